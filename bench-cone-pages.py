@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of heap pages read by cone searches, for each row order
+of ingest-object-catalog.py --row-order.
+
+Without --schemas, the heap is simulated: the objects of each patch
+(each "ref-*.fits" file given, or random patches) are laid out in the
+order being measured, "--rows-per-page" rows to a page, and the pages
+holding the objects found by each cone are counted.
+
+With --schemas, the same cones are searched in the "position" table of
+each schema (loaded with different --row-order) by
+    EXPLAIN (ANALYZE, BUFFERS) SELECT ... WHERE coneSearch(coord, ...)
+and heap blocks and shared buffers accessed are reported.
+"""
+
+import argparse
+import json
+
+import numpy
+
+import lib.common
+import lib.config
+import lib.fits
+import lib.spatialsort
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Measure heap pages read by cone searches for each row order.')
+
+    parser.add_argument('refs', nargs='*',
+                        help='"ref-*.fits" files, each being a patch. Random patches if omitted.')
+    parser.add_argument('--patches', type=int, default=4,
+                        help='Number of random patches (side by side in ra)')
+    parser.add_argument('--objects', type=int, default=50000,
+                        help='Number of objects per random patch')
+    parser.add_argument('--rows-per-page', type=int, default=40,
+                        help='Rows in a heap page (about 8000 / row size in bytes)')
+    parser.add_argument('--radii', type=float, nargs='+', default=[5.0, 30.0, 120.0],
+                        help='Radii of cones in arcsec')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of cones of each radius')
+    parser.add_argument('--schemas', nargs='+',
+                        help='Run the queries on "position" of these schemas instead of simulating')
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+                        help="DB connect parms. Must come after reqd args.")
+
+    args = parser.parse_args()
+
+    patches = read_patches(args.refs) if args.refs else make_patches(args.patches, args.objects)
+    ra = numpy.concatenate([p[0] for p in patches])
+    dec = numpy.concatenate([p[1] for p in patches])
+    print("{} patches, {} objects".format(len(patches), len(ra)))
+
+    rng = numpy.random.RandomState(0)
+    centers = rng.randint(0, len(ra), size=args.queries)
+
+    if args.schemas:
+        if args.db_server:
+            lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in sum(args.db_server, []))
+        bench_db(args.schemas, ra[centers], dec[centers], args.radii)
+    else:
+        bench_simulated(patches, ra[centers], dec[centers], args.radii, args.rows_per_page)
+
+
+def read_patches(paths):
+    """
+    @return (list of (numpy.array, numpy.array))
+        (ra, dec) in degrees of each patch, in catalog order.
+    """
+    patches = []
+    for path in paths:
+        if path.endswith(".gz"):
+            path = path[:-len(".gz")]
+        (ra, dec), flags = lib.fits.BinTable(path).read(["coord_ra", "coord_dec"])
+        patches.append((numpy.degrees(ra), numpy.degrees(dec)))
+    return patches
+
+
+def make_patches(nPatches, nObjects):
+    """
+    Make random patches of 0.2 x 0.2 degrees.
+    Objects are in random order, a pessimistic model of catalog order.
+    @return (list of (numpy.array, numpy.array))
+    """
+    rng = numpy.random.RandomState(1)
+    size = 0.2
+    patches = []
+    for i in range(nPatches):
+        ra = 60.0 + size * (i + rng.uniform(size=nObjects))
+        dec = -30.0 + size * rng.uniform(size=nObjects)
+        patches.append((ra, dec))
+    return patches
+
+
+def to_xyz(ra, dec):
+    ra = numpy.radians(ra)
+    dec = numpy.radians(dec)
+    return numpy.stack([numpy.cos(dec) * numpy.cos(ra), numpy.cos(dec) * numpy.sin(ra), numpy.sin(dec)], axis=-1)
+
+
+def bench_simulated(patches, cra, cdec, radii, rowsPerPage):
+    """
+    Count heap pages in a simulated heap.
+    """
+    centers = to_xyz(cra, cdec)
+
+    for order in ["catalog"] + lib.spatialsort.curves:
+        # Rows of each patch, laid out patch after patch
+        xyz = []
+        for ra, dec in patches:
+            if order != "catalog":
+                permutation = lib.spatialsort.get_order(ra, dec, order)
+                ra, dec = ra[permutation], dec[permutation]
+            xyz.append(to_xyz(ra, dec))
+        xyz = numpy.concatenate(xyz)
+
+        for radius in radii:
+            cosr = numpy.cos(numpy.radians(radius / 3600.0))
+            nObjects = 0
+            nPages = 0
+            for center in centers:
+                rows = numpy.flatnonzero(xyz @ center >= cosr)
+                nObjects += len(rows)
+                nPages += len(numpy.unique(rows // rowsPerPage))
+
+            print("{order:<8} r={radius:6.1f}\" {objects:10.1f} objects {pages:10.1f} pages/query".format(
+                objects=nObjects / len(centers), pages=nPages / len(centers), **locals()))
+
+
+def bench_db(schemas, cra, cdec, radii):
+    """
+    Count heap blocks and buffers accessed by queries in the DB.
+    """
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        for schemaName in schemas:
+            for radius in radii:
+                nObjects = 0
+                nHeap = 0
+                nBuffers = 0
+                for ra, dec in zip(cra, cdec):
+                    cursor.execute("""
+                    EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+                    SELECT object_id FROM "{schemaName}"."position"
+                    WHERE coneSearch(coord, %s, %s, %s)
+                    """.format(**locals()), (float(ra), float(dec), radius))
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    plan = plan[0]["Plan"]
+                    nObjects += plan["Actual Rows"]
+                    nHeap += sum_plan(plan, "Exact Heap Blocks") + sum_plan(plan, "Lossy Heap Blocks")
+                    nBuffers += plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+
+                n = len(cra)
+                print("{schemaName:<16} r={radius:6.1f}\" {objects:10.1f} objects {heap:10.1f} heap blocks {buffers:10.1f} buffers/query".format(
+                    objects=nObjects / n, heap=nHeap / n, buffers=nBuffers / n, **locals()))
+    db.close()
+
+
+def sum_plan(plan, key):
+    """
+    Sum a key of EXPLAIN's plan node and its descendants.
+    """
+    return plan.get(key, 0) + sum(sum_plan(p, key) for p in plan.get("Plans", []))
+
+
+if __name__ == "__main__":
+    main()
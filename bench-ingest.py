@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of ingest-object-catalog.py and ingest-forcedsource.py
+on synthetic catalogs (see lib/synthetic.py).
+
+A rerun of "ref-*.fits" and "forced-*.fits" files, and forced source
+files of visits, are written to a work directory and ingested with the
+functions of the two scripts (read_patch(), transform_patch() and
+copy_patch(); read_visit() and insert_bits()). The seconds of each stage
+are those of the timers of lib.metrics:
+  * discovery:  finding the files (lib.common, ForcedSourceFinder)
+  * read:       read_patch(), read_visit() (which transforms the tables too)
+  * fits_open, fits_read, from_fits, from_hdu:  reading the FITS files
+  * transform:  DBTable.transform(), DbImage.transform()
+  * insert:     copy_patch(), insert_bits()
+  * format:     making COPY data (lib.tsvformat, reordering rows)
+  * copy:       sending COPY data (made as they are sent by lib.pgcopy
+                and pipe_printf) to the database
+Times are inclusive: a stage run within another (fits_read within read)
+is counted in both.
+
+The database (--db) is a throwaway server made by initdb in the work
+directory, the server of lib.config.dbServer, or none, in which case COPY
+data go to a lib.sink.Sink, which discards them. Tables are temporary,
+so nothing is left in a server.
+
+Results are written as JSON, and can be compared with those of a previous
+run (--baseline) to find regressions.
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import importlib
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+import lib.common
+import lib.config
+import lib.metrics
+import lib.sink
+import lib.spatialsort
+import lib.synthetic
+from lib.assumptions import Assumptions
+from lib.forcedsource_finder import ForcedSourceFinder
+
+# Stages taking less than this many seconds are not compared with the baseline
+minComparedSeconds = 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Measure the time of each stage of ingestion on synthetic catalogs.')
+
+    parser.add_argument('--only', choices=["object", "forced"],
+                        help='Run only this benchmark')
+    parser.add_argument('--tracts', type=int, default=1,
+                        help='Number of tracts of the rerun')
+    parser.add_argument('--patches', type=int, default=2,
+                        help='Number of patches in a tract')
+    parser.add_argument('--objects', type=int, default=20000,
+                        help='Number of objects in a patch')
+    parser.add_argument('--bands', default="ugrizy",
+                        help='Bands of the forced catalogs')
+    parser.add_argument('--visits', type=int, default=4,
+                        help='Number of visits')
+    parser.add_argument('--rafts', type=int, default=1,
+                        help='Number of rafts in a visit (each with 9 sensors)')
+    parser.add_argument('--sources', type=int, default=5000,
+                        help='Number of sources in a sensor')
+    parser.add_argument('--compress', action='store_true',
+                        help='Gzip the input files')
+    parser.add_argument('--copy-format', choices=["text", "binary"], default=lib.config.copyFormat,
+                        help='Data format of COPY')
+    parser.add_argument('--row-order', choices=["catalog"] + lib.spatialsort.curves, default="catalog",
+                        help='Order of rows of each patch (ingest-object-catalog.py --row-order)')
+    parser.add_argument('--assumptions', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "config", "forced_source_assumptions.yaml"),
+                        help='Assumptions file of ingest-forcedsource.py')
+    parser.add_argument('--db', choices=["throwaway", "server", "none"], default="none",
+                        help='Database into which to COPY: one made by initdb, '
+                             'that of --db-server, or none (data are discarded)')
+    parser.add_argument('--pg-bin',
+                        help='Directory of initdb and pg_ctl, if not in PATH')
+    parser.add_argument('--work-dir',
+                        help='Directory in which to write the input files (and the throwaway database). '
+                             'A temporary directory, removed at the end, by default')
+    parser.add_argument('--output', default="-",
+                        help='JSON file of the results. "-" for stdout')
+    parser.add_argument('--baseline',
+                        help='JSON file of a previous run to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fraction by which a stage may be slower than the baseline')
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+                        help="DB connect parms. Must come after reqd args.")
+
+    args = parser.parse_args()
+
+    if args.db_server:
+        lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in sum(args.db_server, []))
+
+    lib.config.copyFormat = args.copy_format
+    lib.config.rowOrder = "" if args.row_order == "catalog" else args.row_order
+
+    workDir = args.work_dir or tempfile.mkdtemp(prefix="bench-ingest-")
+    try:
+        # The ingest functions print progress, which must not mix with JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(args, workDir)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+def run(args, workDir):
+    """
+    Make the input files, and run the benchmarks.
+    @return (dict)
+        Results, to be written as JSON.
+    """
+    results = collections.OrderedDict([
+        ("date", datetime.datetime.now().isoformat()),
+        ("host", platform.node()),
+        ("python", platform.python_version()),
+        ("numpy", numpy.__version__),
+        ("cpus", os.cpu_count()),
+        ("parameters", collections.OrderedDict(
+            (key, value) for key, value in sorted(vars(args).items())
+            if key not in ("db_server", "output", "baseline", "work_dir")
+        )),
+        ("benchmarks", collections.OrderedDict()),
+    ])
+
+    if args.db == "throwaway":
+        server = throwaway_server(os.path.join(workDir, "pgdata"), args.pg_bin)
+    else:
+        server = contextlib.ExitStack()
+
+    with server:
+        if args.db == "none":
+            db = lib.sink.Sink()
+        else:
+            db = lib.common.new_db_connection()
+            if args.db == "throwaway":
+                with db.cursor() as cursor:
+                    cursor.execute("CREATE EXTENSION IF NOT EXISTS cube")
+                    cursor.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+
+        try:
+            if args.only in (None, "object"):
+                rerunDir = os.path.join(workDir, "rerun")
+                paths = lib.synthetic.make_rerun(
+                    rerunDir,
+                    tracts=[3830 + i for i in range(args.tracts)],
+                    patches=[(i // lib.synthetic.patchesPerSide) * 100 + i % lib.synthetic.patchesPerSide
+                             for i in range(args.patches)],
+                    bands=list(args.bands), nObjects=args.objects, compress=args.compress)
+                ingest = importlib.import_module("ingest-object-catalog")
+                with db.cursor() as cursor:
+                    results["benchmarks"]["object"] = measure(
+                        paths, cursor, lambda cursor: bench_object(ingest, rerunDir, cursor))
+                db.rollback()
+
+            if args.only in (None, "forced"):
+                visitDir = os.path.join(workDir, "visits")
+                paths = lib.synthetic.make_visits(
+                    visitDir,
+                    visits=[1000 + i for i in range(args.visits)],
+                    bands=list(args.bands),
+                    rafts=["{}{}".format(1 + i // 3, 1 + i % 3) for i in range(args.rafts)],
+                    sensors=["{}{}".format(i // 3, i % 3) for i in range(9)],
+                    nSources=args.sources, compress=args.compress)
+                ingest = importlib.import_module("ingest-forcedsource")
+                with db.cursor() as cursor:
+                    results["benchmarks"]["forced"] = measure(
+                        paths, cursor, lambda cursor: bench_forced(ingest, visitDir, args.assumptions, cursor))
+                db.rollback()
+        finally:
+            db.close()
+
+    results["database"] = args.db
+    return results
+
+
+def measure(paths, cursor, bench):
+    """
+    Run a benchmark.
+    @param paths (list of str)
+        Input files.
+    @param cursor
+        DB connection's cursor object, or lib.sink.Sink.
+    @param bench (callable)
+        bench(cursor) -> number of rows.
+    @return (dict)
+    """
+    lib.metrics.reset()
+    start = time.perf_counter()
+    nRows = bench(cursor)
+    total = time.perf_counter() - start
+    metrics = lib.metrics.snapshot()
+
+    seconds = collections.OrderedDict((name, timer["seconds"]) for name, timer in metrics["timers"].items())
+    seconds["total"] = total
+
+    inputBytes = sum(os.path.getsize(path) for path in paths)
+    return collections.OrderedDict([
+        ("files", len(paths)),
+        ("rows", nRows),
+        ("input_bytes", inputBytes),
+        ("copy_bytes", metrics["counters"].get("copy_bytes", 0)),
+        ("seconds", seconds),
+        ("rows_per_sec", nRows / total if total > 0 else None),
+        ("input_mb_per_sec", inputBytes / 1e6 / total if total > 0 else None),
+    ])
+
+
+def bench_object(ingest, rerunDir, cursor):
+    """
+    Ingest a rerun as insert_patch_into_mastertable() does,
+    without bookkeeping.
+    @param ingest (module)
+        ingest-object-catalog.py
+    @return (int)
+        Number of objects.
+    """
+    with lib.metrics.timer("discovery"):
+        filters = lib.common.get_existing_filters(rerunDir)
+        patches = [(tract, patch, ingest.get_patch_catalog_paths(rerunDir, None, filters, tract, patch))
+                   for tract in lib.common.get_existing_tracts(rerunDir)
+                   for patch in ingest.get_existing_patches(rerunDir, tract)]
+
+    created = set()
+    nRows = 0
+    for tract, patch, catPaths in patches:
+        with lib.metrics.timer("read"):
+            universals, object_id, coord, multibands = ingest.read_patch(rerunDir, tract, patch, catPaths)
+        order = ingest.transform_patch(rerunDir, tract, patch, universals, multibands, coord)
+
+        for table in itertools.chain(universals.values(), (tables[0][0] for tables in multibands.values())):
+            if table.name not in created:
+                table.set_filters(filters)
+                table.create(cursor, "pg_temp")
+                created.add(table.name)
+
+        with lib.metrics.timer("insert"):
+            ingest.copy_patch(cursor, "pg_temp", tract, patch, universals, multibands, object_id, order)
+        nRows += len(object_id)
+
+    return nRows
+
+
+def bench_forced(ingest, rootDir, assumptionsPath, cursor):
+    """
+    Ingest visits as insert_visit() does, without bookkeeping.
+    @param ingest (module)
+        ingest-forcedsource.py
+    @return (int)
+        Number of sources.
+    """
+    with lib.metrics.timer("discovery"):
+        finder = ForcedSourceFinder(rootDir)
+        visitFiles = [finder.get_visit_files(visit) for visit in finder.get_visits()]
+
+    assumptions = Assumptions(assumptionsPath)
+    created = set()
+    nRows = 0
+    for paths in visitFiles:
+        with lib.metrics.timer("read"):
+            bits, tables = ingest.read_visit("pg_temp", finder, assumptions, paths)
+
+        nVisitRows = 0
+        with lib.metrics.timer("insert"):
+            for name, dbimages in tables.items():
+                if name not in created:
+                    dbimages[0].create(cursor, "pg_temp")
+                    created.add(name)
+                nVisitRows = max(nVisitRows, ingest.insert_bits(cursor, "pg_temp", dbimages))
+        nRows += nVisitRows
+
+    return nRows
+
+
+@contextlib.contextmanager
+def throwaway_server(dataDir, binDir=None):
+    """
+    Run a PostgreSQL server of a new cluster, which is removed on exit.
+    lib.config.dbServer is set to connect to it (through a Unix socket
+    in the parent directory of "dataDir").
+    @param dataDir (str)
+        Directory of the cluster, which must not exist.
+    @param binDir (str)
+        Directory of initdb and pg_ctl. Searched in PATH if None.
+    """
+    initdb = shutil.which("initdb", path=binDir)
+    pg_ctl = shutil.which("pg_ctl", path=binDir)
+    if initdb is None or pg_ctl is None:
+        raise RuntimeError("initdb and pg_ctl are not found. Use --pg-bin, or --db=none.")
+
+    socketDir = os.path.dirname(os.path.abspath(dataDir))
+    subprocess.check_call([initdb, "-D", dataDir, "-A", "trust", "-U", "postgres", "--no-sync"],
+                          stdout=subprocess.DEVNULL)
+    subprocess.check_call([pg_ctl, "-D", dataDir, "-w", "-l", dataDir + ".log",
+                           "-o", "-c listen_addresses='' -k {}".format(socketDir), "start"],
+                          stdout=subprocess.DEVNULL)
+    dbServer = lib.config.dbServer
+    lib.config.dbServer = {"host": socketDir, "dbname": "postgres", "user": "postgres"}
+    try:
+        yield
+    finally:
+        lib.config.dbServer = dbServer
+        subprocess.call([pg_ctl, "-D", dataDir, "-w", "-m", "immediate", "stop"],
+                        stdout=subprocess.DEVNULL)
+        shutil.rmtree(dataDir, ignore_errors=True)
+
+
+def compare(baseline, results, tolerance):
+    """
+    Print the time of each stage relative to the baseline.
+    @return (bool)
+        True if any stage is slower than the baseline by more than "tolerance".
+    """
+    regressed = False
+    for name, bench in results["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None:
+            continue
+        for stage, seconds in bench["seconds"].items():
+            oldSeconds = old["seconds"].get(stage)
+            if not oldSeconds or max(seconds, oldSeconds) < minComparedSeconds:
+                continue
+            ratio = seconds / oldSeconds
+            mark = ""
+            if ratio > 1.0 + tolerance:
+                mark = "  REGRESSION"
+                regressed = True
+            print("{name:>8} {stage:>10}: {oldSeconds:8.3f} -> {seconds:8.3f} sec ({ratio:.2f}x){mark}".format(**locals()),
+                  file=sys.stderr)
+    return regressed
+
+
+if __name__ == "__main__":
+    main()
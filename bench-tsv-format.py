@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Microbenchmark of the text formatting for "COPY ... FROM STDIN".
+
+Random columns shaped like a row of the object catalog are formatted
+in three ways, and the outputs are checked to be identical:
+  * zip-numpy:  format % tpl over zip() of numpy arrays
+                (formerly done in pipe_printf when config.MULTICORE)
+  * zip-native: format % tpl over zip() of Python-native values
+                (formerly done when not config.MULTICORE)
+  * tsvformat:  lib.tsvformat.encode()
+"""
+
+import argparse
+import time
+
+import numpy
+
+import lib.tsvformat
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Measure the speed of formatting rows as text for COPY.')
+
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='Number of rows')
+    parser.add_argument('--float32', type=int, default=30,
+                        help='Number of single-precision columns')
+    parser.add_argument('--float64', type=int, default=2,
+                        help='Number of double-precision columns (besides the coordinate)')
+    parser.add_argument('--int', type=int, default=2,
+                        help='Number of integer columns (besides object_id)')
+    parser.add_argument('--flags', type=int, default=20,
+                        help='Number of boolean columns')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Take the best of this many runs')
+
+    args = parser.parse_args()
+
+    format, columns = make_columns(args)
+    print("{} rows, {} columns".format(args.rows, len(columns)))
+
+    methods = [
+        ("zip-numpy",  lambda: b''.join(format % tpl for tpl in zip(*columns))),
+        ("zip-native", lambda: b''.join(format % tpl for tpl in zip(*to_native(columns)))),
+        ("tsvformat",  lambda: b''.join(lib.tsvformat.encode(format, columns))),
+    ]
+
+    reference = None
+    for name, method in methods:
+        best = float("inf")
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            tsv = method()
+            best = min(best, time.perf_counter() - start)
+
+        if reference is None:
+            reference = tsv
+        elif tsv != reference:
+            raise RuntimeError("{}: output differs from zip-numpy".format(name))
+
+        print("{:<12} {:12.0f} rows/s {:8.1f} MB/s".format(
+            name, args.rows / best, len(tsv) / best / 1e6))
+
+
+def make_columns(args):
+    """
+    Make random columns.
+    @return (bytes, list of numpy.array)
+        Row format and columns.
+    """
+    rng = numpy.random.RandomState(0)
+    n = args.rows
+
+    formats = ["%ld", "(%.16e,%.16e,%.16e)"]
+    columns = [numpy.arange(n, dtype=numpy.int64) + (3 << 42)]
+    columns.extend(rng.standard_normal(size=(3, n)) * 180 * 3600 / numpy.pi)
+
+    for i in range(args.float32):
+        column = (rng.standard_normal(n) * 10.0**rng.randint(-10, 10)).astype(numpy.float32)
+        column[rng.uniform(size=n) < 0.1] = numpy.nan
+        formats.append("%.8e")
+        columns.append(column)
+
+    for i in range(args.float64):
+        formats.append("%.16e")
+        columns.append(rng.standard_normal(n))
+
+    for i in range(args.int):
+        formats.append("%ld")
+        columns.append(rng.randint(-1000000, 1000000, size=n).astype(numpy.int32))
+
+    for i in range(args.flags):
+        formats.append("%d")
+        columns.append(rng.uniform(size=n) < 0.5)
+
+    format = ("\t".join(formats) + "\n").encode("utf-8")
+    return format, columns
+
+
+def to_native(columns):
+    """
+    Convert columns to iterators of Python-native values.
+    """
+    ret = []
+    for column in columns:
+        if column.dtype.kind == 'f':
+            ret.append(float(x) for x in column)
+        else:
+            ret.append(int(x) for x in column)
+    return ret
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cross-match a list of positions with the objects of a schema
+in one query (see lib/crossmatch.py).
+
+The input is a whitespace-separated text file with columns
+    id ra dec [radius]
+(ra, dec in degrees, radius in arcsec), and the output, to stdout, is
+    id object_id distance
+for every object within the radius of a position.
+"""
+
+import argparse
+import sys
+import time
+
+import lib.common
+import lib.config
+import lib.crossmatch
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Find the objects around many positions in one query.')
+
+    parser.add_argument('schemaName', help='DB schema name')
+    parser.add_argument('positions',
+                        help='Text file with columns: id ra dec [radius]. "-" for stdin')
+    parser.add_argument('--radius', type=float, default=1.0,
+                        help='Search radius in arcsec, for positions without one')
+    parser.add_argument('--nearest', action='store_true',
+                        help='Output only the nearest object to each position')
+    parser.add_argument('--table-name', default='position',
+                        help='Table searched, with columns "object_id" and "coord"')
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+                        help="DB connect parms. Must come after reqd args.")
+
+    args = parser.parse_args()
+
+    if args.db_server:
+        lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in sum(args.db_server, []))
+
+    if args.positions == "-":
+        ids, ra, dec, radius = lib.crossmatch.read_positions(sys.stdin, args.radius)
+    else:
+        with open(args.positions) as f:
+            ids, ra, dec, radius = lib.crossmatch.read_positions(f, args.radius)
+
+    start = time.time()
+    nMatches = 0
+    db = lib.common.new_db_connection()
+    for id, object_id, distance in lib.crossmatch.crossmatch(
+            db, args.schemaName, ra, dec, radius, ids=ids,
+            nearest=args.nearest, tableName=args.table_name):
+        print("{}\t{}\t{:.6f}".format(id, object_id, distance))
+        nMatches += 1
+    db.rollback()
+    db.close()
+
+    print("{} positions, {} matches in {:.2f} s".format(len(ids), nMatches, time.time() - start),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export the dpdd view of a schema to Parquet files, a file per tract
+(see lib/export.py). Running it again on the same output directory
+exports only the tracts that have changed since.
+"""
+
+import argparse
+import os
+import time
+
+import lib.config
+import lib.export
+from lib.dpdd import DpddView
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Export the dpdd view of a schema to Parquet files, tract by tract.')
+
+    parser.add_argument('schemaName', help='DB schema name')
+    parser.add_argument('outputDir', help='Directory of the Parquet files and the manifest')
+    parser.add_argument('--dpdd-yaml', default=os.getenv('DPDD_YAML'),
+                        help='Directory of nativeobject_to_dpddview.yaml and '
+                             'nativeobject_to_dpddview_postgres.yaml. Defaults to $DPDD_YAML')
+    parser.add_argument('--columns', nargs='+', metavar='COLUMN',
+                        help='Columns of the view to export (lowercase). All columns by default')
+    parser.add_argument('--tracts', type=int, nargs='+',
+                        help='Export only these tracts')
+    parser.add_argument('--jobs', type=int, default=lib.config.scanConnections,
+                        help='Number of tracts exported concurrently')
+    parser.add_argument('--row-group-rows', type=int, default=lib.config.exportRowGroupRows,
+                        help='Rows in a row group of the Parquet files')
+    parser.add_argument('--compression', default='snappy',
+                        help='Compression of the Parquet files (snappy, zstd, gzip, none...)')
+    parser.add_argument('--force', action='store_true',
+                        help='Export tracts even if they have not changed')
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+                        help="DB connect parms. Must come after reqd args.")
+
+    args = parser.parse_args()
+
+    if args.db_server:
+        lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in sum(args.db_server, []))
+
+    if not args.dpdd_yaml:
+        parser.error("--dpdd-yaml or $DPDD_YAML is required")
+
+    view = DpddView(args.schemaName,
+                    yaml_path=os.path.join(args.dpdd_yaml, 'nativeobject_to_dpddview.yaml'),
+                    yaml_override=os.path.join(args.dpdd_yaml, 'nativeobject_to_dpddview_postgres.yaml'))
+
+    start = time.time()
+    tracts = lib.export.export(args.schemaName, view, args.outputDir,
+                               columns=args.columns, tracts=args.tracts,
+                               nConnections=args.jobs, rowGroupRows=args.row_group_rows,
+                               compression=args.compression, force=args.force)
+    print("{} tracts exported in {:.1f} sec".format(len(tracts), time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
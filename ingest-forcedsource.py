@@ -27,7 +27,13 @@ import lib.misc
 import lib.dbtable
 import lib.sourcetable
 import lib.common
+import lib.fastload
+import lib.indexbuilder
 import lib.config
+import lib.metrics
+import lib.pgcopy
+import lib.sink
+import lib.tsvformat
 
 from lib.assumptions import Assumptions
 from lib.forcedsource_finder import ForcedSourceFinder
@@ -36,12 +42,16 @@ from lib.dpdd import DpddView
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
+import atexit
+import collections
 import glob
 import io
 import itertools
+import multiprocessing
 import os
 import re
 import textwrap
+import time
 
 def main():
     import argparse
@@ -75,9 +85,37 @@ def main():
     parser.add_argument('--visits', dest='visits', type=int, nargs='+', 
                         help="Ingest data for specified visits only if present. Else ingest all")
     parser.add_argument('--assumptions', default='forced_source_assumptions.yaml', help="Path to description of prior assumptions about data schema")
+    parser.add_argument('--copy-format', choices=["text", "binary"],
+                        default="text",
+                        help="Format of data sent by COPY. Binary avoids formatting and parsing text")
+
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes inserting visits in parallel")
+    parser.add_argument('--index-jobs', type=int, default=lib.config.indexConnections,
+                        help="Number of connections building indexes and keys in parallel")
+    parser.add_argument('--maintenance-work-mem', default=lib.config.indexMaintenanceWorkMem,
+                        help="maintenance_work_mem of each connection building indexes")
+    parser.add_argument('--fast-load', action='store_true',
+                        help="Create tables UNLOGGED, and set them LOGGED and frozen after all visits are inserted")
+    parser.add_argument('--sink', choices=["db", "null", "file"], default="db",
+                        help="Where to COPY the rows: into the DB, nowhere (null), or into files in --sink-dir. "
+                             "With null or file, the DB is not used, visits are inserted one by one, "
+                             "and rows/sec and MB/sec of each table are reported")
+    parser.add_argument('--sink-dir',
+                        help="Directory of the files of --sink=file")
+    parser.add_argument('--metrics-dir',
+                        help="Write timers, counters and memory high-water marks of each process "
+                             "to JSON lines and Prometheus textfiles in this directory (see lib/metrics.py)")
+    parser.add_argument('--metrics-interval', type=float, default=lib.config.metricsInterval,
+                        help="Seconds between writes of the metrics files")
 
     args = parser.parse_args()
 
+    if args.sink != "db" and (args.dryrun or args.create_keys or args.no_insert):
+        parser.error("--sink cannot be used with --dry-run, --create-keys or --no-insert")
+    if args.sink == "file" and not args.sink_dir:
+        parser.error("--sink=file requires --sink-dir")
+
     if args.visits is not None:
         print("Processing the following visits:")
         for v in args.visits: print(v)
@@ -85,6 +123,21 @@ def main():
     if args.db_server:
         lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in itertools.chain.from_iterable(args.db_server))
 
+    lib.config.copyFormat = args.copy_format
+    lib.config.indexConnections = args.index_jobs
+    lib.config.indexMaintenanceWorkMem = args.maintenance_work_mem
+    # UNLOGGED tables pay only with wal_level = minimal
+    lib.config.unloggedTables = args.fast_load and (
+        args.dryrun or args.sink != "db" or lib.fastload.use_unlogged_tables())
+
+    if args.metrics_dir:
+        lib.metrics.start(args.metrics_dir, "ingest-forcedsource", args.metrics_interval)
+        atexit.register(lib.metrics.stop)
+
+    if lib.config.MULTICORE and lib.config.copyFormat == "text":
+        # Fork the formatters while this process is still small
+        pipe_printf.start()
+
     lib.config.tableSpace = ""
     lib.config.indexSpace = ""
 
@@ -94,6 +147,17 @@ def main():
     if (args.create_keys):
         create_keys(args.schemaname, finder, assumptions, args.dryrun)
         exit(0)
+
+    visits = args.visits if args.visits is not None else finder.get_visits()
+
+    if args.sink != "db":
+        sink = lib.sink.Sink(args.sink_dir if args.sink == "file" else None)
+        start = time.time()
+        insert_visits(args.schemaname, finder, assumptions, visits, False,
+                      sink=sink)
+        for line in sink.report(time.time() - start):
+            print(line)
+        return
     
     something = create_table(args.schemaname, finder, assumptions, 
                              args.dryrun)
@@ -101,8 +165,10 @@ def main():
 
     if args.no_insert: return
 
-    for v in args.visits:
-        insert_visit(args.schemaname, finder, assumptions, v, args.dryrun)
+    insert_visits(args.schemaname, finder, assumptions, visits, args.dryrun,
+                  args.jobs)
+    if args.fast_load:
+        lib.fastload.finish(args.schemaname, args.dryrun)
 
 def create_keys(schema, finder, assumptions, dryrun=True):
     """
@@ -121,20 +187,14 @@ def create_keys(schema, finder, assumptions, dryrun=True):
     """
     dbimages = _get_dbimages(schema, finder, assumptions)
 
+    # Keys of different tables are built concurrently.
+    # (Those of the same table wait for each other's locks.)
+    jobs = []
+    for key,d in dbimages.items():
+        jobs.extend(d.get_primary_jobs())
+        jobs.extend(d.get_foreign_jobs())
 
-    if (dryrun):
-        # print the list
-        for key,d in dbimages.items():
-            d.create_foreign(None)
-            d.create_primary(None)
-        return True
-    else:
-        db = lib.common.new_db_connection()
-        with db.cursor() as cursor:
-            for key,d in dbimages.items():
-                d.create_foreign(cursor)
-                d.create_primary(cursor)
-        db.commit()
+    lib.indexbuilder.build(jobs, dryrun=dryrun)
     return True
 
 def drop_keys(schema, finder, assumptions, dryrun=True):
@@ -282,10 +342,16 @@ def create_view(cursor, schema, dm_schema=3):
                              'nativeforcedsource_to_view.yaml')
     yaml_override = os.path.join(os.getenv('DPDD_YAML'),
                                  'nativeforcedsource_to_view_postgres.yaml')
+    # Object tables with a row per (object_id, band) are joined per band
+    perBandColumns = None
+    if cursor:
+        perBandColumns = lib.dbtable.get_per_band_columns(cursor, schema)
+
     # would be neater to include view table spec in yaml
     view_builder = DpddView(schema,
                             yaml_path=yaml_path,
-                            yaml_override=yaml_override)
+                            yaml_override=yaml_override,
+                            per_band_columns=perBandColumns)
     vs = view_builder.view_string()
     if cursor:
         cursor.execute(vs)
@@ -294,8 +360,143 @@ def create_view(cursor, schema, dm_schema=3):
         print(vs)
 
 
-def insert_visit(schema, finder, assumptions, visit, dryrun=True):
+def insert_visits(schema, finder, assumptions, visits, dryrun=True, jobs=1,
+                  sink=None):
+    """
+    @param  schema       (Postgres) schema name
+    @param  finder       Instance of class which knows how to find schema 
+                         for input data and the data itself
+    @param  assumptions  Instance of class describing columns to be 
+                         included and excluded, among other things
+    @param  visits       list of integer visit numbers
+    @param  dryrun       If true only print out sql.  If false, insert
+                         data for the visits
+    @param  jobs         Number of worker processes. If greater than 1,
+                         visits are distributed over a process pool.
+                         Each visit is still inserted in a transaction
+                         of its own.
+    @param  sink         lib.sink.Sink into which to COPY instead of the DB,
+                         or None. If given, the DB is not used and "jobs"
+                         is ignored.
+    """
+    lib.metrics.set_total("visits", len(visits))
+
+    if sink is not None:
+        for visit in visits:
+            insert_visit(schema, finder, assumptions, visit, False,
+                         inserted=set(), sink=sink)
+            lib.metrics.count("visits")
+        return
+
+    if dryrun:
+        for visit in visits:
+            insert_visit(schema, finder, assumptions, visit, dryrun)
+            lib.metrics.count("visits")
+        return
+
+    # Create the bookkeeping table up front (workers would race to create
+    # it) and read once what has already been inserted.
+    db = lib.common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            create_bit_bookkeeping_table(cursor, schema)
+            inserted = get_inserted_bits(cursor, schema)
+        db.commit()
+    finally:
+        db.close()
+
+    args = [
+        (schema, finder, assumptions, visit, inserted.get(visit, set()))
+        for visit in visits
+    ]
+
+    if jobs <= 1:
+        for a in args:
+            insert_visit(*a[:-1], dryrun=False, inserted=a[-1])
+            lib.metrics.count("visits")
+        return
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # The "fork" method is used so that the workers inherit lib.config
+    # as modified by the command line.
+    workerStats = {}
+    failures = []
+    start = time.time()
+    with multiprocessing.get_context("fork").Pool(jobs, _init_worker) as pool:
+        for pid, visit, nFiles, nRows, dt, error in pool.imap_unordered(_insert_visit_worker, args):
+            lib.metrics.count("visits")
+            if error is not None:
+                lib.metrics.count("failed_visits")
+                failures.append(visit)
+                print("Failed: visit {visit}: {error}".format(**locals()))
+                continue
+
+            stats = workerStats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += nRows
+            stats[2] += dt
+            print("worker {pid}: visit {visit}: {nFiles} files, {nRows} rows in {dt:.1f} sec (worker total {stats[0]} visits, {rate:.0f} rows/sec)".format(
+                rate=stats[1] / stats[2] if stats[2] > 0 else 0.0, **locals()))
+            sys.stdout.flush()
+
+    elapsed = time.time() - start
+    totalRows = sum(stats[1] for stats in workerStats.values())
+    for pid, (nVisits, nRows, busy) in sorted(workerStats.items()):
+        print("worker {pid}: {nVisits} visits, {nRows} rows, {rate:.0f} rows/sec".format(
+            rate=nRows / busy if busy > 0 else 0.0, **locals()))
+    print("{totalRows} rows in {elapsed:.1f} sec ({rate:.0f} rows/sec) with {jobs} workers".format(
+        rate=totalRows / elapsed if elapsed > 0 else 0.0, **locals()))
+
+    if failures:
+        raise RuntimeError("Failed to insert {} visits: {}".format(
+            len(failures), ", ".join(str(v) for v in failures)))
+
+
+def _init_worker():
+    """
+    Initializer of the worker processes of insert_visits().
+    """
+    lib.metrics.reset()
+    if lib.config.MULTICORE and lib.config.copyFormat == "text":
+        pipe_printf.start()
+
+
+def _insert_visit_worker(args):
+    """
+    Process-pool entry point wrapping insert_visit().
+    @param args
+        (schema, finder, assumptions, visit, inserted)
+    @return
+        (pid, visit, number of files, number of rows, seconds,
+         error message or None)
     """
+    schema, finder, assumptions, visit, inserted = args
+    start = time.time()
+    try:
+        nFiles, nRows = insert_visit(schema, finder, assumptions, visit,
+                                     False, inserted)
+        error = None
+    except Exception as e:
+        # The visit's transaction has not been committed,
+        # so nothing of it remains in the DB.
+        nFiles, nRows = 0, 0
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Workers are terminated without notice at the end
+        lib.metrics.emit()
+
+    return os.getpid(), visit, nFiles, nRows, time.time() - start, error
+
+
+def insert_visit(schema, finder, assumptions, visit, dryrun=True,
+                 inserted=None, sink=None):
+    """
+    Insert all sensor files of a visit with one COPY per table,
+    in a single transaction.
     @param  schema       (Postgres) schema name
     @param  finder       Instance of class which knows how to find schema 
                          for input data and the data itself
@@ -304,153 +505,209 @@ def insert_visit(schema, finder, assumptions, visit, dryrun=True):
     @param  visit        integer visit number
     @param  dryrun       If true only print out sql.  If false, insert
                          data for the visit 
+    @param  inserted     set of (raft, sensor) of the visit already
+                         recorded in "_temp:forced_bit".
+                         If None, it is read from the DB.
+    @param  sink         lib.sink.Sink into which to COPY instead of the DB,
+                         or None.
+    @return              (number of files inserted, number of rows)
     """
 
     # Find all data files belonging to the visit.   Many may be of
     # the minimum size which indicates they have no data.  Make a
     # list of the rest.
     visit_files = finder.get_visit_files(visit) 
+    if dryrun:
+        visit_files = visit_files[:3]
+
+    if dryrun:
+        db = None
+    elif sink is not None:
+        db = sink
+    else:
+        db = lib.common.new_db_connection()
+    try:
+        use_cursor = None if dryrun else db.cursor()
+        if inserted is None and not dryrun:
+            create_bit_bookkeeping_table(use_cursor, schema)
+            inserted = get_inserted_bits(use_cursor, schema).get(visit, set())
+
+        bits, tables = read_visit(schema, finder, assumptions, visit_files, inserted)
+        if not bits:
+            return 0, 0
+
+        nRows = 0
+        for dbimages in tables.values():
+            nRows = max(nRows, insert_bits(use_cursor, schema, dbimages))
 
-    use_cursor = None
-    db = lib.common.new_db_connection()
-    with db.cursor() as cursor:
         if not dryrun:
-            use_cursor = cursor
+            # Update bookkeeping table
+            lib.common.execute_prepared(use_cursor, """
+            INSERT INTO "{schema}"."_temp:forced_bit" (visit, raft, sensor)
+            SELECT * FROM unnest($1::Bigint[], $2::int[], $3::int[])
+            """.format(**locals()),
+            tuple(list(column) for column in zip(*bits))
+            )
+            with lib.metrics.timer("commit"):
+                db.commit()
+    finally:
+        if db is not None:
+            # Closing without commit rolls back a partially inserted visit
+            db.close()
 
-        print('using cursor ', str(use_cursor))
-        ifile = 0             #   DEBUG
-        for vf in visit_files:
-            ifile += 1           # DEBUG
-            if dryrun and  ifile > 3: return
-            determiners = finder.get_determiner_dict(vf)
+    return len(bits), nRows
 
-            # Call routine which looks in temp table (creating if need be)
-            # to see if this bit of data has already been processed
-            # Includes cursor argument.  If it is None, routine is no-op
 
-            # Go through essentially same 
-            # procedure as for create_table to determine what columns we're 
-            # looking for and store the column data
-            #
-            hdus = lib.fits.fits_open(vf)  
+def read_visit(schema, finder, assumptions, visit_files, inserted=None):
+    """
+    Read and transform the sensor files of a visit.
+    @param  schema       (Postgres) schema name
+    @param  finder       as in insert_visit()
+    @param  assumptions  as in insert_visit()
+    @param  visit_files  list of paths to the files of the visit
+    @param  inserted     set of (raft, sensor) whose files are skipped, or None
+    @return              (bits, tables): "bits" is the list of
+                         (visit, raft, sensor) read, and "tables" is
+                         OrderedDict mapping name -> list of DbImage,
+                         one per file, to be given to insert_bits()
+    """
+    bits = []
+    tables = collections.OrderedDict()
+    for vf in visit_files:
+        determiners = finder.get_determiner_dict(vf)
+        bit = tuple(int(determiners[k]) for k in ('visit', 'raft', 'sensor'))
+        if inserted and bit[1:] in inserted:
+            continue
+
+        #Read fields which assumptions will use into a SourceTable
+        raw_table = lib.sourcetable.SourceTable.from_fits(
+            vf, assumptions.get_field_filter())
+
+        #  Assumptions class applies 'ignores' to cut it down to what we need
+        #  Maybe also subdivide into multiple tables if so described in yaml
+        remaining_tables = assumptions.apply(raw_table, schema, 
+                                             **determiners)
 
-            #Read fields into a SourceTable
-            raw_table = lib.sourcetable.SourceTable.from_hdu(hdus[1])
+        for name, dbimage in remaining_tables.items():
+            dbimage.transform()
+            tables.setdefault(name, []).append(dbimage)
+        bits.append(bit)
 
-            #  Assumptions class applies 'ignores' to cut it down to what we need
-            #  Maybe also subdivide into multiple tables if so described in yaml
-            remaining_tables = assumptions.apply(raw_table, schema, 
-                                                 **determiners)
+    return bits, tables
 
-            for name in remaining_tables:
-                remaining_tables[name].transform()
-                insert_bit(use_cursor, schema, remaining_tables[name],
-                           **determiners)
-
-            #
-            # The guts of of the insert for object catalog is in 
-            # insert_patch_into_multibandtable.   It
-            #    * assembles a list of column names (called `fieldNames`) an 
-            #      arrays of column data (called `columns`) and generates format
-            #      string (called `format`).   This information all comes from
-            #      the dbtable, plus insertion of tab character between fields
-            #    * If multicore, use pipe_printf.   Write to a pipe, using zip
-            #      to output column-oriented inputs as rows:
-            #           for tpl in zip(*columns):
-            #               fout.write(format % tpl)
-            #       and meanwhile start copying from the pipe to db use copy_from
-            #    * otherwise write the whole thing to an in-memory byte stream,
-            #      then use copy_from on that.
-
-            #   transform
-
-            #   insert
-
-        # End for-loop over files in visit
-        if not dryrun:
-            db.commit()
 
-def insert_bit(use_cursor, schema_name, dbimage, **determiners):
+def insert_bits(use_cursor, schema_name, dbimages):
     """
-    Insert data corresponding to one input file into Postgres
+    Insert data corresponding to several input files into Postgres,
+    in one COPY stream.
     
     @param   use_cursor   db cursor or None (for dryrun)
     @param   schema_name
-    @dbimage DbImage instance
-    @determiners  Uniquely determines this part of the data
+    @param   dbimages     list of DbImage instances of the same table,
+                          one per input file
+    @return  number of rows
     """
-
-    columns = []
-    field_names = []
-    format = ""
-    # For convenience stuff schema_name into determiners
-    determiners['schema_name'] = schema_name
     dryrun = (use_cursor is None)
-    if not dryrun:
-        # create table to keep track of ingest if it doesn't already exist
-        use_cursor.execute("""
-        CREATE TABLE IF NOT EXISTS "{schema_name}"."_temp:forced_bit" (
-          visit   Bigint, 
-          raft int, 
-          sensor int, 
-          unique (visit, raft, sensor)
-        )
-        """.format(**locals())
-        )
-
-        # check if our entry is already there
-        select_q = """
-        SELECT visit FROM "{schema_name}"."_temp:forced_bit" WHERE
-        visit={visit} and raft={raft} and sensor={sensor}
-        """.format(**determiners)
-        use_cursor.execute(select_q)
-        if use_cursor.fetchone() is not None:  # bit is already there
-            return
-        
-    first = True
-    for name, fmt, cols in dbimage.get_backend_field_data(""):
-        columns.extend(cols)
-        field_names.append(name)
-        if first:
-            format = fmt
-            first = False
-        else:
-            format += "\t" + fmt
+    table = '"{}"."{}"'.format(schema_name, dbimages[0].name)
 
-    if dryrun:    # print a piece of the data and exit
-        print("Bit raft={raft}, sensor={sensor}, visit={visit}".format(**determiners))
-        #print("field names: ")
-        all_fields = ' '.join(field_names)
-        print('All fields: ', all_fields)
+    field_names, format, columns = _concatenate_fields(
+        [dbimage.get_backend_field_data("") for dbimage in dbimages])
+    nRows = len(columns[0]) if columns else 0
+    format = "\t".join(format)
 
+    if dryrun:    # print a piece of the data and exit
+        print('All fields: ', ' '.join(field_names))
         print('Format is: \n', format)
-        tsv = ''.join(format % tpl for tpl in zip(*columns))
+        tsv = ''.join(format % tpl + "\n" for tpl in itertools.islice(zip(*columns), 10))
         print('Printing tsv[:600]')
         print(tsv[:600])
-        
-        return
+        return nRows
+
+    # With MULTICORE or binary, rows are formatted while they are sent,
+    # so the time of "copy" includes formatting.
+    if lib.config.copyFormat == "binary":
+        field_names, formats, columns = _concatenate_fields(
+            [dbimage.get_backend_field_binary("") for dbimage in dbimages])
+        with lib.metrics.timer("copy"):
+            nBytes = lib.pgcopy.copy_binary(use_cursor, table, field_names, formats, columns)
+    elif lib.config.MULTICORE:
+        format = (format + "\n").encode("utf-8")
+        with pipe_printf.open(format, *columns) as fin:
+            fin = lib.metrics.CountingReader(fin)
+            with lib.metrics.timer("copy"):
+                use_cursor.copy_from(fin, table, sep='\t', columns=field_names)
+        nBytes = fin.nBytes
+    else:
+        format = (format + "\n").encode("utf-8")
+        with lib.metrics.timer("format"):
+            fin = lib.metrics.CountingReader(io.BytesIO(b''.join(lib.tsvformat.encode(format, columns))))
+        with lib.metrics.timer("copy"):
+            use_cursor.copy_from(fin, table, sep='\t', size=-1, columns=field_names)
+        nBytes = fin.nBytes
 
-    format += "\n"
-    format = format.encode("utf-8")
+    lib.metrics.count("rows", nRows, table=dbimages[0].name)
+    lib.metrics.count("copy_bytes", nBytes, table=dbimages[0].name)
+    return nRows
 
-    if lib.config.MULTICORE:
-        fin = pipe_printf.open(format, *columns)
-        if use_cursor is not None:
-            use_cursor.copy_from(fin,'"{}"."{}"'.format(schema_name,dbimage.name), 
-                                 sep='\t', columns=field_names)
-    else:
-        tsv = b''.join(format % tpl for tpl in zip(*columns))
-        fin = io.BytesIO(tsv)
-        if use_cursor is not None:
-            use_cursor.copy_from(fin, '"{}"."{}"'.format(schema_name,dbimage.name), 
-                                 sep='\t', size=-1, columns=field_names)
-
-    # Update bookkeeping table
-    insert_q = """
-        INSERT INTO "{schema_name}"."_temp:forced_bit"
-        (visit, raft, sensor) values({visit}, {raft}, {sensor})
-        """.format(**determiners)
-    use_cursor.execute(insert_q)
+
+def _concatenate_fields(members_list):
+    """
+    Concatenate the field data of several files.
+    @param members_list
+        list of what DbImage.get_backend_field_data() (or _binary())
+        returns, one per file
+    @return (field names, formats, columns)
+    """
+    first = members_list[0]
+    for members in members_list[1:]:
+        if [(n, f) for n, f, c in members] != [(n, f) for n, f, c in first]:
+            raise RuntimeError("Input files of a visit have different columns")
+
+    field_names = [name for name, fmt, cols in first]
+    formats = [fmt for name, fmt, cols in first]
+    columns = []
+    for i, (name, fmt, cols) in enumerate(first):
+        for j in range(len(cols)):
+            if len(members_list) == 1:
+                columns.append(cols[j])
+            else:
+                columns.append(numpy.concatenate([members[i][2][j] for members in members_list]))
+
+    return field_names, formats, columns
+
+
+def create_bit_bookkeeping_table(cursor, schema_name):
+    """
+    Create the table "_temp:forced_bit" if it does not exist.
+    The table records the (visit, raft, sensor) already inserted.
+    """
+    # Unlogged with the forced source table, which loses its rows together
+    # with this table's in a crash.
+    unlogged = lib.config.get_unlogged()
+    # Once per session, not per visit
+    lib.common.execute_once(cursor, """
+    CREATE {unlogged} TABLE IF NOT EXISTS "{schema_name}"."_temp:forced_bit" (
+      visit   Bigint, 
+      raft int, 
+      sensor int, 
+      unique (visit, raft, sensor)
+    )
+    """.format(**locals())
+    )
+
+
+def get_inserted_bits(cursor, schema_name):
+    """
+    @return dict mapping visit -> set of (raft, sensor) already inserted
+    """
+    cursor.execute("""
+    SELECT visit, raft, sensor FROM "{schema_name}"."_temp:forced_bit"
+    """.format(**locals())
+    )
+    inserted = {}
+    for visit, raft, sensor in cursor:
+        inserted.setdefault(visit, set()).add((raft, sensor))
+    return inserted
 
 def _get_dbimages(schema, finder, assumptions):
     """
@@ -459,10 +716,9 @@ def _get_dbimages(schema, finder, assumptions):
     is sufficient
     """
     afile, determiners = finder.get_some_file()
-    hdus = lib.fits.fits_open(afile)  
-
-    #Read fields into a SourceTable via static method SourceTable.from_hdu
-    raw_table = lib.sourcetable.SourceTable.from_hdu(hdus[1])
+    #Read fields into a SourceTable via static method SourceTable.from_fits
+    raw_table = lib.sourcetable.SourceTable.from_fits(
+        afile, assumptions.get_field_filter())
 
     remaining_tables = assumptions.apply(raw_table, schema, **determiners)
 
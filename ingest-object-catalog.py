@@ -30,19 +30,32 @@ import lib.forced_algos
 import lib.dbtable
 import lib.sourcetable
 import lib.common
+import lib.fastload
+import lib.indexbuilder
 import lib.config
+import lib.metrics
+import lib.partition
+import lib.pipeline
+import lib.sink
+import lib.spatialsort
+import lib.pgcopy
+import lib.tsvformat
 from lib.misc import PoppingOrderedDict
 from lib.dpdd import DpddView
 
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
+import atexit
 import glob
 import io
 import itertools
+import multiprocessing
 import os
 import re
 import textwrap
+import threading
+import time
 
 
 
@@ -86,10 +99,67 @@ def main():
                         default=False)
     parser.add_argument('--tracts', dest='tracts', type=int, nargs='+', 
                         help="Ingest data for specified tracts only if present. Else ingest all")
-    parser.add_argument('--imageRerunDir', default=None, 
+    parser.add_argument('--imageRerunDir', default=None,
                         help="Root dir for finding images; defaults to rerunDir")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes inserting patches in parallel")
+    parser.add_argument('--copy-format', choices=["text", "binary"],
+                        default="text",
+                        help="Format of data sent by COPY. Binary avoids formatting and parsing text")
+    parser.add_argument('--index-jobs', type=int, default=lib.config.indexConnections,
+                        help="Number of connections building indexes and keys in parallel")
+    parser.add_argument('--maintenance-work-mem', default=lib.config.indexMaintenanceWorkMem,
+                        help="maintenance_work_mem of each connection building indexes")
+    parser.add_argument('--fast-load', action='store_true',
+                        help="Create tables UNLOGGED, and set them LOGGED and frozen after all patches are inserted")
+    parser.add_argument('--partition-by-tract', action='store_true',
+                        help="Create tables partitioned by tract. Partitions are created as tracts are inserted")
+    parser.add_argument('--per-band-tables', nargs='+', default=[], metavar='TABLE',
+                        help="Create these multiband tables (e.g. dpdd_forced) with a row per (object_id, band)")
+    parser.add_argument('--row-order', choices=["catalog"] + lib.spatialsort.curves,
+                        default="catalog",
+                        help="Order of rows of each patch: as in the catalog, or along a space-filling curve on the sky")
+    parser.add_argument('--healpix-order', type=int, default=lib.config.healpixOrder,
+                        help="Order of the HEALPix pixel numbers in the \"healpix\" column of the position table")
+    parser.add_argument('--no-gist-index', action='store_true',
+                        help="With --create-index, do not index \"coord\" with GiST; spatial searches use \"healpix\"")
+    parser.add_argument('--replace', action='store_true',
+                        help="Replace patches already inserted, instead of skipping them")
+    parser.add_argument('--drop-tracts', action='store_true',
+                        help="Drop the partitions of the tracts given by --tracts before inserting them again")
+    parser.add_argument('--sink', choices=["db", "null", "file"], default="db",
+                        help="Where to COPY the rows: into the DB, nowhere (null), or into files in --sink-dir. "
+                             "With null or file, the DB is not used, patches are inserted one by one, "
+                             "and rows/sec and MB/sec of each table are reported")
+    parser.add_argument('--sink-dir',
+                        help="Directory of the files of --sink=file")
+    parser.add_argument('--prefetch', type=int, default=lib.config.pipelinePrefetch,
+                        help="Without --jobs, read and transform up to this many patches ahead "
+                             "while one is COPY'ed (0: one patch at a time)")
+    parser.add_argument('--read-threads', type=int, default=lib.config.pipelineReaders,
+                        help="Threads reading patches ahead (see --prefetch)")
+    parser.add_argument('--connections', type=int, default=lib.config.copyConnections,
+                        help="COPY this many patches at a time, on a connection each, "
+                             "from a single process (not with --jobs or --prefetch 0)")
+    parser.add_argument('--max-in-flight-mb', type=float, default=lib.config.pipelineMemory / 2**20,
+                        help="Do not read ahead more patches than this many MB of input files")
+    parser.add_argument('--metrics-dir',
+                        help="Write timers, counters and memory high-water marks of each process "
+                             "to JSON lines and Prometheus textfiles in this directory (see lib/metrics.py)")
+    parser.add_argument('--metrics-interval', type=float, default=lib.config.metricsInterval,
+                        help="Seconds between writes of the metrics files")
     args = parser.parse_args()
 
+    if args.sink != "db" and (args.dryrun or args.create_index or args.no_insert):
+        parser.error("--sink cannot be used with --dry-run, --create-index or --no-insert")
+    if args.sink == "file" and not args.sink_dir:
+        parser.error("--sink=file requires --sink-dir")
+    if args.connections < 1:
+        parser.error("--connections must be at least 1")
+    # Only the pipeline COPYs on several connections
+    if args.connections > 1 and (args.jobs > 1 or args.prefetch <= 0 or args.dryrun):
+        parser.error("--connections cannot be used with --jobs, --prefetch 0 or --dry-run")
+
     if args.tracts is not None:
         print("Processing the following tracts:")
         for t in args.tracts: print(t)
@@ -100,8 +170,48 @@ def main():
     lib.config.tableSpace = args.table_space
     lib.config.indexSpace = args.index_space
     lib.config.withSkymapWcs = args.with_skymap_wcs
+    lib.config.copyFormat = args.copy_format
+    lib.config.indexConnections = args.index_jobs
+    lib.config.indexMaintenanceWorkMem = args.maintenance_work_mem
+    # UNLOGGED tables pay only with wal_level = minimal
+    lib.config.unloggedTables = args.fast_load and (
+        args.dryrun or args.sink != "db" or lib.fastload.use_unlogged_tables())
+    lib.config.partitionByTract = args.partition_by_tract
+    lib.config.perBandTables = set(args.per_band_tables)
+    lib.config.rowOrder = "" if args.row_order == "catalog" else args.row_order
+    lib.config.healpixOrder = args.healpix_order
+    lib.config.gistIndexes = not args.no_gist_index
+    lib.config.pipelinePrefetch = args.prefetch
+    lib.config.pipelineReaders = args.read_threads
+    lib.config.pipelineMemory = int(args.max_in_flight_mb * 2**20)
+    lib.config.copyConnections = args.connections
+
+    if args.metrics_dir:
+        lib.metrics.start(args.metrics_dir, "ingest-object-catalog", args.metrics_interval)
+        atexit.register(lib.metrics.stop)
+
+    if lib.config.MULTICORE and lib.config.copyFormat == "text":
+        # Fork the formatters while this process is still small
+        pipe_printf.start()
 
     filters = lib.common.get_existing_filters(args.rerunDir, hsc=False)
+
+    if args.sink != "db":
+        sink = lib.sink.Sink(args.sink_dir if args.sink == "file" else None)
+        start = time.time()
+        insert_into_mastertable(args.rerunDir, args.schemaName,
+                                args.table_name, filters, False,
+                                args.tracts, replace=args.replace, sink=sink)
+        for line in sink.report(time.time() - start):
+            print(line)
+        return
+
+    # Tables that have been created per band remain so
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        lib.config.perBandTables |= set(lib.dbtable.get_per_band_columns(cursor, args.schemaName))
+    db.close()
+
     if args.create_index:
         create_index_on_mastertable(args.rerunDir, args.schemaName, filters)
     else:
@@ -115,11 +225,17 @@ def main():
             tracts = args.tracts
         else:
             tracts = None
+        if args.drop_tracts:
+            if not tracts:
+                raise RuntimeError("--drop-tracts requires --tracts")
+            drop_tracts(args.schemaName, tracts, args.dryrun)
         if not args.no_insert:
             print("invoking insert_into_mastertable")
-            insert_into_mastertable(args.rerunDir, args.schemaName, 
+            insert_into_mastertable(args.rerunDir, args.schemaName,
                                     args.table_name, filters, args.dryrun,
-                                    tracts)
+                                    tracts, args.jobs, args.replace)
+            if args.fast_load:
+                lib.fastload.finish(args.schemaName, args.dryrun)
 
 def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, 
                                      filters, dryrun, imageRerunDir):
@@ -165,12 +281,18 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
         if bNeedCreating:
             with db.cursor() as cursor:
                 cursor.execute(create_schema_string)
-                dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
+                dm_schema, perBandColumns = create_mastertable(cursor, rerunDir, schemaName, 
                                                masterTableName, filters,
                                                imageRerunDir)
-                create_view(cursor, schemaName, dm_schema)
+                create_view(cursor, schemaName, dm_schema, perBandColumns)
+                record_healpix_order(cursor, schemaName)
             db.commit()
         else:
+            # Tables may have been created before the column "healpix" existed
+            with db.cursor() as cursor:
+                add_healpix_column(cursor, schemaName)
+                record_healpix_order(cursor, schemaName)
+            db.commit()
             if bNeedView:
                 tract, patch, filter = get_an_existing_catalog_id(rerunDir, 
                                                                   schemaName)
@@ -191,19 +313,67 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
             print("Would execute: ")
             print(create_schema_string)
             cursor = None
-            dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
+            dm_schema, perBandColumns = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, schemaName, dm_schema, perBandColumns)
         else:
             print("Master table already exists")
             print("pretend create anyway:")
             print(create_schema_string)
             cursor = None
-            dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
+            dm_schema, perBandColumns = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, schemaName, dm_schema, perBandColumns)
+
+def add_healpix_column(cursor, schemaName):
+    """
+    Add the column "healpix" to the position table of a schema created
+    before it existed. The column of the rows already inserted is NULL.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    cursor.execute("""
+    ALTER TABLE "{schemaName}"."position" ADD COLUMN IF NOT EXISTS healpix Bigint
+    """.format(**locals())
+    )
+
+
+def record_healpix_order(cursor, schemaName):
+    """
+    Record config.healpixOrder as the order of the column "healpix" of
+    a schema in "public.healpix_orders", which healpixConeSearch() and
+    healpixBoxSearch() read when not given the order.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS public.healpix_orders (
+        schema_name     Text    PRIMARY KEY,
+        healpix_order   Integer NOT NULL
+    )
+    """
+    )
+    cursor.execute("""
+    SELECT healpix_order FROM public.healpix_orders WHERE schema_name = %s
+    """, (schemaName,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("""
+        INSERT INTO public.healpix_orders (schema_name, healpix_order) VALUES (%s, %s)
+        """, (schemaName, lib.config.healpixOrder)
+        )
+    elif row[0] != lib.config.healpixOrder:
+        raise RuntimeError("{schemaName} has been loaded with --healpix-order {order}, not {lib.config.healpixOrder}"
+                           .format(order=row[0], **locals()))
+
+
 def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
                        imageRerunDir):
     """
@@ -221,6 +391,9 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
         Name of the master table
     @param filters
         List of filter names
+    @return (dm_schema, perBandColumns)
+        DM schema version, and the columns of per-band tables
+        (See DpddView.)
     """
 
     if imageRerunDir == None: imageRerunDir = rerunDir
@@ -245,12 +418,22 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
     for table in itertools.chain(universals.values(), multibands.values()):
         table.create(cursor, schemaName)
 
-    return dm_schema
+    perBandColumns = {
+        table.name: [
+            name.lower()
+            for algo in table.algos.values()
+            for name, type in algo.get_backend_fields("")
+        ]
+        for table in multibands.values()
+        if isinstance(table, lib.dbtable.DBTable_PerBand)
+    }
+
+    return dm_schema, perBandColumns
 
     #  OMIT old view code,including table comment. We have no old-style views
 
 
-def create_view(cursor, schemaName, dm_schema):
+def create_view(cursor, schemaName, dm_schema, perBandColumns=None):
     """
     Creates dpdd view.
     @param cursor
@@ -260,14 +443,20 @@ def create_view(cursor, schemaName, dm_schema):
     @param dm_schema
        dm table schema version used to produce the data.  Naming conventions
        for native quantities vary somewhat depending on this version
-
+    @param perBandColumns
+       Columns of tables with a row per (object_id, band). See DpddView.
+       If None, they are looked up in the DB.
     """
+    if perBandColumns is None and cursor:
+        perBandColumns = lib.dbtable.get_per_band_columns(cursor, schemaName)
+
     yaml_path = os.path.join(os.getenv('DPDD_YAML'),'nativeobject_to_dpddview.yaml')
     yaml_override = os.path.join(os.getenv('DPDD_YAML'),
                                  'nativeobject_to_dpddview_postgres.yaml')
     view_builder = DpddView(schemaName, yaml_path=yaml_path,
                             yaml_override=yaml_override,
-                            dm_schema_version=int(dm_schema))
+                            dm_schema_version=int(dm_schema),
+                            per_band_columns=perBandColumns)
     vs = view_builder.view_string()
     if cursor:
         cursor.execute(vs)
@@ -277,7 +466,7 @@ def create_view(cursor, schemaName, dm_schema):
 
 
 def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
-                            dryrun, tracts):
+                            dryrun, tracts, jobs=1, replace=False, sink=None):
     """
     Insert data into tables.
     @param rerunDir
@@ -293,6 +482,19 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
     @param tracts
         If present (not None) insert data only from specified tracts. Else
         insert data from all tracts
+    @param jobs
+        Number of worker processes. If greater than 1, (tract, patch) pairs
+        are distributed over a process pool. Each patch is still inserted
+        in a transaction of its own.
+    @param replace
+        If True, patches already inserted are replaced.
+        See insert_patch_into_mastertable().
+    @param sink
+        lib.sink.Sink into which to COPY instead of the DB, or None.
+        If given, the DB is not used and "jobs" is ignored.
+
+    With one job (or a sink), the patches are inserted by
+    insert_patches_pipelined() unless config.pipelinePrefetch is 0.
     """
     all_tracts = lib.common.get_existing_tracts(rerunDir)
     our_tracts = []
@@ -302,14 +504,268 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
         for t in tracts:
             if t in all_tracts: our_tracts.append(t)
 
-    for tract in our_tracts:
-        for patch in get_existing_patches(rerunDir, tract):
-            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun)
+    units = [
+        (tract, patch)
+        for tract in our_tracts
+        for patch in get_existing_patches(rerunDir, tract)
+    ]
+    lib.metrics.set_total("patches", len(units))
+
+    if sink is None:
+        # Partitions are created here, not by the workers inserting patches:
+        # creating a partition locks its parent table against the insertions.
+        db = lib.common.new_db_connection()
+        with db.cursor() as cursor:
+            partitioned = lib.partition.get_partitioned_tables(cursor, schemaName)
+            lib.partition.create_tract_partitions(cursor, schemaName, partitioned,
+                sorted(set(tract for tract, patch in units)), dryrun)
+        db.commit()
+        db.close()
+
+    if sink is not None:
+        jobs = 1
+
+    if dryrun or (jobs <= 1 and lib.config.pipelinePrefetch <= 0):
+        for tract, patch in units:
+            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun, replace, sink)
+            lib.metrics.count("patches")
+        return
 
-def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun):
+    if jobs <= 1:
+        insert_patches_pipelined(rerunDir, schemaName, filters, units, replace, sink)
+        return
+
+    # Workers would race to create the bookkeeping table.
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        create_patch_bookkeeping_table(cursor, schemaName)
+    db.commit()
+    db.close()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    args = [
+        (rerunDir, schemaName, masterTableName, filters, tract, patch, replace)
+        for tract, patch in units
+    ]
+
+    # The "fork" method is used so that the workers inherit lib.config
+    # as modified by the command line.
+    # Each worker starts its own formatters before reading any catalog.
+    workerStats = {}
+    failures = []
+    start = time.time()
+    with multiprocessing.get_context("fork").Pool(jobs, _init_worker) as pool:
+        for pid, tract, patch, nRows, dt, error in pool.imap_unordered(_insert_patch_worker, args):
+            lib.metrics.count("patches")
+            if error is not None:
+                lib.metrics.count("failed_patches")
+                failures.append((tract, patch))
+                print("Failed: (tract,patch) = ({tract}, {patch}): {error}".format(**locals()))
+                continue
+
+            stats = workerStats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += nRows
+            stats[2] += dt
+            print("worker {pid}: (tract,patch) = ({tract}, {patch}): {nRows} rows in {dt:.1f} sec (worker total {stats[0]} patches, {rate:.0f} rows/sec)".format(
+                rate=stats[1] / stats[2] if stats[2] > 0 else 0.0, **locals()))
+            sys.stdout.flush()
+
+    elapsed = time.time() - start
+    totalRows = sum(stats[1] for stats in workerStats.values())
+    for pid, (nPatches, nRows, busy) in sorted(workerStats.items()):
+        print("worker {pid}: {nPatches} patches, {nRows} rows, {rate:.0f} rows/sec".format(
+            rate=nRows / busy if busy > 0 else 0.0, **locals()))
+    print("{totalRows} rows in {elapsed:.1f} sec ({rate:.0f} rows/sec) with {jobs} workers".format(
+        rate=totalRows / elapsed if elapsed > 0 else 0.0, **locals()))
+
+    if failures:
+        raise RuntimeError("Failed to insert {} patches: {}".format(
+            len(failures), ", ".join("({}, {})".format(*f) for f in failures)))
+
+
+def insert_patches_pipelined(rerunDir, schemaName, filters, units, replace=False, sink=None):
+    """
+    Insert patches as insert_patch_into_mastertable() does, each in a
+    transaction of its own, but in a pipeline (see lib.pipeline):
+    while patches are COPY'ed, the next is transformed, and up to
+    config.pipelinePrefetch patches after are read, by
+    config.pipelineReaders threads, as long as the input files of the
+    patches in flight do not exceed config.pipelineMemory bytes.
+    Patches already inserted are skipped without being read.
+
+    Patches are COPY'ed concurrently on config.copyConnections
+    connections, by a thread each, so that the server's backends
+    parse and insert rows in parallel while the client process keeps
+    a single copy of its memory (unlike --jobs).
+    @param rerunDir
+        Path to the rerun directory
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param filters
+        List of filter names
+    @param units
+        List of (tract, patch) to insert.
+    @param replace
+        If True, patches already inserted are replaced.
+    @param sink
+        lib.sink.Sink into which to COPY instead of the DB, or None.
+    """
+    # Connections of the COPY threads
+    connections = []
+    threadLocal = threading.local()
+    lock = threading.Lock()
+
+    def get_connection():
+        db = getattr(threadLocal, "db", None)
+        if db is None:
+            db = lib.common.new_db_connection() if sink is None else sink
+            threadLocal.db = db
+            with lock:
+                connections.append(db)
+        return db
+
+    db = lib.common.new_db_connection() if sink is None else sink
+    try:
+        inserted = {}
+        if sink is None:
+            with db.cursor() as cursor:
+                create_patch_bookkeeping_table(cursor, schemaName)
+                if not replace:
+                    inserted = get_inserted_patches(cursor, schemaName)
+            db.commit()
+
+        items = []
+        for tract, patch in units:
+            catPaths = get_patch_catalog_paths(rerunDir, schemaName, filters, tract, patch)
+            fileId, minFileId, maxFileId = get_patch_file_ids(tract, patch, catPaths.keys())
+            if inserted.get(tract*10000 + patch) == fileId:
+                lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+                lib.metrics.count("patches")
+                continue
+            items.append((tract, patch, catPaths))
+
+        def sizeof(item):
+            tract, patch, catPaths = item
+            paths = [get_ref_path(rerunDir, tract, patch)] + list(catPaths.values())
+            return sum(lib.fits.get_file_size(path) for path in paths)
+
+        def read(item):
+            tract, patch, catPaths = item
+            return item + read_patch(rerunDir, tract, patch, catPaths)
+
+        def transform(data):
+            tract, patch, catPaths, universals, object_id, coord, multibands = data
+            return data + (transform_patch(rerunDir, tract, patch, universals, multibands, coord),)
+
+        totalRows = [0]
+
+        def copy(data):
+            tract, patch, catPaths, universals, object_id, coord, multibands, order = data
+            db = get_connection()
+            try:
+                with db.cursor() as cursor:
+                    if sink is None:
+                        if replace:
+                            replace_patch_bookkeeping(cursor, schemaName, tract, patch, catPaths.keys())
+                        elif is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
+                            lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+                            db.commit()
+                            lib.metrics.count("patches")
+                            return
+                    copy_patch(cursor, schemaName, tract, patch, universals, multibands, object_id, order, replace)
+                with lib.metrics.timer("commit"):
+                    db.commit()
+            except Exception:
+                # Nothing of the patch remains in the DB
+                db.rollback()
+                raise
+
+            lib.metrics.count("patches")
+            with lock:
+                totalRows[0] += len(object_id)
+                print("(tract,patch) = ({tract}, {patch}): {nRows} rows".format(nRows=len(object_id), **locals()))
+                sys.stdout.flush()
+
+        start = time.time()
+        failures = lib.pipeline.run(
+            items,
+            [("read", read, lib.config.pipelineReaders), ("transform", transform, 1),
+             ("copy", copy, max(1, lib.config.copyConnections))],
+            queueSize=lib.config.pipelinePrefetch,
+            memoryCap=lib.config.pipelineMemory,
+            sizeof=sizeof,
+        )
+        elapsed = time.time() - start
+    finally:
+        for connection in connections:
+            connection.close()
+        db.close()
+
+    nRows = totalRows[0]
+    print("{nRows} rows in {elapsed:.1f} sec ({rate:.0f} rows/sec)".format(
+        rate=nRows / elapsed if elapsed > 0 else 0.0, **locals()))
+
+    for (tract, patch, catPaths), e in failures:
+        lib.metrics.count("patches")
+        lib.metrics.count("failed_patches")
+        print("Failed: (tract,patch) = ({tract}, {patch}): {error}".format(
+            error="{}: {}".format(type(e).__name__, e), **locals()))
+
+    if failures:
+        raise RuntimeError("Failed to insert {} patches: {}".format(
+            len(failures), ", ".join("({}, {})".format(tract, patch) for (tract, patch, catPaths), e in failures)))
+
+
+def _init_worker():
+    """
+    Initializer of the worker processes of insert_into_mastertable().
+    """
+    lib.metrics.reset()
+    if lib.config.MULTICORE and lib.config.copyFormat == "text":
+        pipe_printf.start()
+
+
+def _insert_patch_worker(args):
+    """
+    Process-pool entry point wrapping insert_patch_into_mastertable().
+    @param args
+        (rerunDir, schemaName, masterTableName, filters, tract, patch, replace)
+    @return
+        (pid, tract, patch, number of rows, seconds, error message or None)
+    """
+    rerunDir, schemaName, masterTableName, filters, tract, patch, replace = args
+    start = time.time()
+    try:
+        nRows = insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, False, replace)
+        error = None
+    except Exception as e:
+        # The patch's transaction has not been committed,
+        # so nothing of it remains in the DB.
+        nRows = 0
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Workers are terminated without notice at the end
+        lib.metrics.emit()
+
+    return os.getpid(), tract, patch, nRows, time.time() - start, error
+
+
+def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch, dryrun, replace=False, sink=None):
     """
     Insert a specific patch into the master table.
     The data will actually flow not into the master table but into its children.
+    All tables of the patch are inserted in a single transaction.
+
+    If "replace" is True, the patch is inserted even if it has already been
+    inserted (with whatever filters). It is then first COPY'ed into temporary
+    staging tables, and only then are the old rows of the patch deleted
+    and the new ones moved in, so the old rows remain visible to queries
+    until the transaction commits.
     @param rerunDir
         Path to the rerun directory from which to generate the master table
     @param schemaName
@@ -324,6 +780,50 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
         Patch number (x*100 + y)
     @param dryrun
         If True just print commands rather than executing
+    @param replace
+        If True, replace the patch if it has already been inserted.
+    @param sink
+        lib.sink.Sink into which to COPY instead of the DB, or None.
+        The patch is then not looked up in the bookkeeping table.
+    @return
+        Number of objects inserted (0 if the patch has already been inserted)
+    """
+    catPaths = get_patch_catalog_paths(rerunDir, schemaName, filters, tract, patch)
+
+    db = lib.common.new_db_connection() if sink is None else sink
+    try:
+        with db.cursor() as cursor:
+            if sink is not None:
+                use_cursor = cursor
+            elif not dryrun:
+                use_cursor = cursor
+                if replace:
+                    replace_patch_bookkeeping(cursor, schemaName, tract, patch, catPaths.keys())
+                elif is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
+                    lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+                    return 0
+            else:
+                use_cursor = None
+
+            universals, object_id, coord, multibands = read_patch(rerunDir, tract, patch, catPaths)
+            order = transform_patch(rerunDir, tract, patch, universals, multibands, coord)
+            copy_patch(use_cursor, schemaName, tract, patch, universals, multibands, object_id, order, replace)
+
+        if not dryrun:
+            with lib.metrics.timer("commit"):
+                db.commit()
+    finally:
+        # Closing without commit rolls back a partially inserted patch
+        db.close()
+
+    return len(object_id)
+
+
+def get_patch_catalog_paths(rerunDir, schemaName, filters, tract, patch):
+    """
+    @return (dict)
+        Filter -> path to the multiband catalog of the patch, for the
+        filters whose catalogs exist.
     """
     catPaths = {}
 
@@ -333,43 +833,92 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
         if lib.common.path_exists(catPath):
             catPaths[filter] = catPath
 
-    db = lib.common.new_db_connection()
-    with db.cursor() as cursor:
-        if not dryrun:
-            use_cursor = cursor
-            if is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
-                lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
-                return
-        else:
-            use_cursor = None
+    return catPaths
 
-        refPath = get_ref_path(rerunDir, tract, patch)
-        universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
 
-        for table in itertools.chain(universals.values()):
-            table.transform(rerunDir, tract, patch, "", coord)
+def read_patch(rerunDir, tract, patch, catPaths):
+    """
+    Read the catalogs of a patch.
+    @param rerunDir
+        Path to the rerun directory
+    @param tract
+        Tract number.
+    @param patch
+        Patch number (x*100 + y)
+    @param catPaths
+        Filter -> path to the multiband catalog. See get_patch_catalog_paths().
+    @return (universals, object_id, coord, multibands)
+        * "universals" is PoppingOrderedDict mapping name -> DBTable
+          (See get_ref_schema_from_file()),
+        * "object_id" is a numpy.array of object_id,
+        * "coord" is {"ra": numpy.array, "dec": numpy.array},
+        * "multibands" is dict mapping name -> list of (DBTable, filter).
+        No table has been transformed yet.
+    """
+    refPath = get_ref_path(rerunDir, tract, patch)
+    universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
 
-        multibands = {}
-        for filter, catPath in catPaths.items():
-            for table in get_catalog_schema_from_file(catPath, object_id).values():
-                table.transform(rerunDir, tract, patch, filter, coord)
+    multibands = {}
+    for filter, catPath in catPaths.items():
+        for table in get_catalog_schema_from_file(catPath, object_id).values():
+            if table.name not in multibands:
+                multibands[table.name] = []
+            multibands[table.name].append((table, filter))
 
-                if table.name not in multibands:
-                    multibands[table.name] = []
-                multibands[table.name].append((table, filter))
+    return universals, object_id, coord, multibands
 
-        for table in universals.values():
-            insert_patch_into_universaltable(use_cursor, schemaName, table, 
-                                             object_id)
-        for tables in multibands.values():
-            insert_patch_into_multibandtable(use_cursor, schemaName, tables, 
-                                             object_id)
 
-    if not dryrun:
-        db.commit()
+def transform_patch(rerunDir, tract, patch, universals, multibands, coord):
+    """
+    Transform the tables of a patch read by read_patch().
+    @return
+        None, or numpy.array of indices in which to send the rows
+        (See insert_patch_into_multibandtable()).
+    """
+    for table in itertools.chain(universals.values()):
+        table.transform(rerunDir, tract, patch, "", coord)
 
+    for tables in multibands.values():
+        for table, filter in tables:
+            table.transform(rerunDir, tract, patch, filter, coord)
 
-def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
+    # All tables of the patch are sorted in the same order
+    order = None
+    if lib.config.rowOrder:
+        order = lib.spatialsort.get_order(coord["ra"], coord["dec"], lib.config.rowOrder)
+
+    return order
+
+
+def copy_patch(cursor, schemaName, tract, patch, universals, multibands, object_id, order, replace=False):
+    """
+    COPY the tables of a patch transformed by transform_patch().
+    @param cursor
+        DB connection's cursor object. If None just pretend.
+    @param replace
+        If True, replace the rows of the patch through staging tables.
+        See insert_patch_into_mastertable().
+    """
+    # Tables into which to COPY
+    copySchemaName = schemaName
+    if replace:
+        copySchemaName = "pg_temp"
+        for name in itertools.chain(universals.keys(), multibands.keys()):
+            create_staging_table(cursor, schemaName, name)
+
+    for table in universals.values():
+        insert_patch_into_universaltable(cursor, copySchemaName, table,
+                                         object_id, order)
+    for tables in multibands.values():
+        insert_patch_into_multibandtable(cursor, copySchemaName, tables,
+                                         object_id, order=order)
+
+    if replace:
+        for name in itertools.chain(universals.keys(), multibands.keys()):
+            replace_patch_rows(cursor, schemaName, name, tract, patch, object_id)
+
+
+def insert_patch_into_universaltable(cursor, schemaName, table, object_id, order=None):
     """
     Insert a patch into a universal table.
     'Universal' means 'Its contents are universal to all bands.'
@@ -381,10 +930,12 @@ def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
         DBTable_BandIndependent object
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param order
+        If not None, permutation of rows. See insert_patch_into_multibandtable().
     """
-    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id)
+    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id, order=order)
 
-def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
+def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id, band=None, order=None):
     """
     Insert a patch into a multiband table.
     @param cursor
@@ -397,10 +948,56 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
         with different colors.
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param band
+        Short filter name to put in the "band" column.
+        Given (by this function itself) for DBTable_PerBand only.
+    @param order
+        If not None, numpy.array of indices in which to send the rows
+        (See lib.spatialsort).
     """
+    if band is None and isinstance(tables[0][0], lib.dbtable.DBTable_PerBand):
+        # A row per (object_id, band): each band is COPY'ed by itself.
+        for table, filter in tables:
+            band = lib.common.filterToShortName[filter]
+            if len(band.encode("utf-8")) != 1:
+                raise RuntimeError("Band name too long for a per-band table: " + band)
+            insert_patch_into_multibandtable(cursor, schemaName, [(table, filter)], object_id, band, order)
+        return
+
+    if lib.config.copyFormat == "binary":
+        columns = [ object_id ]
+        fieldNames = [ "object_id" ]
+        formats = [ "int8" ]
+        if band is not None:
+            columns.append(numpy.full(len(object_id), band.encode("utf-8"), dtype="S1"))
+            fieldNames.append("band")
+            formats.append("char")
+
+        for table, filter in tables:
+            for name, fmt, cols in table.get_backend_field_binary(filter):
+                columns.extend(cols)
+                fieldNames.append(name)
+                formats.append(fmt)
+
+        if order is not None:
+            with lib.metrics.timer("format"):
+                columns = [column[order] for column in columns]
+
+        if cursor is not None:
+            with lib.metrics.timer("copy"):
+                nBytes = lib.pgcopy.copy_binary(cursor, '"{}"."{}"'.format(schemaName, table.name),
+                                                fieldNames, formats, columns)
+            lib.metrics.count("rows", len(object_id), table=table.name)
+            lib.metrics.count("copy_bytes", nBytes, table=table.name)
+        return
+
     columns = [ object_id ]
     fieldNames = [ "object_id" ]
     format = "%ld"
+    if band is not None:
+        # The band is the same in every row
+        fieldNames.append("band")
+        format += "\t" + band
 
     for table, filter in tables:
         for name, fmt, cols in table.get_backend_field_data(filter):
@@ -411,17 +1008,101 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
     format += "\n"
     format = format.encode("utf-8")
 
+    if order is not None:
+        with lib.metrics.timer("format"):
+            columns = [column[order] for column in columns]
+
+    # With MULTICORE, rows are formatted while they are sent,
+    # so the time of "copy" includes formatting.
     if lib.config.MULTICORE:
-        fin = pipe_printf.open(format, *columns)
+        with pipe_printf.open(format, *columns) as fin:
+            if cursor is not None:
+                fin = lib.metrics.CountingReader(fin)
+                with lib.metrics.timer("copy"):
+                    cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+                                     sep='\t', columns=fieldNames)
+    else:
+        with lib.metrics.timer("format"):
+            tsv = b''.join(lib.tsvformat.encode(format, columns))
+        fin = lib.metrics.CountingReader(io.BytesIO(tsv))
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
-                             sep='\t', columns=fieldNames)
+            with lib.metrics.timer("copy"):
+                cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+                                 sep='\t', size=-1, columns=fieldNames)
+
+    if cursor is not None:
+        lib.metrics.count("rows", len(object_id), table=table.name)
+        lib.metrics.count("copy_bytes", fin.nBytes, table=table.name)
+
+
+def create_staging_table(cursor, schemaName, tableName):
+    """
+    Create a temporary table, dropped at commit, into which to COPY
+    a patch to replace. See replace_patch_rows().
+    @param cursor
+        DB connection's cursor object. If None just print.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tableName
+        Name of the table to replace rows of.
+        The temporary table has the same name.
+    """
+    statement = """
+    CREATE TEMPORARY TABLE "{tableName}" (
+        LIKE "{schemaName}"."{tableName}"
+    )
+    ON COMMIT DROP
+    """.format(**locals())
+
+    if cursor is not None:
+        cursor.execute(statement)
+    else:
+        print(statement)
+
+
+def replace_patch_rows(cursor, schemaName, tableName, tract, patch, object_id):
+    """
+    Replace the rows of a patch in a table with those in the staging table.
+    @param cursor
+        DB connection's cursor object. If None just print.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tableName
+        Name of the table
+    @param tract
+        Tract number.
+    @param patch
+        Patch number (x*100 + y)
+    @param object_id
+        numpy.array of object ID in the staging table.
+    """
+    lower, upper = lib.partition.get_patch_bounds(tract, patch)
+    if len(object_id) == 0 or (lower <= numpy.min(object_id) and numpy.max(object_id) < upper):
+        # Old rows are deleted even if they are not in the new catalog.
+        # The range of object_id is in the only partition of the tract,
+        # if the table is partitioned.
+        delete = """
+        DELETE FROM "{schemaName}"."{tableName}"
+        WHERE object_id >= {lower} AND object_id < {upper}
+        """.format(**locals())
     else:
-        tsv = b''.join(format % tpl for tpl in zip(*columns))
-        fin = io.BytesIO(tsv)
+        # object_id is not encoded as (tract, patch, counter)
+        delete = """
+        DELETE FROM "{schemaName}"."{tableName}" AS t
+        USING pg_temp."{tableName}" AS s
+        WHERE t.object_id = s.object_id
+        """.format(**locals())
+
+    insert = """
+    INSERT INTO "{schemaName}"."{tableName}"
+    SELECT * FROM pg_temp."{tableName}"
+    """.format(**locals())
+
+    for statement in [delete, insert]:
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
-                             sep='\t', size=-1, columns=fieldNames)
+            cursor.execute(statement)
+        else:
+            print(statement)
 
 
 def create_index_on_mastertable(rerunDir, schemaName, filters):
@@ -446,17 +1127,26 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
 
+    # Indexes of partitioned tables are built partition by partition,
+    # and then attached to the indexes of the partitioned tables.
+    jobs = []
+    parentJobs = []
     db = lib.common.new_db_connection()
     with db.cursor() as cursor:
+        add_healpix_column(cursor, schemaName)
+        db.commit()
         for table in itertools.chain(universals.values(), multibands.values()):
-            if ('position' in table.name):
-                table.set_dbconnection(db)
-                table.create_index(cursor, schemaName)
-                table.set_dbconnection(None)
-            else:
-                table.create_index(cursor, schemaName)
-                db.commit()
-    #db.commit()
+            partitions = lib.partition.get_partitions(cursor, schemaName, table.name)
+            if partitions is None:
+                jobs.extend(table.get_index_jobs(schemaName))
+                continue
+            for partition in partitions:
+                jobs.extend(table.get_index_jobs(schemaName, partition))
+            parentJobs.extend(table.get_index_jobs(schemaName, partitioned=True))
+    db.close()
+
+    lib.indexbuilder.build(jobs)
+    lib.indexbuilder.build(parentJobs)
 
 
 def drop_index_from_mastertable(rerunDir, schemaName, filters):
@@ -501,7 +1191,9 @@ def get_ref_schema_from_file(path):
             in which angles are in degrees.
         * "dm_schema_version" Value of 'AFW_TABLE_VERSION' keyword
     """
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    keep = lib.forced_algos.get_field_filter(
+        lib.forced_algos.ref_algos, lib.forced_algos.ref_algos_ignored)
+    table = lib.sourcetable.SourceTable.from_fits(path, keep)
 
     dm_schema_version = table.dm_schema_version()
 
@@ -584,99 +1276,116 @@ def get_ref_schema_from_file(path):
 
     return dbtables, object_id, coord, dm_schema_version
 
+# Building a GiST index costs roughly this many times as much as a btree one
+# on the same table (see lib.indexbuilder.IndexJob)
+_gistWeight = 4.0
+
 # Changes to accommodate leaving field 'parent' as is (no change to 'parent_id')
 class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
-    def __init__(self, name, algos):
-        super().__init__(name, algos)
-        self.dbconn = None
-
-    def set_dbconnection(self, dbconn):
-        self.dbconn = dbconn
-
     # The position table is special in that extra indexes are created for it
-    def create_index(self, cursor, schemaName):
-        lib.dbtable.DBTable_BandIndependent.create_index(self, cursor, schemaName)
+    def get_index_jobs(self, schemaName, tableName=None, partitioned=False):
+        if tableName is None:
+            tableName = self.name
+        jobs = lib.dbtable.DBTable_BandIndependent.get_index_jobs(self, schemaName, tableName, partitioned)
         indexSpace = lib.config.get_index_space()
+        table = '"{schemaName}"."{tableName}"'.format(**locals())
 
-        cursor.execute("""
+        def add(name, statement, weight=1.0):
+            keys = dict(tableName=tableName, schemaName=schemaName, indexSpace=indexSpace)
+            jobs.append(lib.indexbuilder.IndexJob(
+                name.format(**keys), table, [statement.format(**keys)], weight))
+
+        add("{tableName}_parent_id_idx", """
         CREATE INDEX IF NOT EXISTS
-            "{self.name}_parent_id_idx"
+            "{tableName}_parent_id_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( parent
             )
         {indexSpace}
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        """)
+        add("{tableName}_skymap_id_idx", """
         CREATE INDEX IF NOT EXISTS
-            "{self.name}_skymap_id_idx"
+            "{tableName}_skymap_id_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( public.skymap_from_object_id(object_id)
             )
         {indexSpace}
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        """)
+        add("{tableName}_healpix_idx", """
         CREATE INDEX IF NOT EXISTS
-            "{self.name}_coord_idx"
+            "{tableName}_healpix_idx"
         ON
-            "{schemaName}"."{self.name}"
-        USING GiST
-            ( coord
+            "{schemaName}"."{tableName}"
+            ( healpix
             )
         {indexSpace}
-        WHERE
-            coord IS NOT NULL
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
+        """)
+        if lib.config.gistIndexes:
+            add("{tableName}_coord_idx", """
+            CREATE INDEX IF NOT EXISTS
+                "{tableName}_coord_idx"
+            ON
+                "{schemaName}"."{tableName}"
+            USING GiST
+                ( coord
+                )
+            {indexSpace}
+            WHERE
+                coord IS NOT NULL
+            """, weight=_gistWeight)
 
         # indices WHERE detect_isprimary = True
-        cursor.execute("""
+        add("{tableName}_object_id_primary_idx", """
         CREATE UNIQUE INDEX IF NOT EXISTS
-            "{self.name}_object_id_primary_idx"
+            "{tableName}_object_id_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( object_id
             )
         {indexSpace}
         WHERE
           detect_isprimary
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        """)
+        add("{tableName}_skymap_id_primary_idx", """
         CREATE INDEX IF NOT EXISTS
-            "{self.name}_skymap_id_primary_idx"
+            "{tableName}_skymap_id_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( public.skymap_from_object_id(object_id)
             )
         {indexSpace}
         WHERE
           detect_isprimary
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
-        cursor.execute("""
+        """)
+        add("{tableName}_healpix_primary_idx", """
         CREATE INDEX IF NOT EXISTS
-            "{self.name}_coord_primary_idx"
+            "{tableName}_healpix_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
-        USING GiST
-            ( coord
+            "{schemaName}"."{tableName}"
+            ( healpix
             )
         {indexSpace}
         WHERE
-            coord IS NOT NULL
-            AND detect_isprimary
-        """.format(**locals())
-        )
-        if (self.dbconn): self.dbconn.commit()
+          detect_isprimary
+        """)
+        if lib.config.gistIndexes:
+            add("{tableName}_coord_primary_idx", """
+            CREATE INDEX IF NOT EXISTS
+                "{tableName}_coord_primary_idx"
+            ON
+                "{schemaName}"."{tableName}"
+            USING GiST
+                ( coord
+                )
+            {indexSpace}
+            WHERE
+                coord IS NOT NULL
+                AND detect_isprimary
+            """, weight=_gistWeight)
+
+        return jobs
 
     def drop_index(self, cursor, schemaName):
         lib.dbtable.DBTable_BandIndependent.drop_index(self, cursor, schemaName)
@@ -696,6 +1405,11 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
             "{schemaName}"."{self.name}_coord_idx"
         """.format(**locals())
         )
+        cursor.execute("""
+        DROP INDEX IF EXISTS
+            "{schemaName}"."{self.name}_healpix_idx"
+        """.format(**locals())
+        )
 
         # indices WHERE detect_isprimary = True
 
@@ -714,6 +1428,11 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
             "{schemaName}"."{self.name}_coord_primary_idx"
         """.format(**locals())
         )
+        cursor.execute("""
+        DROP INDEX IF EXISTS
+            "{schemaName}"."{self.name}_healpix_primary_idx"
+        """.format(**locals())
+        )
 
 def get_catalog_schema_from_file(path, object_id):
     """
@@ -726,7 +1445,9 @@ def get_catalog_schema_from_file(path, object_id):
         PoppingOrderedDict mapping name: str -> table: DBTable.
     """
 
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    keep = lib.forced_algos.get_field_filter(
+        lib.forced_algos.forced_algos, lib.forced_algos.forced_algos_ignored)
+    table = lib.sourcetable.SourceTable.from_fits(path, keep)
 
     these_object_id = table.cutout_subtable("id").fields["id"].data
 
@@ -754,6 +1475,8 @@ def get_catalog_schema_from_file(path, object_id):
 
     dbtables = PoppingOrderedDict()
     def add(name, sourcenames, dbtable_class=lib.dbtable.DBTable):
+        if name in lib.config.perBandTables:
+            dbtable_class = lib.dbtable.DBTable_PerBand
         dbtables[name] = dbtable_class(name, algos.pop_many(sourcenames))
 
     add("dpdd_forced", [
@@ -813,15 +1536,7 @@ def get_existing_patches(rerunDir, tract):
     @return
         List of tract numbers, sorted.
     """
-    patches = set(
-        os.path.basename(os.path.dirname(path))
-        for path in glob.iglob("{rerunDir}/deepCoadd-results/merged/{tract}/*,*/ref-*".format(**locals()))
-        if path.endswith('.fits') or path.endswith('.fits.gz')
-    )
-
-    return sorted(set(
-        lib.common.patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
-    ))
+    return lib.common.get_coadd_manifest(rerunDir).distinct("patch", kind="ref", tract=tract)
 
 def get_ref_path(rerunDir, tract, patch):
     """
@@ -863,24 +1578,169 @@ def get_an_existing_catalog_id(rerunDir, schemaName):
     pattern = get_catalog_path(rerunDir, "*", "*", "*", False, schemaName)
     print('pattern from get_catalog_path is {pattern}'.format(**locals()))
 
-    cnt = 0
-    for catPath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
-        tract, patch, filter = lib.common.path_decompose(catPath)
-        cnt += 1
-        if cnt < 5:
-            print("tract=",tract, " patch=", patch, " filter=", filter)
+    manifest = lib.common.get_coadd_manifest(rerunDir)
+    if os.path.abspath(pattern).startswith(manifest.rootDir + os.sep):
+        kind = os.path.basename(pattern).split("-", 1)[0]
+        for tract in manifest.distinct("tract", kind=kind):
+            for entry in manifest.find(kind=kind, tract=tract):
+                if manifest.find_one(kind="ref", tract=tract, patch=entry.patch) is not None:
+                    return entry.tract, entry.patch, entry.filter
+    else:
+        # The catalogs are not in deepCoadd-results
+        for catPath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
+            tract, patch, filter = lib.common.path_decompose(catPath)
+            if lib.common.path_exists(get_ref_path(rerunDir, tract, patch)):
+                return tract, patch, filter
 
-        refPath = get_ref_path(rerunDir, tract, patch)
-        if cnt < 5: print("refPath: ", refPath)
-        else:
-            print("quitting")
-            exit(0)
+    raise RuntimeError("No complete pair (ref, forced_src) exists.")
 
-        if lib.common.path_exists(refPath):
-            return tract, patch, filter
 
-    raise RuntimeError("No complete pair (ref, forced_src) exists.")
+def create_patch_bookkeeping_table(cursor, schemaName):
+    """
+    Create the table "_temp:forced_patch" if it does not exist.
+    The table records the files (ref and forced) already inserted.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    # Unlogged with the catalog tables, which lose their rows together
+    # with this table's in a crash.
+    unlogged = lib.config.get_unlogged()
+    # Once per session, not per patch
+    lib.common.execute_once(cursor, """
+    CREATE {unlogged} TABLE IF NOT EXISTS "{schemaName}"."_temp:forced_patch" (
+        file_id   Bigint   PRIMARY KEY
+    )
+    """.format(**locals())
+    )
 
+def drop_tracts(schemaName, tracts, dryrun):
+    """
+    Drop the partitions of tracts and forget that they have been inserted,
+    so that the tracts will be inserted again.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tracts
+        List of tract numbers
+    @param dryrun
+        If True just print commands rather than executing
+    """
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        partitioned = lib.partition.get_partitioned_tables(cursor, schemaName)
+        if not partitioned:
+            raise RuntimeError("Tables in {schemaName} are not partitioned by tract".format(**locals()))
+        lib.partition.drop_tract_partitions(cursor, schemaName, partitioned, tracts, dryrun)
+
+        create_patch_bookkeeping_table(cursor, schemaName)
+        for tract in tracts:
+            # file_id = (tract*10000 + patch)*100 + filter
+            minFileId =  tract   *1000000
+            maxFileId = (tract+1)*1000000 - 1
+            statement = """
+            DELETE FROM "{schemaName}"."_temp:forced_patch" WHERE
+                file_id BETWEEN {minFileId} AND {maxFileId}
+            """.format(**locals())
+            if dryrun:
+                print(statement)
+            else:
+                cursor.execute(statement)
+
+    if not dryrun:
+        db.commit()
+    db.close()
+
+def get_patch_file_ids(tract, patch, filters):
+    """
+    Get the IDs in "_temp:forced_patch" of the files of a patch.
+    @param tract
+        Tract number
+    @param patch
+        Patch number (x*100 + y)
+    @param filters
+        List of filter names for which multiband catalogs actually exist
+    @return (fileId, minFileId, maxFileId)
+        Sorted list of the IDs, and the range of IDs the patch may have.
+    """
+    # file_id = (tract*10000 + patch)*100 + filter
+    patchId = tract*10000 + patch
+    minFileId =  patchId   *100
+    maxFileId = (patchId+1)*100 - 1
+
+    # The files that need registering include a "ref" file as well as 
+    # multiband files.
+    # We address this problem by giving filter ID 0  (or file_id minFileId) 
+    # to the "ref" file, and letting actual filter IDs start with 1.
+    fileId = [minFileId] + sorted(patchId*100 + lib.common.filterOrder[f]+1 for f in filters)
+
+    return fileId, minFileId, maxFileId
+
+def replace_patch_bookkeeping(cursor, schemaName, tract, patch, filters):
+    """
+    Record (tract, patch, filters) as inserted,
+    forgetting the filters previously inserted.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tract
+        Tract number
+    @param patch
+        Patch number (x*100 + y)
+    @param filters
+        List of filter names for which multiband catalogs actually exist
+    """
+    fileId, minFileId, maxFileId = get_patch_file_ids(tract, patch, filters)
+
+    create_patch_bookkeeping_table(cursor, schemaName)
+
+    lib.common.execute_prepared(cursor, """
+    DELETE FROM "{schemaName}"."_temp:forced_patch" WHERE
+        file_id BETWEEN $1 AND $2
+    """.format(**locals()),
+    (minFileId, maxFileId)
+    )
+
+    record_patch_bookkeeping(cursor, schemaName, fileId)
+
+def record_patch_bookkeeping(cursor, schemaName, fileId):
+    """
+    Insert file IDs into "_temp:forced_patch".
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param fileId
+        List of file IDs (See get_patch_file_ids()).
+    """
+    lib.common.execute_prepared(cursor, """
+    INSERT INTO "{schemaName}"."_temp:forced_patch"
+    SELECT unnest($1::Bigint[])
+    """.format(**locals()),
+    (list(fileId),)
+    )
+
+def get_inserted_patches(cursor, schemaName):
+    """
+    Get the files of the patches recorded in "_temp:forced_patch".
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @return (dict)
+        tract*10000 + patch -> sorted list of file_id (See get_patch_file_ids()).
+    """
+    cursor.execute("""
+    SELECT file_id FROM "{schemaName}"."_temp:forced_patch"
+    """.format(**locals())
+    )
+    inserted = {}
+    for fileId, in cursor:
+        inserted.setdefault(fileId // 100, []).append(fileId)
+    for fileIds in inserted.values():
+        fileIds.sort()
+    return inserted
 
 def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
     """
@@ -906,31 +1766,17 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
         List of filter names for which multiband catalogs actually exist
     """
 
-    # file_id = (tract*10000 + patch)*100 + filter
-    patchId = tract*10000 + patch
-    minFileId =  patchId   *100
-    maxFileId = (patchId+1)*100 - 1
-
-
     if cursor is None:  return False
 
-    # The files that need registering include a "ref" file as well as 
-    # multiband files.
-    # We address this problem by giving filter ID 0  (or file_id minFileId) 
-    # to the "ref" file, and letting actual filter IDs start with 1.
-    fileId = [minFileId] + sorted(patchId*100 + lib.common.filterOrder[f]+1 for f in filters)
+    fileId, minFileId, maxFileId = get_patch_file_ids(tract, patch, filters)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS "{schemaName}"."_temp:forced_patch" (
-        file_id   Bigint   PRIMARY KEY
-    )
-    """.format(**locals())
-    )
+    create_patch_bookkeeping_table(cursor, schemaName)
 
-    cursor.execute("""
+    lib.common.execute_prepared(cursor, """
     SELECT file_id FROM "{schemaName}"."_temp:forced_patch" WHERE
-        file_id BETWEEN {minFileId} AND {maxFileId}
-    """.format(**locals())
+        file_id BETWEEN $1 AND $2
+    """.format(**locals()),
+    (minFileId, maxFileId)
     )
 
     dbFileId = sorted(id for id, in cursor)
@@ -955,13 +1801,7 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
             .format(**locals())
         )
 
-    sFileId = ",".join("({})".format(id) for id in fileId)
-
-    cursor.execute("""
-    INSERT INTO "{schemaName}"."_temp:forced_patch"
-    VALUES {sFileId}
-    """.format(**locals())
-    )
+    record_patch_bookkeeping(cursor, schemaName, fileId)
 
     return False
 
@@ -16,12 +16,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy
+import threading
 
 from extinction.dustval import Extinction
 
 from .. import algobase
 from .. import sourcetable
 from .. import common
+from .. import config
+from .. import healpix
 from ..misc import PoppingOrderedDict
 
 
@@ -39,6 +42,11 @@ class Algo_ref_coord(algobase.Algo):
 
         fields = PoppingOrderedDict()
         fields["coord"] = sourcetable.Field_earth.from_radec("coord", ra, dec)
+        fields["healpix"] = sourcetable.Field(
+            "healpix", "Scalar", "",
+            healpix.ang2pix_nest(config.healpixOrder, numpy.degrees(ra), numpy.degrees(dec)),
+            "Nested HEALPix pixel number at order {}".format(config.healpixOrder), None
+        )
 
         extinction_bv = get_extinction(ra, dec)
 
@@ -82,6 +90,11 @@ class Algo_ref_coord(algobase.Algo):
                 "",
                 "Internal value on behalf of (ra,dec). Used in coneSearch(coord, RA, DEC, RADIUS) etc.",
             ),
+            ("healpix",
+                "healpix",
+                "",
+                fields["healpix"].doc + ". Used in healpixConeSearch(healpix, coord, RA, DEC, RADIUS) etc.",
+            ),
             ("skymap_id",
                 "public.skymap_from_object_id(object_id)",
                 "",
@@ -133,6 +146,8 @@ class Algo_ref_coord(algobase.Algo):
 
 
 _extinction = None
+# Patches may be read in several threads (see lib.pipeline)
+_extinctionLock = threading.Lock()
 
 def get_extinction(ra, dec):
     """
@@ -145,7 +160,8 @@ def get_extinction(ra, dec):
     """
 
     global _extinction
-    if _extinction is None:
-        _extinction = Extinction()
+    with _extinctionLock:
+        if _extinction is None:
+            _extinction = Extinction()
 
-    return _extinction.get_Ebv(ra, dec)
+        return _extinction.get_Ebv(ra, dec)
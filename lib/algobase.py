@@ -282,6 +282,25 @@ class Algo(object):
 
         return ret
 
+    def get_backend_field_binary(self, prefix):
+        """
+        Get field data for the backend table, to be sent in binary format.
+        @param prefix (str)
+            This prefix will be prefixed to field names.
+            Typical use is <filtername>_, e.g. 'g_'
+        @return list of (fieldname, binary_format, [column]).
+            'column' is a numpy.array. An example of the return value is:
+            ("coord", "earth", [x, y, z]),
+            in which x, y and z are numpy.array.
+            See lib.pgcopy for binary formats.
+        """
+        ret = []
+        for field in self.sourceTable.fields.values():
+            for f in field.explode():
+                ret.append((prefix + f.name, f.get_binary_format(), f.get_arrays()))
+
+        return ret
+
     def get_frontend_fields(self, prefix):
         """
         Get field data for the frontend view.
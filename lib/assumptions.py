@@ -17,6 +17,7 @@
 from yaml import load as yload
 from yaml import FullLoader
 import re
+import collections
 from .misc import PoppingOrderedDict
 from .misc import warning
 from .sourcetable import Field
@@ -51,6 +52,8 @@ class Assumptions(object):
         # will be dict of table info.  One entry per table. Value is
         # a dict of fields,  key =  name, but without data
         self.finals = None 
+        # _ColumnPlan compiled by apply() for the last input schema
+        self.plan = None
         #self.constraints = None      constraints are per-table
 
     def parse(self):
@@ -108,90 +111,38 @@ class Assumptions(object):
         For now only handle case where everything goes in a single DbImage
 
         """
-        print('assumptions.apply kw arguments: ')
-        for k in kw:
-            print('key is ', k, ' value is ', kw[k])
-
-        # apply ignores
-        self._compile_ignores()
-        if self.ignores != None:
-            remaining = PoppingOrderedDict()
-            for key, f in raw.fields.items():
-                matched = False
-                for p in self.ignores:
-                    if p.fullmatch(key):
-                        matched = True
-                        break;
-                if not matched: remaining[key] = f
-
-
+        if not self.parsed: self.parse()
 
-        #  The dict `remaining` now contains only fields we expect to use.
-        #  field name is used for dict key, as in SourceTable.fields
+        # The column plan depends only on the names and types of the
+        # input fields, which are the same for almost all input files.
+        fingerprint = _schema_fingerprint(raw)
+        if self.plan is None or self.plan.fingerprint != fingerprint:
+            self.plan = self._compile_plan(raw, fingerprint)
+        plan = self.plan
 
         #  Compute data length from the first field, needed for compute fields
-        for k in remaining:
-            data_len = len(remaining[k].data)
+        data_len = 0
+        for f in raw.fields.values():
+            data_len = len(f.data)
             break
 
+        table_name = plan.table_name
         fields = PoppingOrderedDict()
-        table_name = list(self.parsed['tables'].keys())[0]
-        table_def = self.parsed['tables'][table_name]
-
-        column_dicts, column_group_dicts = self._get_names(table_def)
+        for key in plan.raw_names:
+            fields[key] = raw.fields[key]
 
-        for key, f in remaining.items():
-            # check each one matches a column name or column group in our table
-            # (For now assume we have only one table)
-            matched = False
-            for i in range(len(column_dicts)):
-                if column_dicts[i]['name'] == key:
-                    matched = True
-                    fields[key] = f
-                    del(column_dicts[i])
-                    break
-            if matched: continue
-            for c in column_group_dicts:
-                if re.fullmatch(c['name_re'], key):
-                    matched = True
-                    fields[key] = f
-                    break
-            if not matched:
-                print("Column ", key, " unknown to Assumptions file")
-                # and maybe raise exception?
-
-
-        # If there are any entries left in column_dicts they better have
-        # the compute or compute_array attribute
-        for d in column_dicts:
-            if 'compute' in d:
-                c_list = d['compute']
-                cf_list = []
-                for i in range(len(c_list)):
-                    cf_list.append(str(c_list[i]).format(**kw))
-
-                s_val = rpn_eval([], cf_list)
-                print('computed value ', s_val)
-                val = s_val
-                nptype = np.int64     # default
-                if d['dtype'] == 'int8' : nptype = np.int8
+        for d, templates, nptype in plan.derived:
+            if templates is not None:
+                val = rpn_eval([], [t.format(**kw) for t in templates])
                 dat = np.full([data_len], int(val), nptype)
-
-
-                field = Field(d['name'], d['type'], None, dat, d['doc'], 
+                field = Field(d['name'], d['type'], None, dat, d['doc'],
                               d['compute'])
-                fields[d['name']] = field
             else:
-                if 'compute_array' in d:
-                    dat = rpn_eval_array(d['inputs'], d['compute_array'],
-                                         raw.fields)
-                    field = Field(d['name'], d['type'], None, dat, d['doc'],
-                                  None)
-                    fields[d['name']] = field
-                else:
-                    print("Field ", key, 
-                          ", known to Assumptions, not found in input")
-
+                dat = rpn_eval_array(d['inputs'], d['compute_array'],
+                                     raw.fields)
+                field = Field(d['name'], d['type'], None, dat, d['doc'],
+                              None)
+            fields[d['name']] = field
 
         dbimage = DbImage(table_name, fields, schema_name)
         dbimage.set_filters([""])
@@ -216,6 +167,60 @@ class Assumptions(object):
         
         return self.finals
         
+    def _compile_plan(self, raw, fingerprint):
+        """
+        Decide what apply() does with input having the fields of `raw`.
+
+        Parameters
+        ----------
+        raw : SourceTable instance
+        fingerprint : see _schema_fingerprint
+
+        Returns
+        -------
+        _ColumnPlan
+        """
+        self._compile_ignores()
+        ignores = self.ignores if self.ignores else []
+
+        table_name = list(self.parsed['tables'].keys())[0]
+        table_def = self.parsed['tables'][table_name]
+
+        column_dicts, column_group_dicts = self._get_names(table_def)
+        unmatched = [d['name'] for d in column_dicts]
+        group_res = [re.compile(c['name_re']) for c in column_group_dicts]
+
+        raw_names = []
+        for key in raw.fields:
+            if any(p.fullmatch(key) for p in ignores): continue
+
+            # check each one matches a column name or column group in our table
+            # (For now assume we have only one table)
+            if key in unmatched:
+                unmatched.remove(key)
+                raw_names.append(key)
+            elif any(r.fullmatch(key) for r in group_res):
+                raw_names.append(key)
+            else:
+                warning("Column", key, "unknown to Assumptions file")
+
+        # Columns not found in the input better have
+        # the compute or compute_array attribute
+        derived = []
+        for d in column_dicts:
+            if d['name'] not in unmatched: continue
+            if 'compute' in d:
+                nptype = np.int64     # default
+                if d['dtype'] == 'int8' : nptype = np.int8
+                derived.append((d, [str(c) for c in d['compute']], nptype))
+            elif 'compute_array' in d:
+                derived.append((d, None, None))
+            else:
+                warning("Field", d['name'],
+                        "known to Assumptions, not found in input")
+
+        return _ColumnPlan(fingerprint, table_name, raw_names, derived)
+
     def _get_names(self, assump_table):
         """
         Parameter
@@ -236,6 +241,32 @@ class Assumptions(object):
                 column_group_names.append(c)
         return column_names, column_group_names
 
+    def get_field_filter(self):
+        """
+        Returns
+        -------
+        callable keep(name) -> bool telling whether an input column is
+        needed by apply(): it is not ignored, or it is an input of
+        a compute_array column.  See SourceTable.from_fits().
+        """
+        if not self.parsed: self.parse()
+        self._compile_ignores()
+        ignores = self.ignores if self.ignores else []
+
+        inputs = set()
+        for table_def in self.parsed.get('tables', {}).values():
+            for c in table_def['columns']:
+                if 'inputs' in c:
+                    inputs.update(c['inputs'])
+
+        def keep(name):
+            if name in inputs: return True
+            for p in ignores:
+                if p.fullmatch(name): return False
+            return True
+
+        return keep
+
     def _get_ignores(self):
         if not self.parsed: self.parse()
         
@@ -301,3 +332,26 @@ class Assumptions(object):
         A list of index definitions 
         """
         return []                #   **** TO-DO ****
+
+
+class _ColumnPlan(collections.namedtuple("_ColumnPlan",
+                  ["fingerprint", "table_name", "raw_names", "derived"])):
+    """
+    What Assumptions.apply() does with input of a given schema:
+      * fingerprint: _schema_fingerprint() of the input
+      * table_name: Name of the table to make
+      * raw_names: Names of the input fields to keep, in order
+      * derived: List of (column dict, compute templates, numpy type)
+                 for computed columns. The templates and the type are None
+                 for compute_array columns.
+    """
+    __slots__ = []
+
+
+def _schema_fingerprint(raw):
+    """
+    Names and types of the fields of a SourceTable, which are all
+    Assumptions.apply() depends on besides the data.
+    """
+    return tuple((key, f.data.dtype.str, f.data.shape[1:])
+                 for key, f in raw.fields.items())
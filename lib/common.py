@@ -18,17 +18,21 @@
 # This file has been significantly modified for use with DESC simulated data by
 # LSST Dark Energy Science Collaboration (DESC)
 
+import atexit
 import collections
-import glob
 import os
 import re
+import threading
+import weakref
 
 import psycopg2
+import psycopg2.extensions
 
 import numpy as np
 
 from . import config
 from . import libdb
+from .manifest import Manifest
 
 
 def get_image_path(rerunDir, tract, patch, filter):
@@ -77,11 +81,45 @@ def get_existing_tracts(rerunDir):
     @return
         List of tract numbers, sorted.
     """
-    tracts = [os.path.basename(path) for path in glob.iglob("{rerunDir}/deepCoadd-results/*/*".format(**locals()))]
+    return get_coadd_manifest(rerunDir).distinct("tract")
 
-    return sorted(set(
-        int(tract) for tract in tracts if re.match(r'^[0-9]+$', tract)
-    ) )
+
+def get_coadd_manifest(rerunDir):
+    """
+    Get the index of the catalog files in "rerunDir/deepCoadd-results".
+    See lib.manifest. Files are classified by path_decompose():
+    "kind" is the prefix of the file name ("ref", "forced", etc.),
+    and "filter" is None for "ref".
+    @param rerunDir
+        Path to the rerun directory
+    @return (manifest.Manifest)
+    """
+    rootDir = os.path.abspath("{rerunDir}/deepCoadd-results".format(**locals()))
+    manifest = _coaddManifests.get(rootDir)
+    if manifest is None:
+        manifest = Manifest(rootDir, "coadd", _classify_coadd, depth=3)
+        _coaddManifests[rootDir] = manifest
+    return manifest
+
+_coaddManifests = {}
+
+
+def _classify_coadd(relpath):
+    """
+    Keys of a file in deepCoadd-results. See get_coadd_manifest().
+    """
+    basename = os.path.basename(relpath)
+    try:
+        keys = path_decompose(basename)
+    except RuntimeError:
+        return None
+
+    return {
+        "kind": basename.split("-", 1)[0],
+        "tract": keys[0],
+        "patch": keys[1],
+        "filter": keys[2] if len(keys) > 2 else None,
+    }
 
 def patch_to_number(patchStr):
     """
@@ -126,12 +164,255 @@ def path_exists(path):
 
 def new_db_connection():
     """
-    Create a connection to the database.
+    Get a connection to the database.
+
+    The connection is taken from the pool of idle connections of this
+    process, or made if there is none. Its close() returns it to the pool
+    (see ConnectionPool), so that opening and closing a connection per
+    patch, visit or index costs no new server session.
     """
+    connection = _pool.get()
     if config.NDEBUG:
-        return psycopg2.connect(**config.dbServer)
+        return connection
+    else:
+        return libdb.DBConnectionDebug(connection)
+
+
+class ConnectionPool(object):
+    """
+    Idle connections to the database, reused by new_db_connection().
+
+    A new connection is set up once with config.dbSessionSettings.
+    A connection returned to the pool is rolled back. If its borrower
+    changed it with set_session() (lib.indexbuilder, for instance, sets
+    autocommit and then session parameters), its session parameters are also
+    reset. Connections beyond "size" are closed.
+
+    Idle connections are not checked with the server before they are
+    lent: one that the server has closed in the meantime fails at its first
+    statement, as a fresh connection would if the server were restarted.
+
+    A forked process does not use the idle connections of its parent,
+    whose sessions are not its own.
+    """
+    def __init__(self, size=None):
+        """
+        @param size (int)
+            Maximum number of idle connections. Defaults to config.dbPoolSize.
+        """
+        self.size = size
+        self.__idle = []
+        self.__lock = threading.Lock()
+        # Connections of the parent process, which must not be closed here.
+        self.__inherited = []
+
+    def get(self):
+        """
+        @return (PooledConnection)
+        """
+        with self.__lock:
+            while self.__idle:
+                connection = self.__idle.pop()
+                if connection.closed == 0 and \
+                        connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    return PooledConnection(self, connection)
+                connection.close()
+
+        connection = psycopg2.connect(**config.dbServer)
+        try:
+            _set_up_session(connection)
+        except Exception:
+            connection.close()
+            raise
+        return PooledConnection(self, connection)
+
+    def put(self, connection):
+        """
+        Return a connection (psycopg2's) to the pool.
+        """
+        if connection.closed:
+            return
+        try:
+            connection.rollback()
+            get_session(connection).rollback()
+            if connection.autocommit or connection.readonly is not None:
+                connection.readonly = None
+                connection.autocommit = False
+                with connection.cursor() as cursor:
+                    cursor.execute("RESET ALL")
+                _set_up_session(connection)
+        except psycopg2.Error:
+            connection.close()
+            return
+
+        size = config.dbPoolSize if self.size is None else self.size
+        with self.__lock:
+            if len(self.__idle) < size:
+                self.__idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """
+        Close the idle connections.
+        """
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for connection in idle:
+            connection.close()
+
+    def _after_fork(self):
+        """
+        Forget, without closing them, the connections of the parent process.
+        """
+        self.__lock = threading.Lock()
+        self.__inherited.extend(self.__idle)
+        self.__idle = []
+
+
+class PooledConnection(object):
+    """
+    Connection lent by a ConnectionPool. It is used as psycopg2's connection
+    that it wraps, except that close() returns it to the pool.
+    "with connection:" commits or rolls back, without closing, as psycopg2's does.
+    """
+    def __init__(self, pool, connection):
+        object.__setattr__(self, "pool", pool)
+        object.__setattr__(self, "connection", connection)
+
+    def __getattr__(self, name):
+        if self.connection is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        # e.g. "connection.autocommit = True"
+        setattr(self.connection, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    @property
+    def closed(self):
+        return 1 if self.connection is None else self.connection.closed
+
+    def commit(self):
+        self.connection.commit()
+        get_session(self.connection).commit()
+
+    def rollback(self):
+        self.connection.rollback()
+        get_session(self.connection).rollback()
+
+    def close(self):
+        if self.connection is not None:
+            connection = self.connection
+            object.__setattr__(self, "connection", None)
+            self.pool.put(connection)
+
+
+class DBSession(object):
+    """
+    What has been done once for all in the server session of a connection.
+    """
+    def __init__(self):
+        # statement -> name of the prepared statement
+        self.prepared = {}
+        # Statements executed by execute_once() and committed
+        self.executed = set()
+        # Statements executed by execute_once() in the current transaction
+        self.pending = set()
+
+    def commit(self):
+        self.executed |= self.pending
+        self.pending.clear()
+
+    def rollback(self):
+        self.pending.clear()
+
+
+def get_session(connection):
+    """
+    @param connection
+        psycopg2's connection, e.g. cursor.connection.
+    @return (DBSession)
+    """
+    with _sessionsLock:
+        session = _sessions.get(connection)
+        if session is None:
+            session = _sessions[connection] = DBSession()
+        return session
+
+
+def execute_once(cursor, statement):
+    """
+    Execute a statement unless it has already been executed, and committed,
+    in the session of the cursor's connection. This is for statements
+    that need not be repeated, like "CREATE TABLE IF NOT EXISTS".
+    The transaction must be ended by the connection's commit() or rollback().
+    @param cursor
+        DB connection's cursor object
+    @param statement (str)
+    """
+    session = get_session(cursor.connection)
+    if statement in session.executed or statement in session.pending:
+        return
+    cursor.execute(statement)
+    if cursor.connection.autocommit:
+        session.executed.add(statement)
+    else:
+        session.pending.add(statement)
+
+
+def execute_prepared(cursor, statement, params):
+    """
+    Execute a statement, prepared once in the session of the cursor's connection.
+    @param cursor
+        DB connection's cursor object
+    @param statement (str)
+        Statement with parameters $1, $2, ...
+    @param params (tuple)
+        Values of the parameters.
+    """
+    session = get_session(cursor.connection)
+    name = session.prepared.get(statement)
+    if name is None:
+        name = "dc2_stmt_{}".format(len(session.prepared))
+        # Prepared statements are not undone by a rollback
+        cursor.execute("PREPARE {} AS {}".format(name, statement))
+        session.prepared[statement] = name
+
+    if params:
+        cursor.execute("EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(params))), params)
     else:
-        return libdb.DBConnectionDebug(psycopg2.connect(**config.dbServer))
+        cursor.execute("EXECUTE {}".format(name))
+
+
+def _set_up_session(connection):
+    """
+    Set config.dbSessionSettings in the session of a connection.
+    """
+    if config.dbSessionSettings:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT " + ", ".join(["set_config(%s, %s, false)"] * len(config.dbSessionSettings)),
+                           [str(x) for item in config.dbSessionSettings.items() for x in item])
+    connection.commit()
+
+
+_pool = ConnectionPool()
+_sessions = weakref.WeakKeyDictionary()
+_sessionsLock = threading.Lock()
+
+atexit.register(_pool.clear)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_pool._after_fork)
 
 
 def db_table_exists(schema_name, table_name):
@@ -21,15 +21,100 @@ NDEBUG = True
 #NDEBUG = False
 MULTICORE = True
 
+# Number of processes formatting rows for COPY (see lib.pipe_printf)
+# in each ingesting process, if MULTICORE
+printfWorkers = 2
+
 withSkymapWcs = ""
 
+# Directory of the indices of rerun directories (see lib.manifest),
+# and the number of threads walking a rerun directory
+manifestDir = os.environ.get("DC2_MANIFEST_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "dc2-postgresql"))
+manifestThreads = 16
+
+# "text" or "binary". Format of COPY streams sent to the server.
+# "binary" requires the server's cube extension to support binary I/O
+# (cube 1.5, i.e. PostgreSQL 14 or later).
+copyFormat = "text"
+
+# Settings for building indexes (see lib.indexbuilder):
+# number of connections building indexes concurrently, and the session
+# settings of each of them
+indexConnections = 4
+indexMaintenanceWorkMem = "1GB"
+indexParallelWorkers = 2
+
+# Settings for reading catalogs (see lib.scan): number of connections
+# reading concurrently, and rows fetched from the server at a time
+scanConnections = 4
+scanBatchRows = 100000
+
+# Rows in a row group of the Parquet files written by lib.export
+exportRowGroupRows = 1000000
+
+# Seconds between writes of the metrics files (see lib.metrics)
+metricsInterval = 60
+
+# Whether lib.metrics samples the RSS at the end of every timed call,
+# to keep its high-water mark by stage. Off, it is sampled only at each
+# write of the metrics.
+metricsStageRss = False
+
+# Pipeline inserting patches in a process (see lib.pipeline): patches
+# waiting between stages (0 for no pipeline), threads reading patches,
+# and maximum bytes of the input files of the patches in flight
+pipelinePrefetch = 2
+pipelineReaders = 2
+pipelineMemory = 4 << 30
+
+# Connections on which the pipeline COPYs patches concurrently
+copyConnections = 1
+
 tableSpace = ""
 indexSpace = ""
 
+# If True, tables are created UNLOGGED, to be set LOGGED after loading
+# (see lib.fastload)
+unloggedTables = False
+
+# If True, object tables are partitioned by tract (see lib.partition)
+partitionByTract = False
+
+# "", or a curve in lib.spatialsort.curves along which to sort
+# the rows of each patch before COPY
+rowOrder = ""
+
+# Order of the nested HEALPix pixel numbers in the "healpix" column
+# of the position table (see lib.healpix). It must not change once
+# a schema is loaded: it is recorded in the table public.healpix_orders,
+# where the search functions read it.
+healpixOrder = 29
+
+# If False, "coord" of the position table is not indexed with GiST,
+# and spatial searches use the btree index on "healpix"
+gistIndexes = True
+
+# Names of multiband tables to be created with a row per (object_id, band)
+# (see lib.dbtable.DBTable_PerBand)
+perBandTables = set()
+
 dbServer = {
     'dbname': os.environ.get("USER", "postgres"),
 }
 
+# Parameters set once in each database session (see lib.common.new_db_connection).
+# With synchronous_commit off, a server crash may lose the last transactions,
+# but each patch or visit is committed together with its bookkeeping,
+# so it is then simply inserted again.
+dbSessionSettings = {
+    "synchronous_commit": "off",
+    "work_mem": "64MB",
+}
+
+# Idle connections kept by each process for reuse
+dbPoolSize = 4
+
 
 def get_table_space():
     if tableSpace:
@@ -37,6 +122,12 @@ def get_table_space():
     else:
         return ''
 
+def get_unlogged():
+    if unloggedTables:
+        return 'UNLOGGED'
+    else:
+        return ''
+
 def get_index_space():
     if indexSpace:
         return 'TABLESPACE "{}"'.format(indexSpace)
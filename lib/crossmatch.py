@@ -0,0 +1,169 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cross-match of many positions in one query.
+
+Instead of a coneSearch() query per position, the positions are COPY'ed
+into a temporary table, which is joined with the position table: each
+position is searched with the GiST index on "coord" in a LATERAL subquery,
+and the matches are read back through a server-side cursor.
+
+The query is that of crossMatch() of postgres-objcatalog, but issued
+directly: crossMatch(), a PL/pgSQL function, returns its rows only once
+all of them have been found, whereas the query streams them.
+"""
+
+import numpy
+
+from . import pgcopy
+
+# Name of the temporary table of positions
+positionTable = "crossmatch_positions"
+
+# Rows fetched from the server at a time
+fetchRows = 10000
+
+
+def read_positions(file, radius):
+    """
+    Read positions from a text file with columns: id ra dec [radius].
+    Empty lines and text following "#" are ignored.
+    IDs are parsed as integers, not through float64,
+    which would round those above 2**53 (e.g. DC2 object IDs).
+    @param file
+        File object.
+    @param radius (float)
+        Search radius in arcsec, for positions without one.
+    @return (ids, ra, dec, radius)
+        numpy.arrays of int64, and of float64 for the others.
+    """
+    ids = []
+    coords = []
+    for lineNo, line in enumerate(file, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) not in (3, 4):
+            raise RuntimeError("Line {}: expected columns: id ra dec [radius]".format(lineNo))
+        ids.append(int(fields[0]))
+        coords.append([float(x) for x in fields[1:]] + ([radius] if len(fields) == 3 else []))
+
+    coords = numpy.array(coords, dtype=numpy.float64).reshape(-1, 3)
+    return numpy.array(ids, dtype=numpy.int64), coords[:, 0], coords[:, 1], coords[:, 2]
+
+
+def get_query(positions, objects, nearest=False):
+    """
+    @param positions (str)
+        Qualified and quoted name of the table of positions,
+        with columns (id, ra, dec, radius).
+    @param objects (str)
+        Qualified and quoted name of the table searched,
+        with columns "object_id" and "coord".
+    @param nearest (bool)
+        If True, select only the nearest object within the radius.
+    @return (str)
+        Query of (id, object_id, distance in arcsec) of matches,
+        as crossMatch() of postgres-objcatalog.
+    """
+    limit = "LIMIT 1" if nearest else ""
+    return """
+    SELECT
+      p.id, m.object_id, m.distance
+    FROM
+      {positions} p
+    CROSS JOIN LATERAL
+      ( SELECT
+          o.object_id
+        , earth_distance(o.coord, ll_to_earth(p."dec", p."ra")) AS distance
+        FROM
+          {objects} o
+        WHERE
+          public.coneSearch(o.coord, p."ra", p."dec", p.radius)
+        ORDER BY
+          o.coord <-> ll_to_earth(p."dec", p."ra")
+        {limit}
+      ) m
+    """.format(**locals())
+
+
+def crossmatch(connection, schemaName, ra, dec, radius, ids=None, nearest=False, tableName="position"):
+    """
+    Find objects around many positions.
+    The positions are in a temporary table while the generator is active,
+    in the current transaction of "connection", which is left open.
+    @param connection
+        DB connection
+    @param schemaName (str)
+        Name of the schema
+    @param ra (numpy.array)
+    @param dec (numpy.array)
+        Positions in degrees.
+    @param radius (float or numpy.array)
+        Search radius in arcsec.
+    @param ids (numpy.array)
+        Integer ID of each position, returned with its matches.
+        Indices of the positions if None.
+    @param nearest (bool)
+        If True, return only the nearest object within the radius.
+    @param tableName (str)
+        Name of the table searched, with columns "object_id" and "coord".
+    @return (generator of (int, int, float))
+        (id, object_id, distance in arcsec) of matches.
+        Positions without matches do not appear.
+    """
+    ra = numpy.asarray(ra, dtype=numpy.float64)
+    dec = numpy.asarray(dec, dtype=numpy.float64)
+    radius = numpy.broadcast_to(numpy.asarray(radius, dtype=numpy.float64), ra.shape)
+    if ids is None:
+        ids = numpy.arange(len(ra), dtype=numpy.int64)
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        DROP TABLE IF EXISTS "pg_temp"."{positionTable}"
+        """.format(positionTable=positionTable)
+        )
+        cursor.execute("""
+        CREATE TEMPORARY TABLE "{positionTable}"
+            ( id      Bigint
+            , "ra"    Float8
+            , "dec"   Float8
+            , radius  Float8
+            )
+        """.format(positionTable=positionTable)
+        )
+        pgcopy.copy_binary(cursor, '"pg_temp"."{}"'.format(positionTable),
+            ["id", '"ra"', '"dec"', "radius"], ["int8", "float8", "float8", "float8"],
+            [ids, ra, dec, radius])
+        # So that the planner knows the number of positions
+        cursor.execute('ANALYZE "pg_temp"."{}"'.format(positionTable))
+
+    cursor = connection.cursor(name="crossmatch")
+    cursor.itersize = fetchRows
+    cursor.execute(get_query('"pg_temp"."{}"'.format(positionTable),
+                             '"{}"."{}"'.format(schemaName, tableName), nearest))
+    try:
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+    # (If the generator is not exhausted, the table is dropped by the next call
+    # or when the transaction is rolled back)
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE "pg_temp"."{}"'.format(positionTable))
@@ -17,6 +17,8 @@
 # Adapted from dbtable.py
 from . import common
 from . import config
+from . import indexbuilder
+from . import metrics
 
 from .sourcetable import Field
 import numpy as np
@@ -108,6 +110,7 @@ class DbImage(object):
         """
         self.index = indexes
 
+    @metrics.timer("transform")
     def transform(self):
         """
         most of the arguments in the original dbtable version were there
@@ -166,9 +169,10 @@ class DbImage(object):
         """.join(members)
 
         tableSpace = config.get_table_space()
+        unlogged = config.get_unlogged()
 
         create_string = """
-        CREATE TABLE "{schema_name}"."{self.name}" (
+        CREATE {unlogged} TABLE "{schema_name}"."{self.name}" (
             {members}
         )
         {tableSpace}
@@ -180,6 +184,18 @@ class DbImage(object):
             print(create_string)
 
     def create_primary(self, cursor):
+        for job in self.get_primary_jobs():
+            for statement in job.statements:
+                if cursor is None:
+                    print(statement)
+                else:
+                    cursor.execute(statement)
+
+    def get_primary_jobs(self):
+        """
+        @return list of indexbuilder.IndexJob creating the primary key
+        (empty or one job)
+        """
         create_pkey_str = """
         ALTER TABLE {fulltable} ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ({cols}) 
         """
@@ -190,11 +206,10 @@ class DbImage(object):
                     fulltable = '"' + self.schema_name + '"."' + table + '"'
                     cols = ','.join(i['columns'])
                     create_pkey_q = create_pkey_str.format(**locals())
-                    if cursor is None:
-                        print(create_pkey_q)
-                    else:
-                        cursor.execute(create_pkey_q)
-                    return    # can only have one primary key
+                    return [indexbuilder.IndexJob(table + "_pkey", fulltable,
+                                                  [create_pkey_q])]
+                    # can only have one primary key
+        return []
                 
     def drop_primary(self, cursor):
         """
@@ -218,12 +233,26 @@ class DbImage(object):
             # if cursor not None exexute; else print
 
     def create_foreign(self, cursor):
+        for job in self.get_foreign_jobs():
+            for statement in job.statements:
+                # if cursor not None execute; else print
+                if cursor is None:
+                    print(statement)
+                else:
+                    cursor.execute(statement)
+
+    def get_foreign_jobs(self):
+        """
+        @return list of indexbuilder.IndexJob creating foreign keys,
+        one per key
+        """
         create_fk_str = """
         ALTER TABLE {fulltable} ADD CONSTRAINT "{table}_{column}_fk"
         FOREIGN KEY ({column}) REFERENCES {reftable} ({refcolumn})
         """ 
         # can add NOT VALID to end of command above to defer validity
         # checking on rows already in the db
+        jobs = []
         for f in self.foreign:
             table =  self.name
             fulltable = '"' + self.schema_name + '"."' +  self.name + '"'
@@ -232,12 +261,10 @@ class DbImage(object):
             refcolumn = f['ref_column']
             # produce create.. string
             create_fk_q = create_fk_str.format(**locals())
-
-            # if cursor not None execute; else print
-            if cursor is None:
-                print(create_fk_q)
-            else:
-                cursor.execute(create_fk_q)
+            jobs.append(indexbuilder.IndexJob(
+                "{table}_{column}_fk".format(**locals()), fulltable,
+                [create_fk_q]))
+        return jobs
 
 
     def drop_foreign(self, cursor):
@@ -340,6 +367,22 @@ class DbImage(object):
                                 f.get_columns()))
         return members
 
+    def get_backend_field_binary(self, prefix):
+        """
+        Get field data for the backend table, to be sent in binary format.
+        @param prefix (str)
+            prepend to column name  for multiband
+        @return list of (fieldname, binary_format, [column]).
+            'column' is a numpy.array. See lib.pgcopy for binary formats.
+        """
+
+        members = []
+        for field in self.fields.values():
+            for f in field.explode():
+                members.append((prefix + f.name, f.get_binary_format(),
+                                f.get_arrays()))
+        return members
+
 class DbImage_BandIndependent(DbImage):
     """
     Band-independent variant of class DbImage.
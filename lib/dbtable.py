@@ -17,6 +17,8 @@
 
 from . import common
 from . import config
+from . import indexbuilder
+from . import metrics
 
 class DBTable(object):
     """
@@ -43,6 +45,10 @@ class DBTable(object):
     """
     __slots__ = ["name", "algos", "filters"]
 
+    # Columns preceding those of the algos, and the primary key
+    keyMembers = ["object_id Bigint"]
+    keyColumns = "object_id"
+
     def __init__(self, name, algos):
         """
         @param name (str)
@@ -66,6 +72,7 @@ class DBTable(object):
         for algo in self.algos.values():
             algo.set_filters(filters)
 
+    @metrics.timer("transform")
     def transform(self, rerunDir, tract, patch, filter, coord):
         """
         Transform to the style in the DB the fields passed in on construction.
@@ -110,7 +117,7 @@ class DBTable(object):
         @param schemaName
             Name of the schema in which to locate the master table
         """
-        members = ['object_id Bigint']
+        members = list(self.keyMembers)
 
         for filter in self.filters:
             #filt = common.filterToShortName[filter] + "_" if filter else ""
@@ -123,11 +130,19 @@ class DBTable(object):
         """.join(members)
 
         tableSpace = config.get_table_space()
+        unlogged = config.get_unlogged()
+        partitionBy = ""
+        if config.partitionByTract:
+            # Partitions are created as tracts are inserted
+            # (see lib.partition). Only they can be unlogged.
+            partitionBy = "PARTITION BY RANGE (object_id)"
+            unlogged = ""
 
         create_string = """
-        CREATE TABLE "{schemaName}"."{self.name}" (
+        CREATE {unlogged} TABLE "{schemaName}"."{self.name}" (
             {members}
         )
+        {partitionBy}
         {tableSpace}
         """.format(**locals())
 
@@ -144,23 +159,57 @@ class DBTable(object):
         @param schemaName
             Name of the schema in which to locate the master table
         """
+        for job in self.get_index_jobs(schemaName):
+            for statement in job.statements:
+                cursor.execute(statement)
+
+    def get_index_jobs(self, schemaName, tableName=None, partitioned=False):
+        """
+        Get the statements creating indexes on this table.
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param tableName
+            Name of the table or partition (see lib.partition) to index.
+            Defaults to self.name.
+        @param partitioned
+            True if the table is partitioned. Its indexes should then be
+            created after those of its partitions, which they adopt.
+        @return
+            List of indexbuilder.IndexJob, independent of each other.
+        """
+        if tableName is None:
+            tableName = self.name
         indexSpace = config.get_index_space()
 
-        cursor.execute("""
-        CREATE UNIQUE INDEX
-            "{self.name}_pkey"
-        ON
-            "{schemaName}"."{self.name}" (object_id)
-        {indexSpace}
-        """.format(**locals())
-        )
-        cursor.execute("""
-        ALTER TABLE
-            "{schemaName}"."{self.name}"
-        ADD PRIMARY KEY USING INDEX
-          "{self.name}_pkey"
-        """.format(**locals())
-        )
+        if partitioned:
+            # ADD PRIMARY KEY USING INDEX is not supported on partitioned tables
+            statements = ["""
+            ALTER TABLE
+                "{schemaName}"."{tableName}"
+            ADD CONSTRAINT
+                "{tableName}_pkey"
+            PRIMARY KEY ({self.keyColumns})
+            """.format(**locals())]
+        else:
+            statements = ["""
+            CREATE UNIQUE INDEX
+                "{tableName}_pkey"
+            ON
+                "{schemaName}"."{tableName}" ({self.keyColumns})
+            {indexSpace}
+            """.format(**locals()), """
+            ALTER TABLE
+                "{schemaName}"."{tableName}"
+            ADD PRIMARY KEY USING INDEX
+              "{tableName}_pkey"
+            """.format(**locals())]
+
+        return [
+            indexbuilder.IndexJob(
+                "{tableName}_pkey".format(**locals()),
+                '"{schemaName}"."{tableName}"'.format(**locals()),
+                statements),
+        ]
 
     def drop_index(self, cursor, schemaName):
         """
@@ -204,6 +253,21 @@ class DBTable(object):
 
         return members
 
+    def get_backend_field_binary(self, filter):
+        """
+        Get field data for the backend table, to be sent in binary format.
+        @param filter (str)
+            Filter name.
+        @return list of (fieldname, binary_format, [column]).
+            See Algo.get_backend_field_binary().
+        """
+        filt = common.filterToShortName[filter] + "_" if filter else ""
+        members = []
+
+        for algo in self.algos.values():
+            members += algo.get_backend_field_binary(filt)
+
+        return members
 
     def get_exported_fields(self, filter):
         """
@@ -238,3 +302,74 @@ class DBTable_BandIndependent(DBTable):
             return DBTable.create(self, cursor, schemaName)
         finally:
             self.filters = filters
+
+
+class DBTable_PerBand(DBTable):
+    """
+    Long-format variant of class DBTable.
+    Instead of the columns of all bands side by side in a row,
+    this table has a row per (object_id, band), "band" being the short
+    filter name. Rows are narrower (and far from TOAST), and a band can be
+    added without rewriting the rows of the other bands.
+    DpddView pivots this table back into the columns of the bands.
+    """
+    __slots__ = []
+
+    keyMembers = ["object_id Bigint", 'band "char"']
+    keyColumns = "object_id, band"
+
+    def create(self, cursor, schemaName):
+        filters = self.filters
+        self.filters = [""]
+        try:
+            return DBTable.create(self, cursor, schemaName)
+        finally:
+            self.filters = filters
+
+    def get_backend_field_data(self, filter):
+        # The band is not in the field names but in the "band" column
+        return DBTable.get_backend_field_data(self, "")
+
+    def get_backend_field_binary(self, filter):
+        return DBTable.get_backend_field_binary(self, "")
+
+
+def get_per_band_columns(cursor, schemaName):
+    """
+    Find the tables created by DBTable_PerBand in a schema.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema
+    @return (dict)
+        Map from table name to the list of its columns
+        other than "object_id" and "band".
+    """
+    cursor.execute("""
+    SELECT
+        c.relname, a.attname
+    FROM
+        pg_attribute a
+        JOIN pg_class c ON a.attrelid = c.oid
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+    WHERE
+        n.nspname = %s
+        AND c.relkind IN ('r', 'p')
+        AND NOT c.relispartition
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        AND EXISTS (
+            SELECT 1 FROM pg_attribute b
+            WHERE b.attrelid = c.oid AND b.attname = 'band' AND NOT b.attisdropped
+        )
+    ORDER BY
+        c.relname, a.attnum
+    """, (schemaName,)
+    )
+
+    columns = {}
+    for table, column in cursor.fetchall():
+        names = columns.setdefault(table, [])
+        if column not in ("object_id", "band"):
+            names.append(column)
+    return columns
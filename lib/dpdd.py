@@ -75,17 +75,24 @@ class DpddView(object):
                            for err and flux are in native quantities
                            
                            Allowable values are 1,2 or 3
+    per_band_columns       Dict mapping the name of each table with a row
+                           per (object_id, band) to its columns (without
+                           band prefix). See lib.dbtable.DBTable_PerBand.
+                           Such a table is joined once per band, so that
+                           {BAND}_column is found in the join for the band.
     """
     def __init__(self, dbschema, 
                  bands=['g','i','r','u','y','z'], 
                  yaml_path='native_to_dpdd.yaml', pixel_scale=0.2,
-                 yaml_override=None, dm_schema_version=3):
+                 yaml_override=None, dm_schema_version=3,
+                 per_band_columns=None):
         self.dbschema = dbschema
         self.yaml_path = yaml_path
         self.yaml_override = yaml_override
         self.dm_schema_version = dm_schema_version
         self.bands = bands
         self.pixel_scale=pixel_scale
+        self.per_band_columns = per_band_columns or {}
 
         # Next two values are obtained from yaml file
         self.view_name = None
@@ -113,13 +120,15 @@ class DpddView(object):
             n_dict[i['DPDDname']] = itemdict
         return n_dict      
     @staticmethod
-    def _get_table_spec(table_spec_list, schema):
+    def _get_table_spec(table_spec_list, schema, per_band_tables=(), bands=()):
         """
         Parameters
         table_spec_list:  list of dicts
         All have table_name entry.  All but first have
         join_on or join_using entry
         schema : string
+        per_band_tables : names of tables with a row per (object_id, band)
+        bands : list of band names
 
         Returns:  string representation of table spec for create view
         """
@@ -127,9 +136,18 @@ class DpddView(object):
         if n == 0:
             raise ValueException("no source tables for view")
 
-        table_spec =  '"{schema}".' + table_spec_list[0]['table_name'] + ' '
+        first = table_spec_list[0]['table_name']
+        table_spec =  '"{schema}".' + first + ' '
         for i in range(n)[1:] :
             e = table_spec_list[i]
+            if e['table_name'] in per_band_tables:
+                # A join per band, of the configured type. Each of them is
+                # on the primary key, so the planner removes left joins
+                # whose columns are not used.
+                for b in bands:
+                    table_spec += ' {j} "{schema}".{t} AS {t}_{b} on {t}_{b}.object_id = {first}.object_id and {t}_{b}.band = \'{b}\' '.format(
+                        j=e['join_type'].strip(), t=e['table_name'], b=b, first=first, schema='{schema}')
+                continue
             next =  ' '.join([e['join_type'], '"{schema}".' + e['table_name']])
             if 'join_on' in e:
                 next += ' on ' + e['join_on'] + ' '
@@ -228,30 +246,40 @@ class DpddView(object):
             return asvl
         else: return [asv]        
         
-    def view_string(self):
-        dbschema = self.dbschema
-        # table_spec = self.table_spec
-        # if table_spec is None:
-        #     if len(self.tables) == 1:
-        #         table_spec = '"{}"."{}"'.format(dbschema, self.tables[0])
-        #     else:
-        #         join_list = [ '"{}"."{}"'.format(dbschema, self.tables[0]) ] 
-        #         for table in self.tables[1:]:
-        #             join_list.append('LEFT JOIN "{}"."{}" USING (object_id)'.format(dbschema, table) )
-                  
-        #         table_spec = """
-        #         """.join(join_list)
-
+    def per_band_rename(self, field):
+        """
+        Replace {BAND}_column (with BAND substituted) in a field definition
+        with {table}_{BAND}.column if the column is in a per-band table.
+        """
+        for table, columns in self.per_band_columns.items():
+            if not columns: continue
+            pat = re.compile(r'(?<![\w."])(' + '|'.join(re.escape(b) for b in self.bands)
+                             + ')_(' + '|'.join(re.escape(c) for c in columns)
+                             + r')(?![\w"])', re.IGNORECASE)
+            field = pat.sub(lambda m: '{}_{}.{}'.format(table, m.group(1).lower(),
+                                                         m.group(2).lower()),
+                            field)
+        return field
+
+    def read_columns(self):
+        """
+        Read the yaml files, setting view_name and table_spec.
+        Returns the list of column dicts, with overrides applied.
+        """
         dpdd_yaml = DpddYaml(open(self.yaml_path)).parse()
         self.view_name = dpdd_yaml['view_name']
         self.table_spec = self._get_table_spec(dpdd_yaml['table_spec'], 
-                                               dbschema)
+                                               self.dbschema,
+                                               self.per_band_columns,
+                                               self.bands)
         if self.yaml_override:
             override_yaml = DpddYaml(open(self.yaml_override)).parse()
             if 'view_name' in override_yaml:
                 self.view_name = override_yaml['view_name']
             if 'table_spec' in override_yaml:
-                self.table_spec = self._get_table_spec(override_yaml['table_spec'], dbschema)
+                self.table_spec = self._get_table_spec(override_yaml['table_spec'], self.dbschema,
+                                                       self.per_band_columns,
+                                                       self.bands)
 
             if 'columns' in override_yaml:
                 for i in override_yaml['columns']:
@@ -272,13 +300,45 @@ class DpddView(object):
                         new_elt = dict(i)
                         dpdd_yaml['columns'].append(new_elt)
 
+        return dpdd_yaml['columns']
+
+    def column_types(self):
+        """
+        Returns list of (name, Datatype) of the columns of the view,
+        in order. Names are lowercase, as they are in the database.
+        Datatype is as in the yaml files (int, long, double, float, flag, ...),
+        or None if the yaml files give none.
+        """
+        types = []
+        for i in self.read_columns():
+            datatype = i.get('Datatype')
+            for f in self.resolve(i):
+                types.append((f.rsplit(' AS ', 1)[1].lower(), datatype))
+        return types
+
+    def view_string(self):
+        dbschema = self.dbschema
+        # table_spec = self.table_spec
+        # if table_spec is None:
+        #     if len(self.tables) == 1:
+        #         table_spec = '"{}"."{}"'.format(dbschema, self.tables[0])
+        #     else:
+        #         join_list = [ '"{}"."{}"'.format(dbschema, self.tables[0]) ] 
+        #         for table in self.tables[1:]:
+        #             join_list.append('LEFT JOIN "{}"."{}" USING (object_id)'.format(dbschema, table) )
+                  
+        #         table_spec = """
+        #         """.join(join_list)
+
+        columns = self.read_columns()
 
         fields = []
-        for i in dpdd_yaml['columns']:
+        for i in columns:
             r = self.resolve(i)
             if r: fields += r
             #r = DpddYaml.resolve(i)
             #if r: fields.append(r)
+        fields = [self.per_band_rename(f) for f in fields]
         sFields = """,
         """.join(fields)
         table_spec = self.table_spec
@@ -0,0 +1,299 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export of the dpdd view to Parquet files, tract by tract.
+
+Each tract is selected with tractSearch(objectid, tract), read through
+binary COPY by lib.query.read() (only the columns exported), and written
+to "tract_{tract}.parquet" in row groups of config.exportRowGroupRows rows
+with column statistics, so that readers can skip row groups by value.
+Tracts are exported concurrently on several connections.
+
+The output directory has a manifest ("manifest.json") recording, for each
+tract exported, a fingerprint of its rows in "_temp:forced_patch": the
+file_id's of the patches inserted and the transactions (xmin) that
+inserted them. Inserting, replacing or dropping a patch changes the
+fingerprint of its tract, so that the next export rewrites only the tracts
+whose fingerprints have changed (and all of them if the columns have).
+
+pyarrow is required only by this module.
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from . import common
+from . import config
+from . import query
+
+# Name of the manifest in the output directory
+manifestName = "manifest.json"
+
+
+def export(schemaName, view, outputDir, columns=None, tracts=None,
+           nConnections=None, rowGroupRows=None, compression="snappy", force=False):
+    """
+    Export the dpdd view of a schema to Parquet files, a file per tract.
+    @param schemaName (str)
+        Name of the schema
+    @param view (lib.dpdd.DpddView)
+        Builder of the view, for its name and column types.
+    @param outputDir (str)
+        Directory of the Parquet files and the manifest.
+    @param columns (list of str)
+        Names of columns (lowercase) to export. All columns if None.
+    @param tracts (list of int)
+        Export only these tracts. All the tracts inserted if None.
+    @param nConnections (int)
+        Number of tracts exported concurrently.
+        Defaults to config.scanConnections.
+    @param rowGroupRows (int)
+        Rows in a row group. Defaults to config.exportRowGroupRows.
+    @param compression (str)
+        Compression of the Parquet files, as in pyarrow.parquet.write_table().
+    @param force (bool)
+        If True, export tracts even if they have not changed.
+    @return (list of int)
+        Tracts exported.
+    """
+    pyarrow, parquet = import_pyarrow()
+
+    if nConnections is None:
+        nConnections = config.scanConnections
+    if rowGroupRows is None:
+        rowGroupRows = config.exportRowGroupRows
+
+    formats = query.get_dpdd_formats(view, columns)
+
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            fingerprints = get_fingerprints(cursor, schemaName, tracts)
+    finally:
+        db.close()
+
+    os.makedirs(outputDir, exist_ok=True)
+    manifest = read_manifest(outputDir)
+    if manifest.get("schema") != schemaName or manifest.get("columns") != formats:
+        manifest = {"schema": schemaName, "columns": formats, "tracts": {}}
+
+    if tracts is None:
+        # Tracts dropped from the schema
+        for tract in get_removed_tracts(manifest, fingerprints):
+            path = os.path.join(outputDir, manifest["tracts"].pop(str(tract))["file"])
+            if os.path.exists(path):
+                os.remove(path)
+        write_manifest(outputDir, manifest)
+
+    todo = fingerprints if force else get_stale_tracts(manifest, fingerprints)
+    if not todo:
+        return []
+
+    statement = """
+    SELECT * FROM "{schemaName}"."{view.view_name}" WHERE public.tractSearch(objectid, %s)
+    """.format(**locals())
+
+    pending = queue.Queue()
+    for tract in sorted(todo):
+        pending.put(tract)
+
+    lock = threading.Lock()
+    exported = []
+    failures = []
+
+    def run():
+        db = common.new_db_connection()
+        db.set_session(readonly=True)
+        try:
+            with db.cursor() as cursor:
+                while True:
+                    try:
+                        tract = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.time()
+                    fileName = "tract_{}.parquet".format(tract)
+                    try:
+                        data = query.read(cursor, statement, formats, (tract,))
+                        db.rollback()
+                        nRows = write_parquet(os.path.join(outputDir, fileName), data,
+                                              rowGroupRows, compression)
+                    except Exception as e:
+                        db.rollback()
+                        with lock:
+                            failures.append(tract)
+                            print("Failed: tract {}: {}: {}".format(tract, type(e).__name__, e))
+                            sys.stdout.flush()
+                        continue
+                    dt = time.time() - start
+                    with lock:
+                        manifest["tracts"][str(tract)] = {
+                            "fingerprint": todo[tract], "file": fileName, "rows": nRows}
+                        write_manifest(outputDir, manifest)
+                        exported.append(tract)
+                        print("tract {tract}: {nRows} rows in {dt:.1f} sec".format(**locals()))
+                        sys.stdout.flush()
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=run) for i in range(max(1, min(nConnections, len(todo))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        raise RuntimeError("Failed to export {} tracts: {}".format(
+            len(failures), ", ".join(str(tract) for tract in sorted(failures))))
+
+    return exported
+
+
+def import_pyarrow():
+    """
+    @return (module, module)
+        pyarrow and pyarrow.parquet.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required to export catalogs to Parquet")
+    return pyarrow, pyarrow.parquet
+
+
+def get_fingerprints(cursor, schemaName, tracts=None):
+    """
+    Get fingerprints of the patches inserted into tracts.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName (str)
+        Name of the schema
+    @param tracts (list of int)
+        Only these tracts if not None.
+    @return (dict)
+        Tract -> fingerprint (str), for tracts with patches inserted.
+    """
+    cursor.execute("""
+    SELECT to_regclass(%s)
+    """, ('"{}"."_temp:forced_patch"'.format(schemaName),)
+    )
+    if cursor.fetchone()[0] is None:
+        raise RuntimeError('No table "_temp:forced_patch" in {}'.format(schemaName))
+
+    # file_id = (tract*10000 + patch)*100 + filter
+    condition = "WHERE file_id / 1000000 = ANY(%s)" if tracts is not None else ""
+    cursor.execute("""
+    SELECT file_id / 1000000,
+        md5(string_agg(file_id::text || ':' || xmin::text, ',' ORDER BY file_id))
+    FROM "{schemaName}"."_temp:forced_patch"
+    {condition}
+    GROUP BY 1
+    """.format(**locals()), (list(tracts),) if tracts is not None else None
+    )
+    return dict(cursor.fetchall())
+
+
+def get_stale_tracts(manifest, fingerprints):
+    """
+    @param manifest (dict)
+        See read_manifest().
+    @param fingerprints (dict)
+        Tract -> fingerprint. See get_fingerprints().
+    @return (dict)
+        Tract -> fingerprint, of the tracts not exported
+        since their fingerprints changed.
+    """
+    exported = manifest.get("tracts", {})
+    return dict(
+        (tract, fingerprint) for tract, fingerprint in fingerprints.items()
+        if exported.get(str(tract), {}).get("fingerprint") != fingerprint
+    )
+
+
+def get_removed_tracts(manifest, fingerprints):
+    """
+    @return (list of int)
+        Tracts in the manifest that are no longer in the schema.
+    """
+    return sorted(int(tract) for tract in manifest.get("tracts", {})
+                  if int(tract) not in fingerprints)
+
+
+def read_manifest(outputDir):
+    """
+    @param outputDir (str)
+        Output directory of export().
+    @return (dict)
+        {"schema": str, "columns": [[name, format], ...],
+         "tracts": {str(tract): {"fingerprint": str, "file": str, "rows": int}}},
+        or an empty dict if there is no manifest.
+    """
+    path = os.path.join(outputDir, manifestName)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest["columns"] = [tuple(column) for column in manifest.get("columns", [])]
+    return manifest
+
+
+def write_manifest(outputDir, manifest):
+    """
+    Write the manifest, replacing the old one at once
+    so that an interrupted export leaves a valid manifest.
+    """
+    path = os.path.join(outputDir, manifestName)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def write_parquet(path, data, rowGroupRows, compression="snappy"):
+    """
+    Write columns to a Parquet file.
+    @param path (str)
+        Path to the file, replaced at once when it has been written.
+    @param data (collections.OrderedDict)
+        Name -> numpy.array, as returned by lib.query.read().
+        Columns of shape (n, 3) ("earth") are written as lists of 3 doubles.
+    @param rowGroupRows (int)
+        Rows in a row group.
+    @param compression (str)
+        As in pyarrow.parquet.write_table().
+    @return (int)
+        Number of rows.
+    """
+    pyarrow, parquet = import_pyarrow()
+
+    arrays = []
+    for array in data.values():
+        if array.ndim == 2:
+            arrays.append(pyarrow.FixedSizeListArray.from_arrays(
+                pyarrow.array(array.reshape(-1)), array.shape[1]))
+        else:
+            arrays.append(pyarrow.array(array))
+    table = pyarrow.Table.from_arrays(arrays, names=list(data))
+
+    parquet.write_table(table, path + ".tmp", row_group_size=rowGroupRows,
+                        compression=compression, write_statistics=True)
+    os.replace(path + ".tmp", path)
+    return table.num_rows
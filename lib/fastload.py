@@ -0,0 +1,108 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fast initial load.
+
+With config.unloggedTables, tables (and the bookkeeping tables recording
+what has been inserted) are created UNLOGGED, so that rows COPY'ed into
+them are not written to WAL one by one. This pays only if the server's
+wal_level is "minimal": otherwise "SET LOGGED" writes the whole tables
+to WAL in the end anyway (see use_unlogged_tables()). A crash of the server empties
+unlogged tables, bookkeeping included, so an interrupted load can simply
+be run again.
+
+After the load, finish() sets the tables LOGGED and freezes them at once,
+instead of leaving the freezing to anti-wraparound autovacuum weeks later.
+"""
+
+from . import common
+from . import indexbuilder
+from . import misc
+
+
+def use_unlogged_tables():
+    """
+    Tell whether tables should be created UNLOGGED for a fast load.
+    A warning is shown if they should not.
+    @return (bool)
+        True if the server's wal_level is "minimal", under which "SET LOGGED"
+        is not WAL-logged. Under "replica" or "logical", "SET LOGGED" writes
+        whole tables to WAL, which may cost more than logging the COPYs.
+    """
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SHOW wal_level")
+            walLevel, = cursor.fetchone()
+    finally:
+        db.close()
+
+    if walLevel != "minimal":
+        misc.warning("--fast-load creates tables LOGGED because wal_level is {}, not minimal".format(walLevel))
+        return False
+    return True
+
+
+def get_unlogged_tables(cursor, schemaName):
+    """
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema
+    @return
+        Full, quoted names of the unlogged tables in the schema.
+    """
+    cursor.execute("""
+    SELECT
+        c.relname
+    FROM
+        pg_class c JOIN pg_namespace n ON c.relnamespace = n.oid
+    WHERE
+        n.nspname = %s
+        AND c.relpersistence = 'u'
+        AND c.relkind IN ('r', 'p')
+    ORDER BY
+        c.relname
+    """, (schemaName,)
+    )
+    return ['"{}"."{}"'.format(schemaName, name) for name, in cursor.fetchall()]
+
+
+def finish(schemaName, dryrun=False):
+    """
+    Set the unlogged tables of a schema LOGGED, and VACUUM (FREEZE, ANALYZE)
+    them. Tables are processed concurrently as lib.indexbuilder does.
+    @param schemaName
+        Name of the schema
+    @param dryrun
+        If True, just print the statements.
+    """
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            tables = get_unlogged_tables(cursor, schemaName)
+    finally:
+        db.close()
+
+    jobs = [
+        indexbuilder.IndexJob(table, table, [
+            "ALTER TABLE {table} SET LOGGED".format(**locals()),
+            "VACUUM (FREEZE, ANALYZE) {table}".format(**locals()),
+        ])
+        for table in tables
+    ]
+    indexbuilder.build(jobs, dryrun=dryrun)
@@ -22,11 +22,17 @@ except ImportError:
 
 import numpy
 
+from . import metrics
+
 import gzip
 import io
+import mmap
 import os
 import re
+import threading
+import zlib
 
+@metrics.timer("fits_read")
 def fits_open(path, headerOnly = False):
     """
     Open a FITS file ignoring the 3rd HDU and the latter ignored.
@@ -40,7 +46,7 @@ def fits_open(path, headerOnly = False):
     @return
         pyfits HDUList object.
     """
-    header = b""
+    header = []
     dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
 
     if os.path.exists(path):
@@ -55,7 +61,7 @@ def fits_open(path, headerOnly = False):
         chunk = fin.read(2880)
         arr = numpy.frombuffer(chunk, dtype=dtype)
 
-        header += chunk
+        header.append(chunk)
         if numpy.any(arr["key"] == b'END     '): break
 
     if headerOnly:
@@ -64,7 +70,7 @@ def fits_open(path, headerOnly = False):
             arr = numpy.copy(numpy.frombuffer(chunk, dtype=dtype))
             arr["value"][arr["key"] == b'NAXIS2  '] = b'=                    0 / length of data axis 2                          '
 
-            header += memoryview(arr).tobytes()
+            header.append(memoryview(arr).tobytes())
             if numpy.any(arr["key"] == b'END     '): break
     else:
         bitpix = None
@@ -73,7 +79,7 @@ def fits_open(path, headerOnly = False):
         while True:
             chunk = fin.read(2880)
             arr = numpy.frombuffer(chunk, dtype=dtype)
-            header += chunk
+            header.append(chunk)
 
             arrBitpix = arr["value"][arr["key"] == b'BITPIX  ']
             arrNaxis1 = arr["value"][arr["key"] == b'NAXIS1  ']
@@ -87,7 +93,396 @@ def fits_open(path, headerOnly = False):
 
             if numpy.any(arr["key"] == b'END     '): break
 
-        header += fin.read(((abs(bitpix)*width*height + (8*2880-1))//(8*2880))*2880)
+        header.append(fin.read(((abs(bitpix)*width*height + (8*2880-1))//(8*2880))*2880))
 
     fin.close()
-    return pyfits.open(io.BytesIO(header), uint=True)
+    return pyfits.open(io.BytesIO(b"".join(header)), uint=True)
+
+
+def get_nrows(path):
+    """
+    Get the number of rows (NAXIS2) of the 2nd HDU of a FITS file,
+    reading only its headers.
+    The primary HDU must be empty, as in fits_open().
+    @param path
+        Path to a FITS file to read.
+        The file may be compressed, but "path" must ends with ".fits".
+        The prefix ".gz" will be added automatically by this function.
+    @return (int)
+    """
+    if os.path.exists(path):
+        fin = open(path, "rb")
+    elif os.path.exists(path + ".gz"):
+        fin = gzip.open(path + ".gz", "rb")
+    else:
+        raise RuntimeError("File inaccessible: " + path)
+
+    with fin:
+        nHeaders = 0
+        while True:
+            chunk = fin.read(2880)
+            if len(chunk) < 2880:
+                raise RuntimeError("File truncated: " + path)
+            for i in range(0, 2880, 80):
+                key = chunk[i:i+8]
+                if nHeaders == 1 and key == b'NAXIS2  ':
+                    return int(re.match(br"^= *([0-9]+)", chunk[i+8:i+80]).group(1))
+                if key == b'END     ':
+                    nHeaders += 1
+                    break
+
+            if nHeaders == 2:
+                raise RuntimeError("NAXIS2 not found: " + path)
+
+
+def get_file_size(path):
+    """
+    Get the size of a FITS file, uncompressed.
+    @param path
+        Path to a FITS file.
+        The file may be compressed, but "path" must ends with ".fits".
+        The prefix ".gz" will be added automatically by this function.
+    @return (int)
+        Number of bytes. For a compressed file, that recorded in its
+        gzip trailer (modulo 2**32, as gzip records it).
+    """
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    elif os.path.exists(path + ".gz"):
+        with open(path + ".gz", "rb") as fin:
+            fin.seek(-4, io.SEEK_END)
+            return int.from_bytes(fin.read(4), "little")
+    else:
+        raise RuntimeError("File inaccessible: " + path)
+
+
+class BinTable(object):
+    """
+    Binary table in the 2nd HDU of a FITS file, read without copying.
+
+    The file is memory-mapped, or if it is compressed, decompressed into
+    a buffer that is reused by the next BinTable. In either case,
+    "view" is a numpy structured array of the rows in FITS's big-endian
+    layout, and columns are decoded (copied) only when column(),
+    flag_bits() or read() is called. The primary HDU must be empty, as in fits_open().
+    """
+    __slots__ = ["header", "nRows", "view", "__columns", "__mmap", "__offset"]
+
+    def __init__(self, path):
+        """
+        @param path
+            Path to a FITS file to read.
+            The file may be compressed, but "path" must ends with ".fits".
+            The prefix ".gz" will be added automatically by this function.
+        """
+        with metrics.timer("fits_open"):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                buf = numpy.frombuffer(self.__mmap, dtype=numpy.uint8)
+                metrics.count("input_bytes", len(buf))
+            elif os.path.exists(path + ".gz"):
+                metrics.count("input_bytes", os.path.getsize(path + ".gz"))
+                buf = _gunzip(path + ".gz")
+                self.__mmap = None
+            else:
+                raise RuntimeError("File inaccessible: " + path)
+        metrics.count("files")
+
+        # skip primary hdu (which is header-only)
+        start = _find_header_end(buf, 0)
+        end = _find_header_end(buf, start)
+
+        self.header = pyfits.Header.fromstring(buf[start:end].tobytes().decode("ascii"))
+        if self.header.get("XTENSION", "").strip() != "BINTABLE":
+            raise RuntimeError("Not a binary table: " + path)
+
+        rowSize = self.header["NAXIS1"]
+        self.nRows = self.header["NAXIS2"]
+        if len(buf) < end + rowSize * self.nRows:
+            raise RuntimeError("File truncated: " + path)
+
+        # Map from TTYPE -> (index, TFORM code, repeat)
+        self.__columns = {}
+        names = []
+        formats = []
+        offsets = []
+        offset = 0
+        for i in range(1, 1 + self.header["TFIELDS"]):
+            code, repeat, dtype, width = _parse_tform(self.header["TFORM{}".format(i)])
+            if code not in ("A", "X") and repeat != 1:
+                dims = self.header.get("TDIM{}".format(i))
+                if dims is not None:
+                    shape = tuple(reversed([int(d) for d in dims.strip("() ").split(",")]))
+                else:
+                    shape = (repeat,)
+                dtype = numpy.dtype((dtype, shape))
+
+            name = self.header.get("TTYPE{}".format(i), "")
+            self.__columns[name] = (i, code, repeat)
+            names.append("c{}".format(i))
+            formats.append(dtype)
+            offsets.append(offset)
+            offset += width
+
+        if offset != rowSize:
+            raise RuntimeError("Width of columns does not agree with NAXIS1: " + path)
+
+        self.__offset = end
+        rowType = numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": rowSize})
+        self.view = numpy.ndarray(shape=(self.nRows,), dtype=rowType, buffer=buf, offset=end)
+
+    def column_names(self):
+        """
+        @return (list of str)
+            TTYPEs in the order of columns.
+        """
+        return list(self.__columns)
+
+    def column(self, name):
+        """
+        Decode a column to a native-endian numpy.array.
+        Logical columns become bool arrays, and integers with
+        TZERO = 2**(bits-1) become unsigned integers (as pyfits.open(uint=True)).
+        Bit ("X") columns become arrays of packed bytes; see flag_bits().
+        @param name (str)
+            TTYPE of the column
+        @return (numpy.array)
+        """
+        i, code, repeat = self.__columns[name]
+        return self.__decode(i, code, self.view["c{}".format(i)])
+
+    def flag_bits(self, name, bits):
+        """
+        Decode some bits of a bit ("X") column.
+        @param name (str)
+            TTYPE of the column
+        @param bits (list of int)
+            0-based indices of the bits. (Bit 0 is the MSB of the 1st byte.)
+        @return (list of numpy.array)
+            Bool array for each of "bits".
+        """
+        i, code, repeat = self.__columns[name]
+        if code != "X":
+            raise RuntimeError("Not a bit column: " + name)
+
+        return _unpack_bits(self.view["c{}".format(i)], bits)
+
+    @metrics.timer("fits_read")
+    def read(self, names, flagName=None, bits=[]):
+        """
+        Decode columns and bits, as column() and flag_bits() do,
+        but a block of rows at a time. The pages of the file mapped
+        to memory are released after each block is decoded,
+        so that only the decoded columns remain resident.
+        @param names (list of str)
+            TTYPEs of columns to decode.
+        @param flagName (str)
+            TTYPE of the bit column, if "bits" are not empty.
+        @param bits (list of int)
+            See flag_bits().
+        @return (list of numpy.array, list of numpy.array)
+            Decoded columns and bits.
+        """
+        columns = [None] * len(names)
+        flags = [numpy.empty(self.nRows, dtype=bool) for bit in bits]
+
+        for start in range(0, max(self.nRows, 1), _readBlockRows):
+            stop = min(start + _readBlockRows, self.nRows)
+            view = self.view[start:stop]
+            for k, name in enumerate(names):
+                i, code, repeat = self.__columns[name]
+                data = self.__decode(i, code, view["c{}".format(i)])
+                if columns[k] is None:
+                    columns[k] = numpy.empty((self.nRows,) + data.shape[1:], dtype=data.dtype)
+                columns[k][start:stop] = data
+
+            if bits:
+                i, code, repeat = self.__columns[flagName]
+                if code != "X":
+                    raise RuntimeError("Not a bit column: " + flagName)
+                for flag, data in zip(flags, _unpack_bits(view["c{}".format(i)], bits)):
+                    flag[start:stop] = data
+
+            self.__release(start, stop)
+
+        return columns, flags
+
+    def __release(self, start, stop):
+        """
+        Tell the OS that the pages of rows [start, stop) will not be used
+        any longer, if the file is mapped to memory.
+        """
+        if self.__mmap is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+
+        rowSize = self.view.itemsize
+        begin = (self.__offset + start * rowSize) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = (self.__offset + stop * rowSize) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end > begin:
+            self.__mmap.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+    def __decode(self, i, code, raw):
+        """
+        Decode the raw values of the i-th column. See column().
+        """
+        if code == "L":
+            return raw == ord("T")
+        if code in ("A", "X"):
+            return numpy.array(raw)
+
+        data = raw.astype(raw.dtype.base.newbyteorder("="))
+
+        tzero = self.header.get("TZERO{}".format(i), 0)
+        tscal = self.header.get("TSCAL{}".format(i), 1)
+        if tscal == 1 and code in _unsignedZeros and tzero == _unsignedZeros[code][0]:
+            # Adding 2**(bits-1) is flipping the sign bit
+            unsigned = data.view("u{}".format(data.dtype.itemsize))
+            unsigned ^= unsigned.dtype.type(1 << (8 * data.dtype.itemsize - 1))
+            data = data.view(_unsignedZeros[code][1])
+        elif tzero != 0 or tscal != 1:
+            data = data * tscal + tzero
+
+        return data
+
+
+# Number of rows decoded at a time by BinTable.read()
+_readBlockRows = 65536
+
+
+def _unpack_bits(packed, bits):
+    """
+    Unpack some bits of a bit ("X") column.
+    @param packed (numpy.array)
+        Raw values of the column.
+    @param bits (list of int)
+        See BinTable.flag_bits().
+    @return (list of numpy.array)
+    """
+    if packed.ndim == 1:
+        packed = packed.reshape(-1, 1)
+
+    return [(packed[:, bit // 8] & (0x80 >> (bit % 8))) != 0 for bit in bits]
+
+
+# TFORM code -> (big-endian dtype, width in bytes)
+_tformTypes = {
+    "L": ("i1", 1),
+    "B": ("u1", 1),
+    "I": (">i2", 2),
+    "J": (">i4", 4),
+    "K": (">i8", 8),
+    "E": (">f4", 4),
+    "D": (">f8", 8),
+}
+
+# TFORM code -> (TZERO meaning the column is unsigned (signed for "B"), type of the values)
+_unsignedZeros = {
+    "B": (-128, numpy.int8),
+    "I": (1 << 15, numpy.uint16),
+    "J": (1 << 31, numpy.uint32),
+    "K": (1 << 63, numpy.uint64),
+}
+
+_tformPattern = re.compile(r"^\s*([0-9]*)([A-Z])")
+
+
+def _parse_tform(tform):
+    """
+    Parse TFORMn.
+    @return (code, repeat, dtype, width)
+        dtype is that of an element for numeric columns,
+        and that of the whole cell for "A" and "X".
+    """
+    m = _tformPattern.match(tform)
+    if not m:
+        raise RuntimeError("Invalid TFORM: " + tform)
+
+    repeat = int(m.group(1)) if m.group(1) else 1
+    code = m.group(2)
+
+    if code == "A":
+        return code, repeat, numpy.dtype("S{}".format(repeat)), repeat
+    if code == "X":
+        nBytes = (repeat + 7) // 8
+        return code, repeat, numpy.dtype(("u1", (nBytes,))), nBytes
+    if code in _tformTypes:
+        dtype, width = _tformTypes[code]
+        return code, repeat, numpy.dtype(dtype), width * repeat
+
+    raise RuntimeError("TFORM not supported: " + tform)
+
+
+def _find_header_end(buf, start):
+    """
+    Find the end of a header.
+    @param buf (numpy.array)
+        uint8 array of the file.
+    @param start (int)
+        Offset of the header.
+    @return (int)
+        Offset of the 2880-byte block following the header.
+    """
+    dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
+    pos = start
+    while pos + 2880 <= len(buf):
+        arr = buf[pos:pos + 2880].view(dtype)
+        pos += 2880
+        if numpy.any(arr["key"] == b'END     '):
+            return pos
+
+    raise RuntimeError("FITS header is not terminated")
+
+
+# Buffer of _gunzip(), one per thread (see lib.pipeline)
+_gzipBuffers = threading.local()
+
+
+def _gunzip(path):
+    """
+    Decompress a file into the buffer of this thread.
+    The returned array is overwritten when the next file is decompressed
+    in the same thread.
+    @return (numpy.array)
+        uint8 array of the decompressed data.
+    """
+    _gzipBuffer = getattr(_gzipBuffers, "buffer", None)
+    if _gzipBuffer is None:
+        _gzipBuffer = numpy.empty(0, dtype=numpy.uint8)
+
+    with open(path, "rb") as fin:
+        # ISIZE in the trailer: the size of the data modulo 2**32
+        fin.seek(-4, io.SEEK_END)
+        size = int.from_bytes(fin.read(4), "little")
+        fin.seek(0)
+
+        if len(_gzipBuffer) < size:
+            _gzipBuffer = numpy.empty(size, dtype=numpy.uint8)
+            _gzipBuffers.buffer = _gzipBuffer
+
+        buf = _gzipBuffer
+        length = 0
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b""
+        while True:
+            if not pending:
+                pending = fin.read(1 << 20)
+                if not pending:
+                    break
+            if decomp.eof:
+                # Next member
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            # Limit the output so that no big bytes object is made
+            data = decomp.decompress(pending, 1 << 22)
+            pending = decomp.unused_data if decomp.eof else decomp.unconsumed_tail
+
+            if length + len(data) > len(buf):
+                # ISIZE was wrong (the data is larger than 4GB or
+                # the file has more than one member).
+                buf = numpy.concatenate([buf[:length], numpy.empty(max(len(buf), length + len(data)), dtype=numpy.uint8)])
+                _gzipBuffers.buffer = buf
+            buf[length:length + len(data)] = numpy.frombuffer(data, dtype=numpy.uint8)
+            length += len(data)
+
+    return buf[:length]
@@ -158,3 +158,25 @@ forced_algos_ignored = [
     "ext_convolved_ConvolvedFlux_",
     "undeblended_ext_convolved_ConvolvedFlux",
 ]
+
+
+def get_field_filter(algos, ignored):
+    """
+    Get a predicate telling whether a field in a catalog file is to be read.
+    Fields are cut out by the algos before the rest are ignored by prefix,
+    so a field is not needed only if it matches an ignored prefix and it is
+    not in the namespace of any algo.
+    @param algos (iterable of str)
+        Algo names, e.g. ref_algos.
+    @param ignored (iterable of str)
+        Ignored prefixes, e.g. ref_algos_ignored.
+    @return (callable)
+        keep(name: str) -> bool. See SourceTable.from_fits().
+    """
+    algos = tuple(algos)
+    ignored = tuple(ignored)
+
+    def keep(name):
+        return name.startswith(algos) or not name.startswith(ignored)
+
+    return keep
@@ -18,6 +18,7 @@ import re
 import os,sys
 
 from  .finderbase import Finder
+from  .manifest import Manifest
 
 class ForcedSourceFinder(Finder):
     """
@@ -68,8 +69,10 @@ class ForcedSourceFinder(Finder):
         # Files of this length have no data
         self.min_len = min_len
 
-        # Convenience to avoid recalculating
-        self.__subdirs = []
+        # Index of the files (see lib.manifest), made when first needed
+        self.__manifest = None
+        # Map from visit (int) -> visit directory name
+        self.__visitDirs = None
 
     def get_determiners(self) :
         """
@@ -128,14 +131,7 @@ class ForcedSourceFinder(Finder):
             if sensor is not None:
                 if re.fullmatch(self.ccd_re, sensor) is None:
                     raise ValueError("get_file_path: bad sensor argument: " + str(sensor))
-        visitstr = '{:08}'.format(visit)
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        visit_dir = None
-        for s in self.__subdirs:
-            if re.match(visitstr, s):
-                visit_dir = s
-                break
+        visit_dir = self._get_visit_dirs().get(visit)
         if visit_dir is None: return None
         if raft is None:     # Only asked for visit directory
             return os.path.join(self.rootdir, visit_dir)
@@ -143,13 +139,10 @@ class ForcedSourceFinder(Finder):
         raft_dir = os.path.join(self.rootdir,visit_dir, raft)
         if sensor is None:
             return raft_dir
-        files = os.listdir(raft_dir)
-        for f in files:
-            starts_with = self.basename_fmt.format(visit_dir, raft, sensor)
-            if re.match(starts_with, f) and re.fullmatch(self.basename_re, f):
-                return os.path.join(raft_dir, f)
-
-        return None
+        entry = self._get_manifest().find_one(visit=visit, raft=raft[1:],
+                                              sensor=sensor[1:])
+        if entry is None: return None
+        return entry.path
 
     def get_some_file(self) :
         """
@@ -160,26 +153,12 @@ class ForcedSourceFinder(Finder):
         tuple of full file path (str) and dict of determiners
         """
 
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        for v in self.__subdirs:
-            visit = v[:-2]    # strip off filter
-            visit_dir = os.path.join(self.rootdir, v)
-            rdirs = os.listdir(visit_dir)
-            for r in rdirs:
-                if re.fullmatch(self.raft_re, r):
-                    raft = r[1:]
-                    fs = os.listdir(os.path.join(visit_dir, r))
-                    for f in fs:
-                        #print('Found a file ', f)
-                        m = re.fullmatch(self.basename_re, f)
-                        if m:
-                            d = {'visit' : m.group(1),
-                                 'raft' : m.group(2),
-                                 'sensor' : m.group(3)}
-                            return os.path.join(visit_dir, r, f), d
-                
-        return None
+        entry = self._get_manifest().find_one(kind='forced')
+        if entry is None: return None
+        d = {'visit' : '{:08}'.format(entry.visit),
+             'raft' : entry.raft,
+             'sensor' : entry.sensor}
+        return entry.path, d
 
     def get_visit_files(self, visit, nonempty=True):
         """
@@ -190,28 +169,21 @@ class ForcedSourceFinder(Finder):
         visit : int
             visit for which filepaths are requested
         nonempty : bool
-            if true only return files of size greater than min length
-            set at initialization
+            if true only return files whose table has rows
+            (or, if the header cannot be read, whose size is greater than
+            min length set at initialization)
 
         Returns
         -------
         list of full filepaths (strings)
         """
-        visitdir = self.get_file_path(visit)
-        if visitdir is None: 
-            return []
-        print('File path for visit ', visit, ' is: ', visitdir)
         files = []
-        for d in os.listdir(visitdir):
-            if re.fullmatch(self.raft_re, d):
-                rdir = os.path.join(visitdir, d)
-                print('Found raft dir ',rdir)
-                for f in os.listdir(rdir):
-                    if re.fullmatch(self.basename_re, f):
-                        if nonempty:
-                            s = os.stat(os.path.join(rdir,f))
-                            if (s.st_size <= self.min_len) : continue
-                        files.append(os.path.join(rdir, f))
+        for entry in self._get_manifest().find(visit=visit):
+            if nonempty:
+                if entry.nRows is not None:
+                    if entry.nRows == 0: continue
+                elif entry.size <= self.min_len: continue
+            files.append(entry.path)
         return files
 
     def get_visits(self):
@@ -221,11 +193,42 @@ class ForcedSourceFinder(Finder):
         sorted list of ints, identifying visits
 
         """
-        if len(self.__subdirs) == 0:
-            self.__subdirs = os.listdir(self.rootdir)
-        visits = []
-        for v in self.__subdirs:
-            visits.append(int(v[:-2])) # strip off filter
+        return sorted(self._get_visit_dirs())
 
-        visits.sort()
-        return visits
+    def _get_manifest(self):
+        """
+        Get the index of the files under rootdir.
+        """
+        if self.__manifest is None:
+            self.__manifest = Manifest(self.rootdir, 'forced', self._classify,
+                                       depth=2)
+        return self.__manifest
+
+    def _get_visit_dirs(self):
+        """
+        Returns
+        -------
+        dict mapping visit (int) -> name of the visit directory
+        """
+        if self.__visitDirs is None:
+            self.__visitDirs = {}
+            for d in self._get_manifest().top_dirs():
+                m = re.fullmatch(self.visitdir_re, d)
+                if m:
+                    self.__visitDirs.setdefault(int(m.group(1)), d)
+        return self.__visitDirs
+
+    def _classify(self, relpath):
+        """
+        Keys of a file for the manifest. See lib.manifest.Manifest.
+        """
+        parts = relpath.split(os.sep)
+        if len(parts) != 3: return None
+        if re.fullmatch(self.visitdir_re, parts[0]) is None: return None
+        if re.fullmatch(self.raft_re, parts[1]) is None: return None
+        m = re.fullmatch(self.basename_re, parts[2])
+        if m is None: return None
+        return {'kind' : 'forced',
+                'visit' : int(m.group(1)),
+                'raft' : m.group(2),
+                'sensor' : m.group(3)}
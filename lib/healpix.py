@@ -0,0 +1,309 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+HEALPix pixel numbers in the NESTED scheme.
+
+The "healpix" column of the position table holds the pixel of each object
+at order config.healpixOrder. In the nested scheme, pixel p at order k
+contains pixels [p << 2(K-k), (p+1) << 2(K-k)) at order K, so a region
+covered by a few pixels at a coarse order is a few ranges of the column,
+searched with a btree index.
+
+cone_ranges() is the algorithm of healpixConeSearch() in
+postgres-objcatalog/sql/objcatalog.sql.in, kept here to test it:
+the cone is covered by the pixel of its center and the neighbours of that
+pixel, at the finest order whose pixels are wide enough.
+
+The formulae are those of healpix_base.cc of the HEALPix C++ library
+(K. M. Gorski et al., 2005, ApJ, 622, 759).
+"""
+
+import math
+
+import numpy
+
+# Highest order whose pixel numbers fit in Bigint
+maxOrder = 29
+
+# A cone is covered by the neighbours of its center pixel at order k
+# if its radius is at most coverFactor * (mean pixel size at order k).
+# (Points out of them are found at about 0.7 times the mean pixel size,
+# near the corners of the base pixels. See test_healpix.py)
+coverFactor = 0.35
+
+# Neighbours: offsets of (x, y), and tables of healpix_base.cc
+_xoffset = [-1, -1, 0, 1, 1, 1, 0, -1]
+_yoffset = [0, 1, 1, 1, 0, -1, -1, -1]
+_facearray = [
+    [ 8,  9, 10, 11, -1, -1, -1, -1, 10, 11,  8,  9],  # S
+    [ 5,  6,  7,  4,  8,  9, 10, 11,  9, 10, 11,  8],  # SE
+    [-1, -1, -1, -1,  5,  6,  7,  4, -1, -1, -1, -1],  # E
+    [ 4,  5,  6,  7, 11,  8,  9, 10, 11,  8,  9, 10],  # SW
+    [ 0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11],  # center
+    [ 1,  2,  3,  0,  0,  1,  2,  3,  5,  6,  7,  4],  # NE
+    [-1, -1, -1, -1,  7,  4,  5,  6, -1, -1, -1, -1],  # W
+    [ 3,  0,  1,  2,  3,  0,  1,  2,  4,  5,  6,  7],  # NW
+    [ 2,  3,  0,  1, -1, -1, -1, -1,  0,  1,  2,  3],  # N
+]
+_swaparray = [
+    [0, 0, 3],  # S
+    [0, 0, 6],  # SE
+    [0, 0, 0],  # E
+    [0, 0, 5],  # SW
+    [0, 0, 0],  # center
+    [5, 0, 0],  # NE
+    [0, 0, 0],  # W
+    [6, 0, 0],  # NW
+    [3, 0, 0],  # N
+]
+
+
+def ang2pix_nest(order, ra, dec):
+    """
+    Get nested pixel numbers of positions.
+    @param order (int)
+        HEALPix order (nside = 2**order), at most maxOrder.
+    @param ra (numpy.array)
+        Right ascension in degrees.
+    @param dec (numpy.array)
+        Declination in degrees.
+    @return (numpy.array of int64)
+        Pixel numbers. -1 where the position is not finite.
+    """
+    if not (0 <= order <= maxOrder):
+        raise RuntimeError("HEALPix order out of range: {}".format(order))
+
+    ra = numpy.asarray(ra, dtype=numpy.float64)
+    dec = numpy.asarray(dec, dtype=numpy.float64)
+    valid = numpy.isfinite(ra) & numpy.isfinite(dec)
+    ra = numpy.where(valid, ra, 0.0)
+    dec = numpy.where(valid, dec, 0.0)
+
+    nside = 1 << order
+    z = numpy.sin(numpy.radians(dec))
+    za = numpy.abs(z)
+    tt = numpy.mod(ra / 90.0, 4.0)
+    tt = numpy.where(tt < 4.0, tt, 0.0)
+
+    # Equatorial region, za <= 2/3
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * (z * 0.75)
+    jp = (temp1 - temp2).astype(numpy.int64)  # index of ascending edge line
+    jm = (temp1 + temp2).astype(numpy.int64)  # index of descending edge line
+    ifp = jp >> order
+    ifm = jm >> order
+    face = numpy.where(ifp == ifm, ifp | 4, numpy.where(ifp < ifm, ifp, ifm + 8))
+    ix = jm & (nside - 1)
+    iy = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps, za > 2/3
+    polar = za > 2.0/3.0
+    ntt = numpy.minimum(3, tt.astype(numpy.int64))
+    tp = tt - ntt
+    with numpy.errstate(invalid="ignore"):
+        tmp = numpy.where(za < 0.99,
+            nside * numpy.sqrt(3.0 * (1.0 - za)),
+            nside * numpy.cos(numpy.radians(dec)) / numpy.sqrt((1.0 + za) / 3.0),
+        )
+    pjp = numpy.minimum((tp * tmp).astype(numpy.int64), nside - 1)  # increasing edge line
+    pjm = numpy.minimum(((1.0 - tp) * tmp).astype(numpy.int64), nside - 1)  # decreasing edge line
+    north = z >= 0
+    face = numpy.where(polar, numpy.where(north, ntt, ntt + 8), face)
+    ix = numpy.where(polar, numpy.where(north, nside - pjm - 1, pjp), ix)
+    iy = numpy.where(polar, numpy.where(north, nside - pjp - 1, pjm), iy)
+
+    pix = (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
+    pix[~valid] = -1
+    return pix
+
+
+def _spread_bits(v):
+    """
+    Put bit i of v at bit 2i.
+    @param v (numpy.array of int64)
+    """
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compress_bits(v):
+    """
+    Put bit 2i of v at bit i. Inverse of _spread_bits().
+    @param v (int)
+    """
+    result = 0
+    for i in range(maxOrder):
+        result |= ((v >> (2 * i)) & 1) << i
+    return result
+
+
+def nest2xyf(order, pix):
+    """
+    @param pix (int)
+    @return (int, int, int)
+        (x, y, face) of the pixel.
+    """
+    npface = 1 << (2 * order)
+    face, pix = divmod(pix, npface)
+    return _compress_bits(pix), _compress_bits(pix >> 1), face
+
+
+def xyf2nest(order, x, y, face):
+    """
+    @return (int)
+        Pixel number of (x, y, face).
+    """
+    return (face << (2 * order)) + int(_spread_bits(numpy.int64(x))) + (int(_spread_bits(numpy.int64(y))) << 1)
+
+
+def neighbours(order, pix):
+    """
+    @param pix (int)
+    @return (list of int)
+        The 8 neighbours (SW, W, NW, N, NE, E, SE, S) of the pixel.
+        -1 for neighbours that do not exist.
+    """
+    nside = 1 << order
+    ix, iy, face = nest2xyf(order, pix)
+    result = []
+    for i in range(8):
+        x = ix + _xoffset[i]
+        y = iy + _yoffset[i]
+        nbnum = 4
+        if x < 0:
+            x += nside
+            nbnum -= 1
+        elif x >= nside:
+            x -= nside
+            nbnum += 1
+        if y < 0:
+            y += nside
+            nbnum -= 3
+        elif y >= nside:
+            y -= nside
+            nbnum += 3
+
+        f = _facearray[nbnum][face]
+        if f < 0:
+            result.append(-1)
+            continue
+        bits = _swaparray[nbnum][face >> 2]
+        if bits & 1:
+            x = nside - x - 1
+        if bits & 2:
+            y = nside - y - 1
+        if bits & 4:
+            x, y = y, x
+        result.append(xyf2nest(order, x, y, f))
+    return result
+
+
+def pixel_size(order):
+    """
+    @return (float)
+        Square root of the area of a pixel, in degrees.
+    """
+    return math.degrees(math.sqrt(math.pi / 3.0)) / (1 << order)
+
+
+def cone_order(radius, order=maxOrder):
+    """
+    @param radius (float)
+        Radius of a cone in arcsec.
+    @param order (int)
+        Order of the pixel numbers searched.
+    @return (int)
+        The finest order, not finer than "order", at which a cone is
+        covered by the pixel of its center and its neighbours,
+        or -1 if none is.
+    """
+    ratio = coverFactor * pixel_size(0) * 3600.0 / radius if radius > 0 else float("inf")
+    if ratio < 1.0:
+        return -1
+    return min(order, int(math.floor(math.log2(ratio))))
+
+
+def cone_ranges(ra, dec, radius, order=maxOrder):
+    """
+    @param ra (float)
+    @param dec (float)
+        Center of a cone in degrees.
+    @param radius (float)
+        Radius in arcsec.
+    @param order (int)
+        Order of the pixel numbers searched.
+    @return (list of (int, int))
+        Ranges [lower, upper] (both inclusive) of pixel numbers at "order"
+        that include all positions in the cone, sorted and merged.
+    """
+    k = cone_order(radius, order)
+    if k < 0:
+        return [(0, 12 * (1 << (2 * order)) - 1)]
+
+    center = int(ang2pix_nest(k, numpy.array([ra]), numpy.array([dec]))[0])
+    pixels = sorted(set([center] + [p for p in neighbours(k, center) if p >= 0]))
+
+    shift = 2 * (order - k)
+    ranges = []
+    for p in pixels:
+        if ranges and ranges[-1][1] + 1 == (p << shift):
+            ranges[-1] = (ranges[-1][0], ((p + 1) << shift) - 1)
+        else:
+            ranges.append((p << shift, ((p + 1) << shift) - 1))
+    return ranges
+
+
+def box_cone(ra1, ra2, dec1, dec2):
+    """
+    @param ra1, ra2, dec1, dec2 (float)
+        Box in degrees as given to boxSearch().
+    @return (float, float, float)
+        (ra, dec, radius) of a cone including the box,
+        ra and dec in degrees and radius in arcsec.
+    """
+    ra = 0.5 * (ra1 + ra2)
+    dec = 0.5 * (dec1 + dec2)
+    # The farthest points from the center are corners
+    radius = max(
+        _distance(ra, dec, r, d)
+        for r in (ra1, ra2) for d in (dec1, dec2)
+    )
+    return ra, dec, radius
+
+
+def box_ranges(ra1, ra2, dec1, dec2, order=maxOrder):
+    """
+    @return (list of (int, int))
+        Ranges [lower, upper] of pixel numbers at "order"
+        that include all positions in the box.
+    """
+    return cone_ranges(*box_cone(ra1, ra2, dec1, dec2), order=order)
+
+
+def _distance(ra1, dec1, ra2, dec2):
+    """
+    @return (float)
+        Angular distance in arcsec between two points given in degrees.
+    """
+    ra1, dec1, ra2, dec2 = (math.radians(x) for x in (ra1, dec1, ra2, dec2))
+    h = math.sin(0.5 * (dec2 - dec1))**2 + math.cos(dec1) * math.cos(dec2) * math.sin(0.5 * (ra2 - ra1))**2
+    return math.degrees(2.0 * math.asin(min(1.0, math.sqrt(h)))) * 3600.0
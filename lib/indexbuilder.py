@@ -0,0 +1,174 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Build indexes and constraints concurrently on several connections.
+
+Each IndexJob is a list of SQL statements run in order on one connection,
+each statement in a transaction of its own. Jobs are started in the order
+of decreasing estimated cost (size of the table times the weight of the job),
+so that the largest builds do not start last.
+
+CREATE INDEX on a table takes a lock that does not conflict with other
+CREATE INDEX's on the same table, so they really run concurrently.
+ALTER TABLE (ADD PRIMARY KEY, ADD FOREIGN KEY) waits for them, and
+because no job upgrades a lock within a transaction, jobs cannot deadlock.
+"""
+
+import queue
+import sys
+import threading
+import time
+
+from . import common
+from . import config
+
+
+class IndexJob(object):
+    """
+    Statements building an index or a constraint.
+    """
+    __slots__ = ["name", "table", "statements", "weight"]
+
+    def __init__(self, name, table, statements, weight=1.0):
+        """
+        @param name (str)
+            Name of the job in reports (e.g. the name of the index).
+        @param table (str)
+            Full, quoted name of the table ('"schema"."table"'),
+            whose size is the estimated cost of the job.
+        @param statements (list of str)
+            SQL statements.
+        @param weight (float)
+            Relative cost per byte of the table. (e.g. GiST is slower than btree.)
+        """
+        self.name = name
+        self.table = table
+        self.statements = statements
+        self.weight = weight
+
+
+def build(jobs, nConnections=None, dryrun=False):
+    """
+    Run jobs concurrently.
+    @param jobs (list of IndexJob)
+    @param nConnections (int)
+        Number of connections. Defaults to config.indexConnections.
+    @param dryrun (bool)
+        If True, just print the statements.
+    @return (list of (str, float))
+        Names of the jobs and seconds taken, in the order of completion.
+    """
+    if dryrun:
+        for job in jobs:
+            for statement in job.statements:
+                print(statement)
+        return []
+
+    if not jobs:
+        return []
+
+    if nConnections is None:
+        nConnections = config.indexConnections
+
+    costs = _get_costs(jobs)
+    pending = queue.Queue()
+    for i in sorted(range(len(jobs)), key=lambda i: -costs[i]):
+        pending.put(jobs[i])
+
+    lock = threading.Lock()
+    durations = []
+    failures = []
+
+    def run():
+        db = _new_connection()
+        try:
+            with db.cursor() as cursor:
+                while True:
+                    try:
+                        job = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.time()
+                    try:
+                        for statement in job.statements:
+                            cursor.execute(statement)
+                    except Exception as e:
+                        with lock:
+                            failures.append(job.name)
+                            print("Failed: {}: {}: {}".format(job.name, type(e).__name__, e))
+                            sys.stdout.flush()
+                        continue
+                    dt = time.time() - start
+                    with lock:
+                        durations.append((job.name, dt))
+                        print("{job.name}: {dt:.1f} sec".format(**locals()))
+                        sys.stdout.flush()
+        finally:
+            db.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=run) for i in range(max(1, min(nConnections, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.time() - start
+    print("{} indexes and constraints in {:.1f} sec ({:.1f} sec if built one by one)".format(
+        len(durations), elapsed, sum(dt for name, dt in durations)))
+
+    if failures:
+        raise RuntimeError("Failed to build {} indexes or constraints: {}".format(
+            len(failures), ", ".join(failures)))
+
+    return durations
+
+
+def _new_connection():
+    """
+    Make a connection for building indexes, in autocommit mode.
+    """
+    db = common.new_db_connection()
+    db.set_session(autocommit=True)
+    with db.cursor() as cursor:
+        if config.indexMaintenanceWorkMem:
+            cursor.execute("SET maintenance_work_mem = %s", (config.indexMaintenanceWorkMem,))
+        if config.indexParallelWorkers is not None:
+            cursor.execute("SET max_parallel_maintenance_workers = %s", (config.indexParallelWorkers,))
+    return db
+
+
+def _get_costs(jobs):
+    """
+    Estimate the cost of jobs.
+    @return (list of float)
+    """
+    sizes = {}
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            for table in set(job.table for job in jobs):
+                try:
+                    cursor.execute("SELECT pg_total_relation_size(%s::regclass)", (table,))
+                    sizes[table] = cursor.fetchone()[0] or 0
+                except Exception:
+                    db.rollback()
+                    sizes[table] = 0
+    finally:
+        db.close()
+
+    return [sizes[job.table] * job.weight for job in jobs]
@@ -0,0 +1,321 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Index of the catalog files in a directory tree.
+
+Listing and stat'ing every file of a rerun directory is slow on a
+parallel file system. A Manifest walks the tree once, in parallel per
+top-level directory, and records the files in an SQLite file
+in config.manifestDir. Later, only the directories are stat'ed:
+a top-level directory is walked again if the mtime of any directory
+in it has changed.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+
+from . import config
+from . import fits
+
+Entry = collections.namedtuple("Entry", [
+    "path", "size", "nRows",
+    "kind", "tract", "patch", "filter", "visit", "raft", "sensor",
+])
+Entry.__doc__ = """
+A file in a Manifest:
+  * path: Absolute path, virtualized so it always ends with '.fits'
+          even if the file is compressed.
+  * size: Size of the file in bytes
+  * nRows: NAXIS2 of the 2nd HDU, or None if the header cannot be read
+  * kind, tract, patch, filter, visit, raft, sensor:
+          Keys given by the classifier of the Manifest. (None if not given.)
+"""
+
+_keyNames = Entry._fields[3:]
+
+# Bump this if the layout of the SQLite file changes
+_version = 1
+
+
+class Manifest(object):
+    """
+    Index of the files in a directory tree.
+    """
+
+    def __init__(self, rootDir, layout, classify, depth, nThreads=None):
+        """
+        @param rootDir (str)
+            Root directory of the tree.
+        @param layout (str)
+            Name of the kind of tree (e.g. "coadd"), which must identify
+            "classify" and "depth". Trees of different layouts are recorded
+            in different files even if their "rootDir" is the same.
+        @param classify (callable)
+            classify(relpath: str) -> dict or None.
+            "relpath" is the path to a file relative to "rootDir",
+            with ".gz" removed. Return a dict of the keys of the file
+            (Keys are "kind", "tract", "patch", "filter", "visit", "raft",
+            "sensor"; any of them may be omitted.), or None if the file is
+            not to be recorded.
+        @param depth (int)
+            Depth of directories below "rootDir" containing files.
+            Deeper directories are not walked.
+        @param nThreads (int)
+            Number of threads walking the tree. Defaults to config.manifestThreads.
+        """
+        self.rootDir = os.path.abspath(rootDir)
+        self.layout = layout
+        self.classify = classify
+        self.depth = depth
+        self.nThreads = nThreads if nThreads is not None else config.manifestThreads
+
+        digest = hashlib.sha1(self.rootDir.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(config.manifestDir, "{}-{}.sqlite".format(layout, digest))
+
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__db = None
+        self.refresh()
+
+    def __getstate__(self):
+        # The connection is not to be shared with other processes.
+        # The receiver will reopen the file without refreshing it.
+        return (self.rootDir, self.layout, self.classify, self.depth, self.nThreads, self.path)
+
+    def __setstate__(self, state):
+        self.rootDir, self.layout, self.classify, self.depth, self.nThreads, self.path = state
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__db = None
+
+    def refresh(self):
+        """
+        Update the index to agree with the file system.
+        """
+        with self.__lock:
+            db = self.__connect()
+            known = collections.defaultdict(dict)
+            for path, top, mtime in db.execute("SELECT path, top, mtime FROM dirs"):
+                known[top][path] = mtime
+
+            if not os.path.isdir(self.rootDir):
+                raise RuntimeError("Directory inaccessible: " + self.rootDir)
+            with os.scandir(self.rootDir) as it:
+                current = set(entry.name for entry in it if entry.is_dir())
+
+            with concurrent.futures.ThreadPoolExecutor(max(1, self.nThreads)) as executor:
+                tops = [top for top in current if top in known]
+                changed = executor.map(lambda top: _changed(self.rootDir, known[top]), tops)
+                rescan = sorted(set(current - set(known)) | set(top for top, c in zip(tops, changed) if c))
+                removed = set(known) - current
+
+                walks = executor.map(lambda top: _walk(self.rootDir, top, self.depth, self.classify), rescan)
+
+                with db:
+                    for top in removed | set(rescan):
+                        db.execute("DELETE FROM dirs WHERE top = ?", (top,))
+                        db.execute("DELETE FROM files WHERE top = ?", (top,))
+                    for top, (dirs, files) in zip(rescan, walks):
+                        db.executemany("INSERT INTO dirs VALUES (?, ?, ?)",
+                            [(path, top, mtime) for path, mtime in dirs])
+                        db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(path, top, size, nRows) + tuple(keys.get(k) for k in _keyNames)
+                             for path, size, nRows, keys in files])
+
+    def find(self, **keys):
+        """
+        Find files.
+        @param keys
+            Keys of the files to find (e.g. tract=1234, kind="ref").
+        @return (list of Entry)
+            Sorted by path.
+        """
+        where, values = _where(keys)
+        rows = self.__query(
+            "SELECT path, size, nrows, {} FROM files {} ORDER BY path".format(", ".join(_keyNames), where),
+            values)
+        return [Entry(os.path.join(self.rootDir, row[0]), *row[1:]) for row in rows]
+
+    def find_one(self, **keys):
+        """
+        Find a file.
+        @param keys
+            See find().
+        @return (Entry)
+            The first of find(**keys), or None.
+        """
+        where, values = _where(keys)
+        rows = self.__query(
+            "SELECT path, size, nrows, {} FROM files {} ORDER BY path LIMIT 1".format(", ".join(_keyNames), where),
+            values)
+        return Entry(os.path.join(self.rootDir, rows[0][0]), *rows[0][1:]) if rows else None
+
+    def distinct(self, key, **keys):
+        """
+        Get the distinct values of a key.
+        @param key (str)
+            Name of the key (e.g. "tract").
+        @param keys
+            Keys of the files to look at. See find().
+        @return (list)
+            Sorted values, excluding None.
+        """
+        if key not in _keyNames:
+            raise RuntimeError("Unknown key: " + key)
+        where, values = _where(keys)
+        where = where + (" AND " if where else "WHERE ") + "{} IS NOT NULL".format(key)
+        rows = self.__query("SELECT DISTINCT {} FROM files {} ORDER BY 1".format(key, where), values)
+        return [row[0] for row in rows]
+
+    def top_dirs(self):
+        """
+        @return (list of str)
+            Names of the directories just below rootDir, sorted.
+        """
+        rows = self.__query("SELECT path FROM dirs WHERE path = top ORDER BY path", ())
+        return [row[0] for row in rows]
+
+    def __query(self, sql, values):
+        with self.__lock:
+            return self.__connect().execute(sql, values).fetchall()
+
+    def __connect(self):
+        """
+        Get the connection of this process to the SQLite file,
+        creating the file if it does not exist.
+        """
+        if self.__db is not None and self.__pid == os.getpid():
+            return self.__db
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        version, = db.execute("PRAGMA user_version").fetchone()
+        if version != _version:
+            with db:
+                db.execute("DROP TABLE IF EXISTS dirs")
+                db.execute("DROP TABLE IF EXISTS files")
+                db.execute("""
+                CREATE TABLE dirs (
+                    path    TEXT PRIMARY KEY,
+                    top     TEXT,
+                    mtime   INTEGER
+                )""")
+                db.execute("""
+                CREATE TABLE files (
+                    path    TEXT PRIMARY KEY,
+                    top     TEXT,
+                    size    INTEGER,
+                    nrows   INTEGER,
+                    kind    TEXT,
+                    tract   INTEGER,
+                    patch   INTEGER,
+                    filter  TEXT,
+                    visit   INTEGER,
+                    raft    TEXT,
+                    sensor  TEXT
+                )""")
+                db.execute("CREATE INDEX dirs_top ON dirs (top)")
+                db.execute("CREATE INDEX files_top ON files (top)")
+                db.execute("CREATE INDEX files_tract ON files (tract, patch)")
+                db.execute("CREATE INDEX files_visit ON files (visit)")
+                db.execute("PRAGMA user_version = {}".format(_version))
+
+        self.__db = db
+        self.__pid = os.getpid()
+        return db
+
+
+def _where(keys):
+    """
+    Make a WHERE clause for Manifest.find().
+    @return (str, tuple)
+        The clause and the values of its placeholders.
+    """
+    for key in keys:
+        if key not in _keyNames:
+            raise RuntimeError("Unknown key: " + key)
+    if not keys:
+        return "", ()
+    return ("WHERE " + " AND ".join("{} = ?".format(key) for key in keys),
+            tuple(keys.values()))
+
+
+def _changed(rootDir, dirs):
+    """
+    Check whether the mtime of any of the directories has changed.
+    @param dirs (dict)
+        Map from path relative to rootDir -> recorded mtime.
+    """
+    for path, mtime in dirs.items():
+        try:
+            if os.stat(os.path.join(rootDir, path)).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def _walk(rootDir, top, depth, classify):
+    """
+    Walk a top-level directory.
+    @return (list, list)
+        List of (path, mtime) of directories,
+        and list of (path, size, nRows, keys) of files.
+        Paths are relative to rootDir.
+    """
+    dirs = []
+    files = []
+    pending = [(top, 1)]
+    while pending:
+        path, level = pending.pop()
+        try:
+            # The mtime is read before the directory is listed, so that
+            # any later change will be detected by the next refresh.
+            dirs.append((path, os.stat(os.path.join(rootDir, path)).st_mtime_ns))
+            with os.scandir(os.path.join(rootDir, path)) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        for entry in entries:
+            relpath = os.path.join(path, entry.name)
+            if entry.is_dir():
+                if level < depth:
+                    pending.append((relpath, level + 1))
+                continue
+
+            if relpath.endswith(".gz"):
+                relpath = relpath[:-len(".gz")]
+            keys = classify(relpath)
+            if keys is None:
+                continue
+
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            try:
+                nRows = fits.get_nrows(os.path.join(rootDir, relpath))
+            except Exception:
+                nRows = None
+            files.append((relpath, size, nRows, keys))
+
+    return dirs, files
@@ -0,0 +1,393 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Metrics of the ingestion: timers, counters and memory high-water marks.
+
+Timers accumulate calls and seconds by stage:
+    with metrics.timer("copy"):
+        cursor.copy_from(...)
+or as a function decorator:
+    @metrics.timer("transform")
+    def transform(self, ...): ...
+Stages may be nested (from_fits contains fits_read); the time of each
+is inclusive. The resident set size of the process is sampled at each
+write of the metrics. With config.metricsStageRss, it is also sampled at
+the end of each timed call (a read of /proc/self/statm), and its maximum
+is kept by stage.
+
+Counters (rows, bytes, files...) are summed, in total and optionally
+by table. set_total() gives the number of units (patches, visits) to be
+done, from which, as they are counted, the ETA is estimated.
+
+Metrics are always collected: a timed call costs two perf_counter() calls,
+a lock and a list update; a counted one, a lock and a dict update or two.
+start() makes them written every config.metricsInterval seconds, and at
+stop(), to "{name}-{pid}.jsonl" (appending a JSON line each time) and
+"{name}-{pid}.prom" (a textfile for Prometheus' node_exporter, replaced
+each time) in a directory. Each process writes its own files: worker
+processes forked by a pool must call reset() (in their initializer).
+"""
+
+import collections
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+from . import config
+
+# Prefix of the names of Prometheus metrics
+prometheusPrefix = "dc2_ingest_"
+
+_lock = threading.Lock()
+
+# stage -> [calls, seconds, RSS high-water (bytes, None if not sampled)]
+_timers = collections.OrderedDict()
+# counter -> value
+_counters = collections.OrderedDict()
+# table -> (counter -> value)
+_tables = collections.OrderedDict()
+# unit -> (total, time at which the total was set)
+_totals = collections.OrderedDict()
+
+_startTime = time.time()
+
+# Emitter of this process, if started
+_emitter = None
+
+
+class Timer(object):
+    """
+    Context manager, and function decorator, timing a stage.
+    """
+    def __init__(self, name):
+        """
+        @param name (str)
+            Name of the stage.
+        """
+        self.name = name
+        self.seconds = 0.0
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.__start
+        rss = get_rss() if config.metricsStageRss else None
+        with _lock:
+            stats = _timers.get(self.name)
+            if stats is None:
+                stats = _timers[self.name] = [0, 0.0, None]
+            stats[0] += 1
+            stats[1] += self.seconds
+            if rss is not None:
+                stats[2] = rss if stats[2] is None else max(stats[2], rss)
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def timer(name):
+    """
+    @param name (str)
+        Name of the stage.
+    @return (Timer)
+        Context manager or function decorator. See the module's docstring.
+    """
+    return Timer(name)
+
+
+def count(name, n=1, table=None):
+    """
+    Add to a counter.
+    @param name (str)
+        Name of the counter. e.g. "rows", "copy_bytes", "patches".
+    @param n (int)
+        Amount to add.
+    @param table (str)
+        If given, the amount is also added to the counter of this table.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        if table is not None:
+            counters = _tables.setdefault(table, collections.OrderedDict())
+            counters[name] = counters.get(name, 0) + n
+
+
+def set_total(name, total):
+    """
+    Set the number of units (e.g. "patches") to be done.
+    As count(name) counts units done, their ETA is estimated.
+    @param name (str)
+        Name of the counter of the units.
+    @param total (int)
+        Number of units.
+    """
+    with _lock:
+        _totals[name] = (total, time.time())
+
+
+def get_seconds(name):
+    """
+    @return (float)
+        Total seconds of a stage.
+    """
+    with _lock:
+        return _timers.get(name, [0, 0.0, 0])[1]
+
+
+def get_rss():
+    """
+    @return (int)
+        Resident set size of this process in bytes, or its maximum
+        so far where the current size is unknown.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return get_max_rss()
+
+
+def get_max_rss():
+    """
+    @return (int)
+        Maximum resident set size of this process in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+def snapshot():
+    """
+    @return (collections.OrderedDict)
+        All the metrics of this process. This is what is written as a JSON line.
+    """
+    now = time.time()
+    with _lock:
+        timers = collections.OrderedDict(
+            (name, collections.OrderedDict([("calls", calls), ("seconds", seconds), ("rss_high_water", rss)]))
+            for name, (calls, seconds, rss) in _timers.items()
+        )
+        counters = collections.OrderedDict(_counters)
+        tables = collections.OrderedDict(
+            (table, collections.OrderedDict(values)) for table, values in _tables.items()
+        )
+        progress = collections.OrderedDict()
+        for name, (total, since) in _totals.items():
+            done = _counters.get(name, 0)
+            eta = (now - since) * (total - done) / done if done > 0 else None
+            progress[name] = collections.OrderedDict([("done", done), ("total", total), ("eta_seconds", eta)])
+
+    return collections.OrderedDict([
+        ("time", datetime.datetime.fromtimestamp(now).isoformat()),
+        ("pid", os.getpid()),
+        ("elapsed", now - _startTime),
+        ("rss", get_rss()),
+        ("max_rss", get_max_rss()),
+        ("timers", timers),
+        ("counters", counters),
+        ("tables", tables),
+        ("progress", progress),
+    ])
+
+
+def to_prometheus(metrics, labels={}):
+    """
+    Format metrics in Prometheus' text exposition format.
+    @param metrics (dict)
+        As returned by snapshot().
+    @param labels (dict)
+        Labels given to all the metrics.
+    @return (str)
+    """
+    lines = []
+
+    def add(name, type, samples):
+        """
+        @param samples (list of (dict, number))
+            Labels and value of each sample.
+        """
+        samples = [(extra, value) for extra, value in samples if value is not None]
+        if not samples:
+            return
+        name = prometheusPrefix + name
+        lines.append("# TYPE {} {}".format(name, type))
+        for extra, value in samples:
+            allLabels = dict(labels, **extra)
+            labelString = ",".join(
+                '{}="{}"'.format(key, str(allLabels[key]).replace("\\", "\\\\").replace('"', '\\"'))
+                for key in sorted(allLabels))
+            lines.append("{}{{{}}} {}".format(name, labelString, repr(float(value))))
+
+    add("elapsed_seconds", "gauge", [({}, metrics["elapsed"])])
+    add("rss_bytes", "gauge", [({}, metrics["rss"])])
+    add("max_rss_bytes", "gauge", [({}, metrics["max_rss"])])
+
+    timers = metrics["timers"]
+    add("stage_calls_total", "counter", [({"stage": name}, t["calls"]) for name, t in timers.items()])
+    add("stage_seconds_total", "counter", [({"stage": name}, t["seconds"]) for name, t in timers.items()])
+    add("stage_rss_high_water_bytes", "gauge", [({"stage": name}, t["rss_high_water"]) for name, t in timers.items()])
+
+    for name, value in metrics["counters"].items():
+        add(name + "_total", "counter", [({}, value)])
+
+    names = []
+    for values in metrics["tables"].values():
+        names.extend(name for name in values if name not in names)
+    for name in names:
+        add("table_" + name + "_total", "counter", [
+            ({"table": table}, values[name]) for table, values in metrics["tables"].items() if name in values])
+
+    progress = metrics["progress"]
+    add("units_expected", "gauge", [({"unit": name}, p["total"]) for name, p in progress.items()])
+    add("eta_seconds", "gauge", [({"unit": name}, p["eta_seconds"]) for name, p in progress.items()])
+
+    return "\n".join(lines) + "\n"
+
+
+class _Emitter(object):
+    """
+    Thread writing the metrics of this process periodically.
+    """
+    def __init__(self, directory, name, interval):
+        self.directory = directory
+        self.name = name
+        self.interval = interval
+        self.pid = os.getpid()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.emit()
+
+    def emit(self):
+        metrics = snapshot()
+        metrics["name"] = self.name
+        path = os.path.join(self.directory, "{}-{}".format(self.name, self.pid))
+
+        with open(path + ".jsonl", "a") as f:
+            f.write(json.dumps(metrics) + "\n")
+
+        # node_exporter must not read a file being written
+        with open(path + ".prom.tmp", "w") as f:
+            f.write(to_prometheus(metrics, {"name": self.name, "pid": self.pid}))
+        os.replace(path + ".prom.tmp", path + ".prom")
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.emit()
+
+
+def start(directory, name, interval=None):
+    """
+    Write the metrics of this process periodically (see the module's docstring).
+    @param directory (str)
+        Directory of the files.
+    @param name (str)
+        Name of the files (and of the "name" label), e.g. the script's name.
+    @param interval (float)
+        Seconds between writes. Defaults to config.metricsInterval.
+    """
+    global _emitter
+    if interval is None:
+        interval = config.metricsInterval
+    os.makedirs(directory, exist_ok=True)
+    stop()
+    _emitter = _Emitter(directory, name, interval)
+
+
+def emit():
+    """
+    Write the metrics now, if start() has been called.
+    """
+    if _emitter is not None:
+        _emitter.emit()
+
+
+def stop():
+    """
+    Write the metrics a last time, and stop writing them.
+    """
+    global _emitter
+    if _emitter is not None and _emitter.pid == os.getpid():
+        _emitter.stop()
+    _emitter = None
+
+
+def reset():
+    """
+    Clear the metrics. In a process forked from one that has called start(),
+    this starts writing the metrics of the new process to files of its own.
+    """
+    global _emitter, _startTime, _lock
+    # The lock may have been held by a thread of the parent when forked
+    _lock = threading.Lock()
+    _timers.clear()
+    _counters.clear()
+    _tables.clear()
+    _totals.clear()
+    _startTime = time.time()
+
+    if _emitter is not None and _emitter.pid != os.getpid():
+        # The parent's thread does not exist in this process
+        _emitter = _Emitter(_emitter.directory, _emitter.name, _emitter.interval)
+
+
+class CountingReader(object):
+    """
+    File object counting the bytes read from another,
+    e.g. a COPY stream being sent to the server.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.nBytes = 0
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self.nBytes += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.file.readline(*args)
+        self.nBytes += len(data)
+        return data
@@ -18,6 +18,8 @@
 import collections
 import warnings
 
+from . import metrics
+
 
 class _undefined:
     """
@@ -91,25 +93,19 @@ def meas_time(id):
     @meas_time("id")
     def do_something(): ...
 
-    Time of execution with the same "id" will be accumulated.
+    Time of execution with the same "id" will be accumulated,
+    as the stage "id" of lib.metrics.
     """
 
     def _meas_time(func):
         def wrapper(*a, **b):
-            import time
-            start = time.time()
-            ret = func(*a, **b)
-            dt = time.time() - start
-
-            sum = dt + _timeDict.get(id, 0.0)
-            _timeDict[id] = sum
+            with metrics.timer(id) as timer:
+                ret = func(*a, **b)
 
-            print("time {}: {:.3f} sec (total {:.3f} sec)".format(id, dt, sum))
+            print("time {}: {:.3f} sec (total {:.3f} sec)".format(id, timer.seconds, metrics.get_seconds(id)))
 
             return ret
 
         return wrapper
 
     return _meas_time
-
-_timeDict = {}
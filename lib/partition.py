@@ -0,0 +1,202 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Partitioning of object tables by tract.
+
+With config.partitionByTract, DBTable's are created as partitioned by
+RANGE (object_id), and each tract is a partition of its own. Because
+
+    object_id = (tract << 42) | (patch_x << 37) | (patch_y << 32) | (counter),
+
+the bounds of a tract are the same as those used by tractSearch(),
+so queries restricted by tractSearch(object_id, ...) are pruned to
+the partitions of the tracts.
+
+The partition of tract T of table "position" is named "position_t{T}".
+"""
+
+from . import config
+
+# object_id = (tract << tractShift) | (patch_x << patchXShift) | (patch_y << patchYShift) | (counter)
+tractShift = 42
+patchXShift = 37
+patchYShift = 32
+
+
+def get_tract_bounds(tract):
+    """
+    @param tract (int)
+    @return (int, int)
+        Range [lower, upper) of object_id in the tract.
+    """
+    return tract << tractShift, (tract + 1) << tractShift
+
+
+def get_patch_bounds(tract, patch):
+    """
+    @param tract (int)
+    @param patch (int)
+        Patch number (x*100 + y)
+    @return (int, int)
+        Range [lower, upper) of object_id in the patch.
+    """
+    x, y = patch // 100, patch % 100
+    lower = (tract << tractShift) | (x << patchXShift) | (y << patchYShift)
+    return lower, lower + (1 << patchYShift)
+
+
+def get_partition_name(tableName, tract):
+    """
+    @param tableName (str)
+        Name of the partitioned table.
+    @param tract (int)
+    @return (str)
+        Name of the partition of the tract.
+    """
+    return "{tableName}_t{tract}".format(**locals())
+
+
+def get_partitioned_tables(cursor, schemaName):
+    """
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema
+    @return (list of str)
+        Names of the partitioned tables in the schema, sorted.
+    """
+    cursor.execute("""
+    SELECT
+        c.relname
+    FROM
+        pg_partitioned_table p
+        JOIN pg_class c ON p.partrelid = c.oid
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+    WHERE
+        n.nspname = %s
+    ORDER BY
+        c.relname
+    """, (schemaName,)
+    )
+    return [name for name, in cursor.fetchall()]
+
+
+def get_partitions(cursor, schemaName, tableName):
+    """
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema
+    @param tableName
+        Name of the table
+    @return (list of str)
+        Names of the partitions of the table, sorted,
+        or None if the table is not partitioned.
+    """
+    cursor.execute("""
+    SELECT
+        c.relkind
+    FROM
+        pg_class c JOIN pg_namespace n ON c.relnamespace = n.oid
+    WHERE
+        n.nspname = %s AND c.relname = %s
+    """, (schemaName, tableName)
+    )
+    row = cursor.fetchone()
+    if row is None or row[0] != 'p':
+        return None
+
+    cursor.execute("""
+    SELECT
+        c.relname
+    FROM
+        pg_inherits i JOIN pg_class c ON i.inhrelid = c.oid
+    WHERE
+        i.inhparent = %s::regclass
+    ORDER BY
+        c.relname
+    """, ('"{}"."{}"'.format(schemaName, tableName),)
+    )
+    return [name for name, in cursor.fetchall()]
+
+
+def create_tract_partitions(cursor, schemaName, tableNames, tracts, dryrun=False):
+    """
+    Create the partitions of tracts if they do not exist.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema
+    @param tableNames (list of str)
+        Names of the partitioned tables.
+    @param tracts (list of int)
+    @param dryrun
+        If True, just print the statements.
+    """
+    tableSpace = config.get_table_space()
+    unlogged = config.get_unlogged()
+
+    for tableName in tableNames:
+        for tract in tracts:
+            partitionName = get_partition_name(tableName, tract)
+            lower, upper = get_tract_bounds(tract)
+            statement = """
+            CREATE {unlogged} TABLE IF NOT EXISTS "{schemaName}"."{partitionName}"
+            PARTITION OF "{schemaName}"."{tableName}"
+            FOR VALUES FROM ({lower}) TO ({upper})
+            {tableSpace}
+            """.format(**locals())
+
+            if dryrun:
+                print(statement)
+            else:
+                cursor.execute(statement)
+
+
+def drop_tract_partitions(cursor, schemaName, tableNames, tracts, dryrun=False):
+    """
+    Detach and drop the partitions of tracts, so that the tracts can be
+    loaded again. Other tracts remain available to queries all the time.
+    Partitions that do not exist are ignored.
+    @param cursor
+        DB connection's cursor object (also used if dryrun)
+    @param schemaName
+        Name of the schema
+    @param tableNames (list of str)
+        Names of the partitioned tables.
+    @param tracts (list of int)
+    @param dryrun
+        If True, just print the statements.
+    """
+    for tableName in tableNames:
+        existing = set(get_partitions(cursor, schemaName, tableName) or [])
+        for tract in tracts:
+            partitionName = get_partition_name(tableName, tract)
+            if partitionName not in existing:
+                continue
+            statements = ["""
+            ALTER TABLE "{schemaName}"."{tableName}"
+            DETACH PARTITION "{schemaName}"."{partitionName}"
+            """.format(**locals()), """
+            DROP TABLE "{schemaName}"."{partitionName}"
+            """.format(**locals())]
+
+            for statement in statements:
+                if dryrun:
+                    print(statement)
+                else:
+                    cursor.execute(statement)
@@ -0,0 +1,332 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Encoder and decoder for PostgreSQL's binary COPY format ("PGCOPY").
+
+Rows are built as numpy structured arrays whose fields are the
+big-endian wire representation, so no value is ever formatted as text
+on the client nor parsed on the server.
+
+Decoding works the other way around as long as every row has the same
+length, i.e. the columns have fixed-size types and no NULL values
+(see lib/query.py).
+"""
+
+import io
+import struct
+
+import numpy
+
+signature = b"PGCOPY\n\377\r\n\0"
+
+# signature, flags (int32), length of header extension (int32)
+header = signature + struct.pack(">ii", 0, 0)
+
+# field count -1 terminates the data
+trailer = struct.pack(">h", -1)
+
+# Binary format name (see Field.get_binary_format()) -> wire dtype
+wireTypes = {
+    "bool"  : "u1",
+    "char"  : "S1",     # PostgreSQL's one-byte "char", not char(n)
+    "int2"  : ">i2",
+    "int4"  : ">i4",
+    "int8"  : ">i8",
+    "float4": ">f4",
+    "float8": ">f8",
+}
+
+# Binary format name -> dtype of decoded columns
+nativeTypes = {
+    "bool"  : "bool",
+    "char"  : "S1",
+    "int2"  : "int16",
+    "int4"  : "int32",
+    "int8"  : "int64",
+    "float4": "float32",
+    "float8": "float64",
+    "earth" : "float64",
+}
+
+# "earth" is a domain over "cube". A cube is sent as
+# a header (dimension | point bit) followed by the coordinates.
+_cubePointBit = 0x80000000
+
+# Number of rows encoded at a time
+blockRows = 65536
+
+
+def get_row_dtype(formats):
+    """
+    Get the dtype of a row in the binary COPY stream.
+    @param formats (list of str)
+        Binary format name of each column.
+    @return (numpy.dtype, list of list of str)
+        The row dtype, and the names of the value members for each column.
+    """
+    members = [("nfields", ">i2")]
+    valueNames = []
+
+    for i, fmt in enumerate(formats):
+        members.append(("len{}".format(i), ">i4"))
+        if fmt == "earth":
+            members.append(("cube{}".format(i), ">u4"))
+            names = ["{}_{}".format(c, i) for c in "xyz"]
+            members.extend((name, ">f8") for name in names)
+        elif fmt in wireTypes:
+            names = ["val{}".format(i)]
+            members.append((names[0], wireTypes[fmt]))
+        else:
+            raise RuntimeError("Binary format not supported: {}".format(fmt))
+        valueNames.append(names)
+
+    return numpy.dtype(members), valueNames
+
+
+def encode(formats, columns, nRows=None):
+    """
+    Encode columns in the binary COPY format.
+    @param formats (list of str)
+        Binary format name of each field. See Field.get_binary_format().
+    @param columns (list of numpy.array)
+        Columns in the same order as "formats".
+        A field of format "earth" consumes three columns (x, y, z).
+    @param nRows (int)
+        Number of rows. Taken from the first column if omitted.
+    @return
+        Generator of bytes, the concatenation of which is the whole stream
+        including header and trailer.
+    """
+    dtype, valueNames = get_row_dtype(formats)
+
+    # Match the columns to the value members
+    sources = []
+    iColumn = 0
+    for names in valueNames:
+        for name in names:
+            sources.append((name, columns[iColumn]))
+            iColumn += 1
+
+    if iColumn != len(columns):
+        raise RuntimeError("Number of columns does not match formats")
+
+    # Unsigned integers (uint64 -> int8) would wrap around silently
+    for name, column in sources:
+        target = dtype[name]
+        column = numpy.asarray(column)
+        if column.dtype.kind == "u" and target.kind == "i" and len(column) > 0 \
+                and column.max() > numpy.iinfo(target).max:
+            raise RuntimeError("Value {} of a {} column does not fit in {}".format(
+                column.max(), column.dtype.name, target.name))
+
+    if nRows is None:
+        nRows = len(columns[0]) if columns else 0
+
+    yield header
+
+    buf = numpy.empty(min(nRows, blockRows), dtype=dtype)
+    buf["nfields"] = len(formats)
+    for i, fmt in enumerate(formats):
+        buf["len{}".format(i)] = dtype[valueNames[i][0]].itemsize * len(valueNames[i]) + (4 if fmt == "earth" else 0)
+        if fmt == "earth":
+            buf["cube{}".format(i)] = _cubePointBit | 3
+
+    for start in range(0, nRows, blockRows):
+        stop = min(start + blockRows, nRows)
+        block = buf[:stop - start]
+        for name, column in sources:
+            block[name] = column[start:stop]
+        yield block.tobytes()
+
+    yield trailer
+
+
+class BinaryCopyStream(io.RawIOBase):
+    """
+    Read-only file object producing a binary COPY stream.
+    This can be passed to cursor.copy_expert().
+    """
+    def __init__(self, formats, columns, nRows=None):
+        """
+        @param formats (list of str)
+        @param columns (list of numpy.array)
+            See encode().
+        """
+        io.RawIOBase.__init__(self)
+        if nRows is None:
+            nRows = len(columns[0]) if columns else 0
+        self.nRows = nRows
+        # Bytes read so far
+        self.nBytes = 0
+        self.__chunks = encode(formats, columns, nRows)
+        self.__chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.__chunk:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                return 0
+            self.__chunk = memoryview(chunk)
+
+        n = min(len(b), len(self.__chunk))
+        b[:n] = self.__chunk[:n]
+        self.__chunk = self.__chunk[n:]
+        self.nBytes += n
+        return n
+
+
+def copy_binary(cursor, tableName, fieldNames, formats, columns):
+    """
+    Insert columns into a table with "COPY ... (FORMAT binary)".
+    @param cursor
+        DB connection's cursor object
+    @param tableName (str)
+        Qualified and quoted table name. e.g. '"schema"."table"'
+    @param fieldNames (list of str)
+        Field names. As in cursor.copy_from(), they are not quoted.
+    @param formats (list of str)
+        Binary format name of each field.
+    @param columns (list of numpy.array)
+        See encode().
+    @return (int)
+        Number of bytes sent.
+    """
+    fieldList = ", ".join(fieldNames)
+    fin = BinaryCopyStream(formats, columns)
+    cursor.copy_expert(
+        "COPY {tableName} ({fieldList}) FROM STDIN WITH (FORMAT binary)".format(**locals()),
+        fin)
+    return fin.nBytes
+
+
+class Decoder(io.RawIOBase):
+    """
+    Write-only file object decoding a binary COPY stream into numpy arrays.
+    This can be passed to cursor.copy_expert() with "COPY ... TO STDOUT".
+    Complete rows are decoded as they arrive, into arrays whose capacity
+    is doubled when they are full.
+    """
+    def __init__(self, formats, nRows=0):
+        """
+        @param formats (list of str)
+            Binary format name of each column. See get_row_dtype().
+        @param nRows (int)
+            Expected number of rows, for which arrays are allocated at first.
+        """
+        io.RawIOBase.__init__(self)
+        self.formats = formats
+        self.dtype, self.valueNames = get_row_dtype(formats)
+        self.nRows = 0
+        self.__buffer = bytearray()
+        self.__headerDone = False
+        self.__columns = [self.__allocate(fmt, max(nRows, 1024)) for fmt in formats]
+
+    @staticmethod
+    def __allocate(fmt, n):
+        shape = (n, 3) if fmt == "earth" else (n,)
+        return numpy.empty(shape, dtype=nativeTypes[fmt])
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.__buffer += b
+        if len(self.__buffer) >= self.dtype.itemsize * blockRows:
+            self.__decode()
+        return len(b)
+
+    def get_columns(self):
+        """
+        Decode the rest of the stream, which must be complete.
+        @return (list of numpy.array)
+            A column per format, of self.nRows rows.
+            A column of format "earth" has shape (nRows, 3): (x, y, z).
+        """
+        self.__decode()
+        if not self.__headerDone or bytes(self.__buffer) != trailer:
+            raise RuntimeError("Binary COPY stream is truncated or has rows of unexpected length")
+        return [column[:self.nRows] for column in self.__columns]
+
+    def __decode(self):
+        buf = self.__buffer
+        if not self.__headerDone:
+            if len(buf) < len(header):
+                return
+            if bytes(buf[:len(signature)]) != signature:
+                raise RuntimeError("Not a binary COPY stream")
+            extension, = struct.unpack_from(">i", buf, len(signature) + 4)
+            if len(buf) < len(header) + extension:
+                return
+            del buf[:len(header) + extension]
+            self.__headerDone = True
+
+        n = len(buf) // self.dtype.itemsize
+        if n == 0:
+            return
+        rows = numpy.frombuffer(buf, dtype=self.dtype, count=n)
+        self.__check(rows)
+
+        if self.nRows + n > len(self.__columns[0]):
+            capacity = max(2 * len(self.__columns[0]), self.nRows + n)
+            for i, fmt in enumerate(self.formats):
+                column = self.__allocate(fmt, capacity)
+                column[:self.nRows] = self.__columns[i][:self.nRows]
+                self.__columns[i] = column
+
+        for i, fmt in enumerate(self.formats):
+            out = self.__columns[i][self.nRows:self.nRows + n]
+            if fmt == "earth":
+                for j, name in enumerate(self.valueNames[i]):
+                    out[:, j] = rows[name]
+            else:
+                out[...] = rows[self.valueNames[i][0]]
+
+        self.nRows += n
+        del rows
+        del buf[:n * self.dtype.itemsize]
+
+    def __check(self, rows):
+        """
+        Verify that rows are of fixed length as expected.
+        (A NULL or a variable-length value would shift the rows.)
+        """
+        ok = (rows["nfields"] == len(self.formats))
+        for i, fmt in enumerate(self.formats):
+            length = self.dtype[self.valueNames[i][0]].itemsize * len(self.valueNames[i])
+            if fmt == "earth":
+                length += 4
+                ok &= (rows["cube{}".format(i)] == (_cubePointBit | 3))
+            ok &= (rows["len{}".format(i)] == length)
+        if not numpy.all(ok):
+            raise RuntimeError("Row {} of binary COPY stream has NULL or unexpected values".format(
+                self.nRows + int(numpy.argmin(ok))))
+
+
+def decode(formats, data):
+    """
+    Decode a whole binary COPY stream.
+    @param formats (list of str)
+    @param data (bytes)
+    @return (list of numpy.array)
+        See Decoder.get_columns().
+    """
+    decoder = Decoder(formats)
+    decoder.write(data)
+    return decoder.get_columns()
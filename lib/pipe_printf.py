@@ -15,66 +15,400 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+"""
+Format rows in other processes, to be read through a pipe.
+
+    with pipe_printf.open(b"%ld\\t%.8e\\n", ids, values) as fin:
+        cursor.copy_from(fin, ...)
+
+The formatting is done by a pool of long-lived worker processes.
+They are forked once per process (call start() early, before the process
+grows big) rather than once per table. The columns are handed over in
+a file in shared memory (/dev/shm if it exists), and the formatted rows
+come back over a pipe that belongs to the worker, in frames:
+
+    length (int64) > 0: "length" bytes of text follow
+    length == 0       : end of the job
+    length == -1      : the job failed; an error message follows
+                        as another frame
+
+open() blocks while all the workers are busy,
+so at most config.printfWorkers jobs are in flight. (Hence a thread must
+not keep more than that many files open at a time.)
+"""
+
+import atexit
 import contextlib
 import io
+import mmap
 import os
+import pickle
+import struct
 import sys
+import tempfile
+import threading
+import traceback
+
+import numpy
+
+from . import config
+from . import tsvformat
+
+_frameHeader = struct.Struct("<q")
+
+# Directory of files passing columns to workers
+_sharedDir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Offsets of columns in the shared file are aligned to this
+_alignment = 64
+
+# Pool of this process. (Children forked by this process create their own.)
+_pool = None
+_poolLock = threading.Lock()
+
+
+def start(nWorkers=None):
+    """
+    Start the worker processes if they are not running in this process.
+    Calling this function is optional (open() calls it),
+    but the earlier it is called the cheaper the forks are.
+    @param nWorkers (int)
+        Number of workers. Defaults to config.printfWorkers.
+    """
+    _get_pool(nWorkers)
 
 
 def open(format, *columns):
-    desc_in, desc_out = os.pipe()
-    pid = os.fork()
-    if pid == 0:
+    """
+    Format rows in a worker process.
+    @param format (bytes)
+        Row format including the trailing newline. See lib.tsvformat.
+    @param columns (numpy.array)
+        Columns, one per conversion in "format".
+    @return (PipeReadEnd)
+        File object from which to read the formatted rows.
+    """
+    columns = [numpy.ascontiguousarray(column) for column in columns]
+    nRows = len(columns[0]) if columns else 0
+
+    path = _write_shared(columns)
+    try:
+        pool = _get_pool()
+        worker = pool.acquire()
+    except:
         with contextlib.suppress(BaseException):
-            os.close(desc_in)
-        try:
-            __open_child(desc_out, format, *columns)
-            os._exit(0)
-        except BaseException as e:
-            with contextlib.suppress(BaseException):
-                sys.excepthook(*sys.exc_info())
-                #sys.stdout.flush()
-                #sys.stderr.flush()
+            os.unlink(path)
+        raise
 
-        os._exit(1)
-    else:
+    job = (format, path, nRows, [(column.dtype.str, offset) for column, offset in zip(columns, _offsets(columns))])
+    try:
+        worker.submit(job)
+    except:
         with contextlib.suppress(BaseException):
-            os.close(desc_out)
+            os.unlink(path)
+        pool.release(worker, healthy=False)
+        raise
+
+    return PipeReadEnd(pool, worker, path)
+
+
+def _get_pool(nWorkers=None):
+    global _pool
+    with _poolLock:
+        if _pool is not None and _pool.pid != os.getpid():
+            # Inherited from the parent process
+            _pool.abandon()
+            _pool = None
+        if _pool is None:
+            _pool = _Pool(nWorkers if nWorkers is not None else config.printfWorkers)
+        return _pool
 
-        return PipeReadEnd(pid, desc_in)
 
+def _offsets(columns):
+    """
+    Offsets of columns in the shared file.
+    """
+    offset = 0
+    for column in columns:
+        yield offset
+        offset += (column.nbytes + _alignment - 1) // _alignment * _alignment
 
-def __open_child(desc_out, format, *columns):
+
+def _write_shared(columns):
+    """
+    Write columns to a new file in shared memory.
+    @return (str)
+        Path to the file.
+    """
+    desc, path = tempfile.mkstemp(prefix="pipe_printf-", dir=_sharedDir)
     try:
-        fout = io.open(desc_out, "wb")
+        with io.open(desc, "wb") as fout:
+            for column, offset in zip(columns, _offsets(columns)):
+                fout.seek(offset)
+                fout.write(column.view(numpy.uint8))
     except:
         with contextlib.suppress(BaseException):
-            os.close(desc_out)
+            os.unlink(path)
         raise
 
-    with fout:
-        for tpl in zip(*columns):
-            fout.write(format % tpl)
+    return path
 
 
-class PipeReadEnd(io.FileIO):
-    def __init__(self, pid, desc):
-        try:
-            io.FileIO.__init__(self, desc, "rb")
-        except:
-            with contextlib.suppress(BaseException):
-                os.close(desc)
+class _Pool:
+    """
+    Worker processes of a process.
+    """
+    def __init__(self, nWorkers):
+        self.pid = os.getpid()
+        self.__cond = threading.Condition()
+        self.__workers = []
+        self.__idle = []
+        for i in range(max(1, nWorkers)):
+            self.__add_worker()
+
+        atexit.register(self.shutdown)
+
+    def __add_worker(self):
+        worker = _Worker([w for w in self.__workers])
+        self.__workers.append(worker)
+        self.__idle.append(worker)
+
+    def acquire(self):
+        """
+        Get an idle worker, waiting for one if none.
+        """
+        with self.__cond:
+            while not self.__idle:
+                self.__cond.wait()
+            return self.__idle.pop()
+
+    def release(self, worker, healthy):
+        """
+        Return a worker acquired with acquire().
+        @param healthy (bool)
+            False if the worker is broken; it is replaced.
+        """
+        with self.__cond:
+            if healthy:
+                self.__idle.append(worker)
+            else:
+                self.__workers.remove(worker)
+                worker.kill()
+                self.__add_worker()
+            self.__cond.notify()
+
+    def shutdown(self):
+        """
+        Let the workers exit, and wait for them.
+        """
+        if self.pid != os.getpid():
+            return
+        with self.__cond:
+            for worker in self.__workers:
+                worker.stop()
+            self.__workers = []
+            self.__idle = []
+
+    def abandon(self):
+        """
+        Forget the pool inherited from the parent process.
+        The workers are the parent's, not to be waited for by this process.
+        """
+        for worker in self.__workers:
+            worker.close_pipes()
+        self.__workers = []
+        self.__idle = []
+
+
+class _Worker:
+    """
+    Parent's handle of a worker process.
+    """
+    def __init__(self, siblings):
+        """
+        @param siblings (list of _Worker)
+            Other workers of the pool, whose pipes the new process must close.
+        """
+        ctrl_in, ctrl_out = os.pipe()
+        data_in, data_out = os.pipe()
+
+        self.pid = os.fork()
+        if self.pid == 0:
+            status = 1
+            try:
+                for worker in siblings:
+                    worker.close_pipes()
+                os.close(ctrl_out)
+                os.close(data_in)
+                _worker_main(ctrl_in, data_out)
+                status = 0
+            except BaseException:
+                with contextlib.suppress(BaseException):
+                    sys.excepthook(*sys.exc_info())
+            finally:
+                with contextlib.suppress(BaseException):
+                    sys.stderr.flush()
+                os._exit(status)
+
+        os.close(ctrl_in)
+        os.close(data_out)
+        self.ctrl = io.open(ctrl_out, "wb")
+        self.data = io.open(data_in, "rb", buffering=0)
+
+    def submit(self, job):
+        """
+        Send a job to the process.
+        """
+        message = pickle.dumps(job)
+        self.ctrl.write(_frameHeader.pack(len(message)))
+        self.ctrl.write(message)
+        self.ctrl.flush()
+
+    def close_pipes(self):
+        for f in (self.ctrl, self.data):
             with contextlib.suppress(BaseException):
-                os.waitpid(self.__pid, 0)
-            raise
+                f.close()
+
+    def stop(self):
+        """
+        Let the process exit (by closing the control pipe) and wait for it.
+        """
+        self.close_pipes()
+        with contextlib.suppress(BaseException):
+            os.waitpid(self.pid, 0)
+
+    def kill(self):
+        with contextlib.suppress(BaseException):
+            os.kill(self.pid, 9)
+        self.stop()
+
+
+def _worker_main(ctrl_in, data_out):
+    """
+    Main loop of a worker process.
+    """
+    with io.open(ctrl_in, "rb") as fin, io.open(data_out, "wb") as fout:
+        while True:
+            header = fin.read(_frameHeader.size)
+            if len(header) < _frameHeader.size:
+                return  # The parent has closed the pipe
+            length, = _frameHeader.unpack(header)
+            job = pickle.loads(fin.read(length))
+
+            try:
+                _run_job(fout, *job)
+            except Exception:
+                message = traceback.format_exc().encode("utf-8")
+                fout.write(_frameHeader.pack(-1))
+                fout.write(_frameHeader.pack(len(message)))
+                fout.write(message)
+            else:
+                fout.write(_frameHeader.pack(0))
+
+            fout.flush()
+
+
+def _run_job(fout, format, path, nRows, layout):
+    """
+    Format the columns in a shared file, writing frames to "fout".
+    """
+    if nRows == 0 or not layout:
+        return
 
-        self.__pid = pid
+    with io.open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        _write_frames(fout, format, buf, nRows, layout)
+    finally:
+        buf.close()
+
+
+def _write_frames(fout, format, buf, nRows, layout):
+    columns = [numpy.frombuffer(buf, dtype=dtype, count=nRows, offset=offset) for dtype, offset in layout]
+    for chunk in tsvformat.encode(format, columns, nRows):
+        fout.write(_frameHeader.pack(len(chunk)))
+        fout.write(chunk)
+
+
+class PipeReadEnd(io.RawIOBase):
+    """
+    File object from which to read the rows formatted by a worker.
+    """
+    def __init__(self, pool, worker, path):
+        io.RawIOBase.__init__(self)
+        self.__pool = pool
+        self.__worker = worker
+        self.__path = path
+        self.__remaining = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.__remaining == 0:
+            if self.__worker is None:
+                return 0
+            self.__next_frame()
+
+        with memoryview(b) as view:
+            n = self.__worker.data.readinto(view[:min(len(view), self.__remaining)])
+        if not n:
+            self.__finish(healthy=False)
+            raise RuntimeError("Thread that performed printf aborted.")
+
+        self.__remaining -= n
+        return n
 
     def close(self):
-        io.FileIO.close(self)
-        if self.__pid != 0:
-            pid = self.__pid
-            self.__pid = 0
-            _, status = os.waitpid(pid, 0)
-            if not(os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+        try:
+            # Skip the rest of the output, if any
+            while self.__worker is not None:
+                if self.__remaining == 0:
+                    self.__next_frame()
+                else:
+                    chunk = self.__worker.data.read(min(self.__remaining, 1 << 20))
+                    if not chunk:
+                        self.__finish(healthy=False)
+                        raise RuntimeError("Thread that performed printf aborted.")
+                    self.__remaining -= len(chunk)
+        finally:
+            io.RawIOBase.close(self)
+
+    def __next_frame(self):
+        """
+        Read the header of a frame.
+        """
+        length = self.__read_header()
+        if length > 0:
+            self.__remaining = length
+        elif length == 0:
+            self.__finish(healthy=True)
+        else:
+            message = self.__read_exact(self.__read_header())
+            self.__finish(healthy=True)
+            raise RuntimeError("Thread that performed printf aborted.\n" + message.decode("utf-8", "replace"))
+
+    def __read_header(self):
+        return _frameHeader.unpack(self.__read_exact(_frameHeader.size))[0]
+
+    def __read_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.__worker.data.read(size - len(data))
+            if not chunk:
+                self.__finish(healthy=False)
                 raise RuntimeError("Thread that performed printf aborted.")
+            data += chunk
+        return data
+
+    def __finish(self, healthy):
+        """
+        Release the worker and the shared file.
+        """
+        worker = self.__worker
+        self.__worker = None
+        self.__remaining = 0
+        with contextlib.suppress(BaseException):
+            os.unlink(self.__path)
+        self.__pool.release(worker, healthy)
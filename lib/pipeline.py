@@ -0,0 +1,162 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pipeline of stages running concurrently in threads.
+
+Items (e.g. patches) go through stages (e.g. read, transform, COPY), each
+run by threads of its own and linked to the next by a bounded queue: a
+stage whose queue is full waits for the next stage, so that no more than
+"queueSize" items wait between two stages. While one item is being sent
+by COPY, the next is being transformed and the ones after are being read,
+and the throughput approaches that of the slowest stage. Threads overlap
+as far as the stages release the GIL: reading files and decompressing
+them, numpy, and psycopg2 sending data all do.
+
+The memory of the items in flight can be limited: the size of each item
+(estimated before the first stage) is reserved from a budget before the
+item enters the pipeline, and returned when it leaves it. An item larger
+than the budget enters only when the pipeline is empty.
+
+The failure of an item does not stop the pipeline; failures are returned.
+"""
+
+import queue
+import threading
+
+from . import metrics
+
+# End of items, put into a queue
+_end = object()
+
+
+class MemoryBudget(object):
+    """
+    Number of bytes that may be reserved at a time.
+    """
+    def __init__(self, capacity):
+        """
+        @param capacity (int)
+            Number of bytes. If None, reservations never wait.
+        """
+        self.capacity = capacity
+        self.used = 0
+        self.__condition = threading.Condition()
+
+    def reserve(self, n):
+        """
+        Reserve "n" bytes, waiting until they are available.
+        If nothing is reserved, "n" bytes are reserved even if they exceed the capacity.
+        """
+        with self.__condition:
+            while self.capacity is not None and self.used > 0 and self.used + n > self.capacity:
+                self.__condition.wait()
+            self.used += n
+
+    def release(self, n):
+        with self.__condition:
+            self.used -= n
+            self.__condition.notify_all()
+
+
+def run(items, stages, queueSize=1, memoryCap=None, sizeof=None):
+    """
+    Pass items through stages.
+    @param items (list)
+        Items to process. They are given in this order to the first stage.
+    @param stages (list of (str, callable, int))
+        Name, function and number of threads of each stage.
+        The function of the first stage is called with an item, and
+        that of each other stage with what the previous one returned.
+        The time the threads of a stage spend waiting for input is
+        recorded as the stage "{name}_wait" of lib.metrics.
+    @param queueSize (int)
+        Maximum number of items waiting between two stages.
+    @param memoryCap (int)
+        Maximum number of bytes of the items in flight, or None.
+    @param sizeof (callable)
+        sizeof(item) -> int, estimated number of bytes of an item in flight.
+        Required if "memoryCap" is given.
+    @return (list of (item, Exception))
+        Items that failed, in the order of failure, and the exceptions raised.
+    """
+    budget = MemoryBudget(memoryCap)
+    lock = threading.Lock()
+    failures = []
+
+    # The queue of the first stage has all the items, so as not to wait
+    queues = [queue.Queue()] + [queue.Queue(maxsize=max(1, queueSize)) for stage in stages[1:]]
+    for item in items:
+        queues[0].put(item)
+    for i in range(stages[0][2]):
+        queues[0].put(_end)
+
+    # Number of threads still running in each stage
+    running = [nThreads for name, func, nThreads in stages]
+
+    def work(iStage):
+        name, func, nThreads = stages[iStage]
+        inQueue = queues[iStage]
+        outQueue = queues[iStage + 1] if iStage + 1 < len(stages) else None
+
+        while True:
+            with metrics.timer(name + "_wait"):
+                entry = inQueue.get()
+            if entry is _end:
+                break
+
+            if iStage == 0:
+                item, value, size = entry, entry, 0
+            else:
+                item, value, size = entry
+
+            try:
+                if iStage == 0 and memoryCap is not None:
+                    n = sizeof(item)
+                    with metrics.timer(name + "_wait"):
+                        budget.reserve(n)
+                    size = n
+                value = func(value)
+            except Exception as e:
+                budget.release(size)
+                with lock:
+                    failures.append((item, e))
+                continue
+
+            if outQueue is not None:
+                outQueue.put((item, value, size))
+            else:
+                budget.release(size)
+
+        with lock:
+            running[iStage] -= 1
+            last = (running[iStage] == 0)
+        if last and outQueue is not None:
+            for i in range(stages[iStage + 1][2]):
+                outQueue.put(_end)
+
+    threads = [
+        threading.Thread(target=work, args=(iStage,))
+        for iStage, (name, func, nThreads) in enumerate(stages)
+        for i in range(nThreads)
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return failures
@@ -0,0 +1,169 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read query results into numpy arrays through binary COPY.
+
+Fetching rows through a cursor makes a Python tuple of Python objects
+per row. read() instead runs
+
+    COPY (SELECT ... FROM (query) q) TO STDOUT WITH (FORMAT binary)
+
+and lib.pgcopy.Decoder decodes the stream, block by block, with
+numpy.frombuffer() into arrays of native types. For the rows to be of
+fixed length, every column is cast to the type of its format and NULL is
+replaced: NaN in floating point columns, -1 in integer columns, False in
+boolean columns (as lib.scan does), and a point of NaN's in "earth"
+columns (which need cube 1.5, i.e. PostgreSQL 14, for binary I/O).
+
+The arrays are contiguous and native-endian, so that they can be wrapped
+by Arrow (pyarrow.array()) without copying.
+"""
+
+import collections
+
+from . import pgcopy
+
+# Binary format -> (SQL type to cast to, SQL value of NULL)
+_casts = {
+    "bool"  : ("Boolean"         , "False"),
+    "char"  : ('"char"'          , "''"),
+    "int2"  : ("Smallint"        , "-1"),
+    "int4"  : ("Integer"         , "-1"),
+    "int8"  : ("Bigint"          , "-1"),
+    "float4": ("Real"            , "'NaN'"),
+    "float8": ("Double precision", "'NaN'"),
+    "earth" : ("public.cube"     , "public.cube(ARRAY['NaN', 'NaN', 'NaN']::Float8[])"),
+}
+
+# Datatype in DpddView's yaml files -> binary format
+dpddFormats = {
+    "int"   : "int4",
+    "long"  : "int8",
+    "float" : "float4",
+    "double": "float8",
+    "flag"  : "bool",
+    "earth" : "earth",
+}
+
+# PostgreSQL type OID -> binary format
+_oidFormats = {
+    16 : "bool",
+    18 : "char",
+    20 : "int8",
+    21 : "int2",
+    23 : "int4",
+    700: "float4",
+    701: "float8",
+}
+
+
+def read(cursor, query, formats, params=None, nRows=0):
+    """
+    Run a query and get its result as numpy arrays.
+    @param cursor
+        DB connection's cursor object
+    @param query (str)
+        SELECT statement.
+    @param formats (list of (str, str))
+        (name, binary format) of the columns to read from the result of
+        the query. See get_formats() and get_dpdd_formats().
+    @param params (tuple or dict)
+        Parameters of the query, as in cursor.execute().
+    @param nRows (int)
+        Expected number of rows, if known.
+    @return (collections.OrderedDict)
+        Name -> numpy.array. See lib.pgcopy.Decoder.get_columns().
+    """
+    if params is not None:
+        query = cursor.mogrify(query, params).decode()
+
+    selectList = ", ".join(
+        'COALESCE(q."{name}"::{sqltype}, {null}) AS "{name}"'.format(
+            name=name, sqltype=_casts[fmt][0], null=_casts[fmt][1])
+        for name, fmt in formats
+    )
+
+    decoder = pgcopy.Decoder([fmt for name, fmt in formats], nRows)
+    cursor.copy_expert("""
+    COPY (SELECT {selectList} FROM ({query}) q) TO STDOUT WITH (FORMAT binary)
+    """.format(**locals()), decoder)
+
+    return collections.OrderedDict(zip(
+        (name for name, fmt in formats), decoder.get_columns()))
+
+
+def get_formats(cursor, query, params=None):
+    """
+    Get the binary formats of the columns of a query
+    from the types the server reports for it.
+    @param cursor
+        DB connection's cursor object
+    @param query (str)
+        SELECT statement.
+    @param params (tuple or dict)
+        Parameters of the query, as in cursor.execute().
+    @return (list of (str, str))
+        (name, binary format) of the columns.
+    """
+    oidFormats = dict(_oidFormats)
+    # "earth" is reported as its base type "cube"
+    cursor.execute("SELECT to_regtype('public.cube')::oid")
+    cube, = cursor.fetchone()
+    if cube is not None:
+        oidFormats[cube] = "earth"
+
+    cursor.execute("SELECT * FROM ({}) q LIMIT 0".format(query), params)
+
+    formats = []
+    for column in cursor.description:
+        fmt = oidFormats.get(column[1])
+        if fmt is None:
+            raise RuntimeError("Type of column {} (OID {}) cannot be read in binary".format(column[0], column[1]))
+        formats.append((column[0], fmt))
+    return formats
+
+
+def get_dpdd_formats(view, columns=None):
+    """
+    Get the binary formats of columns of the dpdd view
+    from the Datatype's of its definition.
+    @param view (lib.dpdd.DpddView)
+        Builder of the view.
+    @param columns (list of str)
+        Names of columns (lowercase). If None, all the columns
+        whose Datatype can be read in binary; the others are left out.
+    @return (list of (str, str))
+        (name, binary format) of the columns.
+    """
+    types = collections.OrderedDict(view.column_types())
+    if columns is None:
+        columns = [name for name, datatype in types.items()
+                   if datatype is not None and datatype.lower() in dpddFormats]
+
+    formats = []
+    for name in columns:
+        if name not in types:
+            raise RuntimeError("No column {} in the view".format(name))
+        if types[name] is None:
+            # Not necessarily a float (e.g. filtername, obsstart)
+            raise ValueError("Column {} has no Datatype in the yaml files of the view,"
+                             " so it cannot be read in binary".format(name))
+        datatype = types[name].lower()
+        if datatype not in dpddFormats:
+            raise RuntimeError("Datatype of column {} cannot be read in binary: {}".format(name, datatype))
+        formats.append((name, dpddFormats[datatype]))
+    return formats
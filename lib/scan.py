@@ -0,0 +1,239 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Parallel scan of a whole catalog.
+
+A single "SELECT ... FROM dpdd" runs on one backend and returns its rows
+through one connection. scan() splits the catalog into tracts (or patches)
+listed in the "skymap" table, selects each of them with
+tractSearch(object_id, tract) (or the range of object_id of the patch,
+see partition.get_patch_bounds()), which are index (or partition) scans
+because object_id encodes the tract and the patch, through server-side cursors on
+several connections, and yields the rows as numpy structured arrays in
+the order they arrive.
+
+Batches waiting to be consumed are bounded in number, so memory usage is
+bounded however large the catalog is: when the consumer is slow, the
+connections wait.
+"""
+
+import queue
+import threading
+
+import numpy
+
+from . import common
+from . import config
+from . import partition
+
+# Batches waiting to be consumed, per connection
+queuedBatches = 2
+
+# Units into which the catalog is split
+units = ["tract", "patch"]
+
+# numpy dtypes of PostgreSQL types (by OID). Others are Python objects.
+_dtypes = {
+    16 : "bool",    # Boolean
+    18 : "S1",      # "char"
+    20 : "int64",   # Bigint
+    21 : "int16",   # Smallint
+    23 : "int32",   # Integer
+    700: "float32", # Real
+    701: "float64", # Double precision
+}
+
+# Values of NULL by kind of dtype. (NULL is NaN in floating point columns)
+_nullValues = {"b": False, "i": -1, "S": b""}
+
+
+def scan(schemaName, columns=None, where=None, params=None,
+         tableName="dpdd", idColumn="objectid", unit="tract", tracts=None,
+         nConnections=None, batchRows=None):
+    """
+    Read a table or a view, in parallel.
+    @param schemaName (str)
+        Name of the schema
+    @param columns (list of str)
+        SQL expressions to select (e.g. ["objectid", "ra", "dec"]).
+        All columns ("*") if None.
+    @param where (str)
+        SQL condition on rows, if any (e.g. "mag_i < %s").
+    @param params (tuple)
+        Parameters of "where", passed to cursor.execute().
+    @param tableName (str)
+        Name of the table or view.
+    @param idColumn (str)
+        Column of the table holding object_id.
+    @param unit (str)
+        One of "units": each tract or each patch is a query.
+    @param tracts (list of int)
+        Read only these tracts. All the tracts in "skymap" if None.
+    @param nConnections (int)
+        Number of connections. Defaults to config.scanConnections.
+    @param batchRows (int)
+        Maximum number of rows in a batch. Defaults to config.scanBatchRows.
+    @return (generator of numpy.ndarray)
+        Structured arrays with a field per column. Batches come in no
+        particular order. NULL is NaN in floating point fields, and
+        False, -1 or b"" in boolean, integer and "char" fields.
+    """
+    if unit not in units:
+        raise RuntimeError("Unknown unit: {}".format(unit))
+    if nConnections is None:
+        nConnections = config.scanConnections
+    if batchRows is None:
+        batchRows = config.scanBatchRows
+
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            values = get_units(cursor, unit, tracts)
+    finally:
+        db.close()
+
+    selectList = ", ".join(columns) if columns else "*"
+    pending = queue.Queue()
+    for value in values:
+        pending.put("""
+        SELECT {selectList}
+        FROM "{schemaName}"."{tableName}"
+        WHERE {predicate} {condition}
+        """.format(
+            predicate=get_predicate(unit, value, idColumn),
+            condition="AND ({})".format(where) if where else "",
+            **locals()))
+
+    results = queue.Queue(maxsize=max(1, nConnections * queuedBatches))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            db = common.new_db_connection()
+            db.set_session(readonly=True)
+            try:
+                while not stop.is_set():
+                    try:
+                        statement = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    with db.cursor(name="scan") as cursor:
+                        cursor.execute(statement, params)
+                        while True:
+                            rows = cursor.fetchmany(batchRows)
+                            if not rows:
+                                break
+                            if not put(to_records(cursor.description, rows)):
+                                break
+                    db.rollback()
+            finally:
+                db.close()
+        except Exception as e:
+            put(e)
+        put(None)
+
+    nThreads = max(1, min(nConnections, len(values)))
+    threads = [threading.Thread(target=run) for i in range(nThreads)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        nFinished = 0
+        while nFinished < nThreads:
+            item = results.get()
+            if item is None:
+                nFinished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Also when the consumer stops early
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def get_units(cursor, unit="tract", tracts=None):
+    """
+    List the tracts or patches in the "skymap" table.
+    @param cursor
+        DB connection's cursor object
+    @param unit (str)
+        One of "units".
+    @param tracts (list of int)
+        Only these tracts if not None.
+    @return (list of int)
+        Tracts, or skymap_id's (tract*10000 + patch_x*100 + patch_y) of patches.
+    """
+    expression = "skymap_id / 10000" if unit == "tract" else "skymap_id"
+    condition = "WHERE skymap_id / 10000 = ANY(%s)" if tracts is not None else ""
+    cursor.execute("""
+    SELECT DISTINCT {expression} FROM public.skymap {condition} ORDER BY 1
+    """.format(**locals()), (list(tracts),) if tracts is not None else None
+    )
+    return [value for value, in cursor.fetchall()]
+
+
+def get_predicate(unit, value, idColumn):
+    """
+    @param unit (str)
+        One of "units".
+    @param value (int)
+        Tract, or skymap_id (tract*10000 + patch_x*100 + patch_y) of a patch.
+    @param idColumn (str)
+        Column of object_id.
+    @return (str)
+        SQL condition selecting the rows of a tract or a patch,
+        on the range of object_id so that indexes and partitions are used.
+    """
+    if unit == "tract":
+        return "public.tractSearch({idColumn}, {value})".format(**locals())
+    else:
+        lower, upper = partition.get_patch_bounds(value // 10000, value % 10000)
+        return "{idColumn} >= {lower} AND {idColumn} < {upper}".format(**locals())
+
+
+def to_records(description, rows):
+    """
+    Convert rows fetched from a cursor to a structured array.
+    @param description
+        cursor.description
+    @param rows (list of tuple)
+    @return (numpy.ndarray)
+    """
+    names = [column[0] for column in description]
+    dtypes = [numpy.dtype(_dtypes.get(column[1], "O")) for column in description]
+    records = numpy.empty(len(rows), dtype=list(zip(names, dtypes)))
+
+    for i, (name, dtype) in enumerate(zip(names, dtypes)):
+        values = [row[i] for row in rows]
+        null = _nullValues.get(dtype.kind)
+        if null is not None:
+            values = [null if v is None else v for v in values]
+        records[name] = numpy.array(values, dtype=dtype)
+
+    return records
@@ -0,0 +1,166 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sink of COPY data, in place of a database
+(--sink of ingest-object-catalog.py and ingest-forcedsource.py).
+
+A Sink is given to the ingest functions as both the connection and its
+cursor. Statements other than COPY are ignored. COPY streams are read to
+the end, so that the rows are formatted (or encoded) as they would be for
+the server, and then discarded or written to files, a file per COPY.
+Rows, bytes and seconds spent reading the streams are summed by table.
+"""
+
+import collections
+import os
+import re
+import threading
+import time
+
+# Size of chunks read from COPY streams
+chunkSize = 1 << 20
+
+
+class Sink(object):
+    """
+    Connection and cursor object discarding or saving COPY data.
+    """
+    def __init__(self, directory=None):
+        """
+        @param directory (str)
+            Directory in which to write the COPY data, as files
+            "{table}-{n}.tsv" (text) or "{table}-{n}.bin" (binary),
+            which can be loaded with psql's "\\copy".
+            If None, COPY data are discarded.
+        """
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        # table -> [COPYs, rows, bytes, seconds]
+        self.stats = collections.OrderedDict()
+        # COPYs may be made in several threads (see lib.pipeline)
+        self.__lock = threading.Lock()
+
+        # As psycopg2's cursor.connection and connection.autocommit
+        self.connection = self
+        self.autocommit = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, *args, **kwargs):
+        pass
+
+    def copy_from(self, file, table, sep='\t', null='\\N', size=8192, columns=None):
+        self.__consume(file, table, "tsv")
+
+    def copy_expert(self, sql, file, size=8192):
+        match = re.match(r'\s*COPY\s+(\S+)', sql, re.IGNORECASE)
+        if match is None:
+            raise RuntimeError("Not a COPY statement: " + sql)
+        self.__consume(file, match.group(1),
+                       "bin" if re.search(r'\bbinary\b', sql, re.IGNORECASE) else "tsv")
+
+    def __consume(self, file, table, extension):
+        """
+        Read a COPY stream to the end.
+        @param file
+            File object from which to read the stream.
+        @param table (str)
+            Table name, possibly qualified and quoted.
+        @param extension (str)
+            "tsv" for the text format, "bin" for the binary format.
+        """
+        table = table.split(".")[-1].strip('"')
+        with self.__lock:
+            stats = self.stats.setdefault(table, [0, 0, 0, 0.0])
+            iCopy = stats[0]
+            stats[0] += 1
+
+        start = time.time()
+        out = None
+        if self.directory is not None:
+            out = open(os.path.join(self.directory, "{}-{:06d}.{}".format(table, iCopy, extension)), "wb")
+
+        nRows = 0
+        nBytes = 0
+        try:
+            while True:
+                chunk = file.read(chunkSize)
+                if not chunk:
+                    break
+                if extension == "tsv":
+                    nRows += chunk.count(b"\n")
+                nBytes += len(chunk)
+                if out is not None:
+                    out.write(chunk)
+        finally:
+            if out is not None:
+                out.close()
+
+        if extension == "bin":
+            # See lib.pgcopy.BinaryCopyStream
+            nRows = getattr(file, "nRows", 0)
+
+        with self.__lock:
+            stats[1] += nRows
+            stats[2] += nBytes
+            stats[3] += time.time() - start
+
+    def report(self, elapsed=None):
+        """
+        @param elapsed (float)
+            Seconds of the whole ingestion, if known.
+        @return (list of str)
+            Lines reporting rows/sec and MB/sec of each table.
+            Seconds of a table are those spent reading its COPY streams,
+            which include formatting or encoding the rows.
+        """
+        lines = []
+        for table, (nCopies, nRows, nBytes, seconds) in self.stats.items():
+            lines.append("{table}: {nRows} rows, {mb:.1f} MB in {nCopies} COPYs, {seconds:.2f} sec"
+                         " ({rows:.0f} rows/sec, {mbs:.1f} MB/sec)".format(
+                mb=nBytes / 1e6, rows=_rate(nRows, seconds), mbs=_rate(nBytes / 1e6, seconds), **locals()))
+
+        if elapsed is not None:
+            nBytes = sum(stats[2] for stats in self.stats.values())
+            seconds = sum(stats[3] for stats in self.stats.values())
+            lines.append("total: {mb:.1f} MB, {seconds:.2f} sec in COPY of {elapsed:.2f} sec"
+                         " ({mbs:.1f} MB/sec overall)".format(
+                mb=nBytes / 1e6, mbs=_rate(nBytes / 1e6, elapsed), **locals()))
+
+        return lines
+
+
+def _rate(amount, seconds):
+    return amount / seconds if seconds > 0 else 0.0
@@ -22,6 +22,8 @@ import numpy
 
 from .misc import PoppingOrderedDict
 from . import config
+from . import fits
+from . import metrics
 
 class SourceTable(object):
     """
@@ -74,6 +76,7 @@ class SourceTable(object):
         return None
 
     @staticmethod
+    @metrics.timer("from_hdu")
     def from_hdu(hdu):
         """
         Read Fits HDU to return an instance of SourceTable.
@@ -114,6 +117,80 @@ class SourceTable(object):
 
         return SourceTable(fields, slots, header)
 
+    @staticmethod
+    @metrics.timer("from_fits")
+    def from_fits(path, keep=None):
+        """
+        Read a catalog file to return an instance of SourceTable,
+        decoding only the fields that are to be kept.
+        The result is the same as from_hdu(fits.fits_open(path)[1])
+        with the other fields removed.
+        @param path (str)
+            Path to a FITS file. See fits.BinTable.
+        @param keep (callable)
+            keep(name: str) -> bool.
+            If omitted, all fields are kept.
+        """
+        if keep is None:
+            keep = lambda name: True
+
+        table  = fits.BinTable(path)
+        header = table.header
+
+        aliases = []
+        slots = {}
+        for key, value in header.items():
+            if key == "ALIAS":
+                reference, referend = value.split(':')
+                if reference.startswith("slot_"):
+                    slots[reference[len("slot_"):]] = referend
+                elif keep(reference):
+                    aliases.append((reference, referend))
+
+        # Aliased fields must be decoded even if they are not kept
+        wanted = set(referend for reference, referend in aliases)
+        def want(name):
+            return name in wanted or keep(name)
+
+        iFlag = header.get("FLAGCOL", None)
+
+        indices = [i for i in range(1, 1+header["TFIELDS"])
+                   if i != iFlag and want(header.get("TTYPE{}".format(i), ""))]
+        bits = []
+        flagName = None
+        if iFlag is not None:
+            nFlags = int(re.match(r'^([0-9]+)X$', header["TFORM{}".format(iFlag)]).group(1))
+            bits = [i for i in range(nFlags) if want(header.get("TFLAG{}".format(i+1), ""))]
+            flagName = header.get("TTYPE{}".format(iFlag), "flags")
+
+        columns, flags = table.read(
+            [header.get("TTYPE{}".format(i), "") for i in indices], flagName, bits)
+
+        fields = PoppingOrderedDict()
+
+        for i, data in zip(indices, columns):
+            name   = header.get("TTYPE{}".format(i), "")
+            type   = header.get("TCCLS{}".format(i), "")
+            unit   = header.get("TUNIT{}".format(i), "")
+            doc    = header.get("TDOC{}" .format(i), "")
+            fields[name] = Field(name, type, unit, data,
+                                 to_safe_doc(doc), None)
+        for i, data in zip(bits, flags):
+            name = header.get("TFLAG{}".format(i+1), "")
+            doc  = header.get("TFDOC{}".format(i+1), "")
+            fields[name] = Field(name, "Scalar", "", data,
+                                 to_safe_doc(doc), None)
+
+        for reference, referend in aliases:
+            if referend in fields:
+                fields[reference] = fields[referend]._replace(name=reference)
+
+        for name in wanted:
+            if not keep(name):
+                fields.pop(name, None)
+
+        return SourceTable(fields, slots, header)
+
 
 class Field(collections.namedtuple("Field_",
                                    ["name", "type", "unit", "data", 
@@ -217,32 +294,54 @@ class Field(collections.namedtuple("Field_",
 
         raise RuntimeError("Type not supported")
 
+    def get_binary_format(self):
+        """
+        Get the name of the binary COPY format ("int8" etc) for this field.
+        See lib.pgcopy.
+        """
+        if len(self.data.shape) > 1:
+            raise RuntimeError("data must not be multi-dimensional array to print")
+
+        return Field.dtypesToBinaryFormat[self.data.dtype.name]
+
+    # Must agree with dtypesToSQLType
+    dtypesToBinaryFormat = {
+        'bool'   : "bool",
+        'int8'   : "int2",
+        'uint8'  : "int2",
+        'int16'  : "int2",
+        'uint16' : "int4",
+        'int32'  : "int4",
+        'uint32' : "int8",
+        'int64'  : "int8",
+        'uint64' : "int8",
+        'float16': "float4",
+        'float32': "float4",
+        'float64': "float8",
+    }
+
+    def get_arrays(self):
+        """
+        Get self.data as a list of 1-dimensional numpy.array's.
+        For example, if the data is [ [1,2], [3,4] ],
+        the returned value will be [ array([1,3]), array([2,4]) ].
+        """
+        if len(self.data.shape) <= 1:
+            return [ self.data ]
+        else:
+            return [ self.data[...,i] for i in range(self.data.shape[-1]) ]
+
     def get_columns(self):
         """
         Accessor for self.data.
-        This function will return list of iterators each of which traverses a column.
+        This function will return list of numpy.array's each of which is a column.
         For example, if the data is [ [1,2], [3,4] ],
-        the returned value will be [ iter([1,3]), iter([2,4]) ].
+        the returned value will be [ array([1,3]), array([2,4]) ].
+        The columns are to be formatted by lib.tsvformat,
+        which is faster with numpy arrays than with Python-native values.
         """
-        if config.MULTICORE:
-            if len(self.data.shape) <= 1:
-                return [ self.data ]
-            else:
-                return [ self.data[...,i] for i in range(self.data.shape[-1]) ]
-        else:
-            # converting from numpy types to Python-native types accelerates formatting speed
-            name = self.data.dtype.name
-            if len(self.data.shape) <= 1:
-                if name.startswith('float'):
-                    return [(float(x) for x in self.data), ]
-                elif name == 'bool':
-                    return [(int(x) for x in self.data), ]
-                elif name.startswith('int') or name.startswith('uint'):
-                    return [(int(x) for x in self.data), ]
-                else:
-                    return [self.data]
-            else:
-                return [ (float(x) for x in self.data[...,i]) for i in range(self.data.shape[-1]) ]
+        return self.get_arrays()
+
     def get_compute(self):
         return[self.compute]
 
@@ -283,6 +382,9 @@ class Field_earth(Field):
     def get_print_format(self):
         return "(%.16e,%.16e,%.16e)"
 
+    def get_binary_format(self):
+        return "earth"
+
 
 def to_safe_doc(doc):
     """
@@ -0,0 +1,142 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Row order along a space-filling curve.
+
+Rows inserted in catalog order are scattered over the heap with respect
+to the sky, so a cone search touches about as many heap pages as it finds
+objects. Sorting the rows of a patch by the position of the object along
+a Morton (Z-order) or Hilbert curve through the unit cube containing the
+unit sphere puts objects close on the sky in the same pages.
+
+Keys are computed on (x, y, z) rather than (ra, dec) so that
+they have no singularity at the poles or at ra = 0.
+"""
+
+import numpy
+
+# Supported curves
+curves = ["morton", "hilbert"]
+
+# Bits per axis. 3 * 21 = 63 bits fit in int64.
+# (2 / 2**21 is about 0.2 arcsec on the sphere.)
+keyBits = 21
+
+
+def get_order(ra, dec, curve):
+    """
+    Get the permutation sorting objects along a curve.
+    @param ra (numpy.array)
+        Right ascension in degrees.
+    @param dec (numpy.array)
+        Declination in degrees.
+    @param curve (str)
+        One of "curves".
+    @return (numpy.array)
+        Indices that sort the objects, as given by numpy.argsort().
+        Objects without a position come last.
+    """
+    if curve == "morton":
+        key = morton_key(ra, dec)
+    elif curve == "hilbert":
+        key = hilbert_key(ra, dec)
+    else:
+        raise RuntimeError("Unknown curve: {}".format(curve))
+
+    key[~(numpy.isfinite(ra) & numpy.isfinite(dec))] = numpy.iinfo(numpy.int64).max
+    return numpy.argsort(key, kind="stable")
+
+
+def morton_key(ra, dec, bits=keyBits):
+    """
+    @return (numpy.array of int64)
+        Position along the Morton curve.
+    """
+    return _interleave(_quantize(ra, dec, bits), bits)
+
+
+def hilbert_key(ra, dec, bits=keyBits):
+    """
+    @return (numpy.array of int64)
+        Position along the Hilbert curve.
+    """
+    return _hilbert(_quantize(ra, dec, bits), bits)
+
+
+def _hilbert(X, bits):
+    """
+    Position along the Hilbert curve of integer coordinates.
+    @param X (list of numpy.array of int64)
+        Coordinates in [0, 2**bits), modified in place.
+    @return (numpy.array of int64)
+    """
+    n = len(X)
+
+    # J. Skilling, "Programming the Hilbert curve",
+    # AIP Conf. Proc. 707, 381 (2004): AxestoTranspose(),
+    # applied to all points at once. Branches on bit q of X[i]
+    # are replaced by masks "high" (all ones where the bit is set).
+    for q in range(bits - 1, 0, -1):
+        P = (1 << q) - 1
+        for i in range(n):
+            high = -((X[i] >> q) & 1)
+            t = (X[0] ^ X[i]) & P & ~high
+            X[0] ^= (P & high) | t
+            if i != 0:
+                X[i] ^= t
+
+    for i in range(1, n):
+        X[i] ^= X[i-1]
+
+    t = numpy.zeros_like(X[0])
+    for q in range(bits - 1, 0, -1):
+        t ^= ((1 << q) - 1) & -((X[n-1] >> q) & 1)
+    for i in range(n):
+        X[i] ^= t
+
+    return _interleave(X, bits)
+
+
+def _quantize(ra, dec, bits):
+    """
+    Convert (ra, dec) to integer coordinates in [0, 2**bits) of (x, y, z).
+    @return (list of numpy.array of int64)
+    """
+    ra = numpy.radians(numpy.asarray(ra, dtype=numpy.float64))
+    dec = numpy.radians(numpy.asarray(dec, dtype=numpy.float64))
+    cosdec = numpy.cos(dec)
+    scale = float(1 << bits)
+
+    axes = []
+    for v in (cosdec * numpy.cos(ra), cosdec * numpy.sin(ra), numpy.sin(dec)):
+        q = numpy.floor((v + 1.0) * (0.5 * scale))
+        # NaN would not convert to an integer (see get_order())
+        q = numpy.where(numpy.isfinite(q), q, scale - 1)
+        axes.append(numpy.clip(q, 0, scale - 1).astype(numpy.int64))
+    return axes
+
+
+def _interleave(axes, bits):
+    """
+    Interleave the bits of the axes, the most significant first.
+    @return (numpy.array of int64)
+    """
+    key = numpy.zeros_like(axes[0])
+    for bit in range(bits - 1, -1, -1):
+        for a in axes:
+            key = (key << 1) | ((a >> bit) & 1)
+    return key
@@ -0,0 +1,391 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic catalog files, laid out as those of a DC2 rerun,
+for benchmarks and tests that cannot use a real rerun.
+
+    make_rerun()   writes deepCoadd-results/merged/{tract}/{x},{y}/ref-*.fits
+                   and deepCoadd-results/{filter}/{tract}/{x},{y}/forced-*.fits
+                   (for ingest-object-catalog.py),
+    make_visits()  writes {visit}-{filter}/R{raft}/forced_{visit}-...-det*.fits
+                   (for ingest-forcedsource.py).
+
+The files are afw tables as the DM stack writes them: flags are bits of
+a "flags" column (FLAGCOL, TFLAGn), fields are of class (TCCLSn) "Scalar",
+AFW_TABLE_VERSION is 3, and besides
+the columns the ingest scripts use there are as many columns of algorithms
+that they ignore (CircularApertureFlux, GaussianFlux, ...), as in real
+files. Values are random but plausible (positive fluxes, flags mostly
+unset), and object_id's encode (tract, patch) as DC2's do.
+"""
+
+import gzip
+import os
+import shutil
+
+import numpy
+
+from .fits import pyfits
+from . import partition
+
+# Bands of DC2
+filters = ["u", "g", "r", "i", "z", "y"]
+
+# Names of pixel flags (base_PixelFlags_flag_{name})
+pixelFlags = [
+    "edge", "interpolated", "interpolatedCenter", "saturated", "saturatedCenter",
+    "cr", "crCenter", "bad", "suspect", "suspectCenter", "clipped", "offimage",
+    "sensor_edge", "sensor_edgeCenter", "bright_object", "bright_objectCenter",
+]
+
+# Radii of base_CircularApertureFlux (ignored by the ingest scripts)
+apertures = ["3_0", "4_5", "6_0", "9_0", "12_0", "17_0", "25_0", "35_0", "50_0", "70_0"]
+
+# Size of a patch in degrees, and patches per side of a tract
+patchSize = 0.2
+patchesPerSide = 7
+
+
+def make_rerun(rerunDir, tracts=[3830], patches=[0, 1], bands=filters,
+               nObjects=20000, compress=False, seed=0):
+    """
+    Write the catalog files of a rerun.
+    @param rerunDir (str)
+        Rerun directory to make.
+    @param tracts (list of int)
+    @param patches (list of int)
+        Patches (x*100 + y) of every tract.
+    @param bands (list of str)
+        Filters of the forced catalogs.
+    @param nObjects (int)
+        Number of objects in a patch.
+    @param compress (bool)
+        If True, files are gzipped (*.fits.gz).
+    @param seed (int)
+        Seed of the random numbers.
+    @return (list of str)
+        Paths to the files written.
+    """
+    rng = numpy.random.RandomState(seed)
+    paths = []
+    for tract in tracts:
+        for patch in patches:
+            x, y = patch // 100, patch % 100
+            refPath = "{rerunDir}/deepCoadd-results/merged/{tract}/{x},{y}/ref-{tract}-{x},{y}.fits".format(**locals())
+            object_id, ra, dec = get_objects(tract, patch, nObjects, rng)
+            paths.append(write_ref(refPath, object_id, ra, dec, rng, compress))
+
+            for filter in bands:
+                catPath = "{rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/forced-{filter}-{tract}-{x},{y}.fits".format(**locals())
+                paths.append(write_forced(catPath, object_id, ra, dec, rng, compress))
+    return paths
+
+
+def make_visits(rootDir, visits=[1000], bands=["r"], rafts=["22"], sensors=["11"],
+                nSources=5000, compress=False, seed=0):
+    """
+    Write the forced source files of visits.
+    @param rootDir (str)
+        Directory to make.
+    @param visits (list of int)
+    @param bands (list of str)
+        Filters, assigned to the visits in turn.
+    @param rafts (list of str)
+        Rafts of every visit, e.g. "22".
+    @param sensors (list of str)
+        Sensors of every raft, e.g. "11".
+    @param nSources (int)
+        Number of sources in a sensor. (Files with no more than a few
+        rows are taken to be empty by ForcedSourceFinder.)
+    @param compress (bool)
+        If True, files are gzipped (*.fits.gz).
+    @param seed (int)
+        Seed of the random numbers.
+    @return (list of str)
+        Paths to the files written.
+    """
+    rng = numpy.random.RandomState(seed)
+    paths = []
+    for i, visit in enumerate(visits):
+        filter = bands[i % len(bands)]
+        det = 0
+        for raft in rafts:
+            for sensor in sensors:
+                path = "{rootDir}/{visit:08}-{filter}/R{raft}/forced_{visit:08}-{filter}-R{raft}-S{sensor}-det{det:03}.fits".format(**locals())
+                object_id, ra, dec = get_objects(3830, rng.randint(patchesPerSide) * 100 + rng.randint(patchesPerSide), nSources, rng)
+                paths.append(write_visit(path, object_id, ra, dec, rng, compress))
+                det += 1
+    return paths
+
+
+def get_objects(tract, patch, nObjects, rng):
+    """
+    @return (numpy.array, numpy.array, numpy.array)
+        object_id, ra and dec (in radians) of objects in a patch.
+    """
+    x, y = patch // 100, patch % 100
+    lower, upper = partition.get_patch_bounds(tract, patch)
+    object_id = lower + numpy.arange(nObjects, dtype=numpy.int64)
+
+    # Tracts side by side in ra, and patches in them
+    ra0 = 50.0 + (tract % 100) * patchSize * patchesPerSide + x * patchSize
+    dec0 = -30.0 + y * patchSize
+    ra = numpy.radians(ra0 + rng.uniform(0, patchSize, size=nObjects))
+    dec = numpy.radians(dec0 + rng.uniform(0, patchSize, size=nObjects))
+    return object_id, ra, dec
+
+
+def write_ref(path, object_id, ra, dec, rng, compress=False):
+    """
+    Write a "ref-*.fits" file.
+    @return (str)
+        Path to the file written.
+    """
+    n = len(object_id)
+    columns = _common_columns(object_id, ra, dec, rng)
+    columns += _flux_columns("base_PsfFlux", n, rng)
+    columns += [
+        ("base_PsfFlux_area", "E", rng.uniform(20, 60, size=n)),
+        ("base_ClassificationExtendedness_value", "D", (rng.uniform(size=n) < 0.6).astype(float)),
+        ("base_Blendedness_old", "D", rng.uniform(0, 1, size=n)),
+        ("base_Blendedness_abs", "D", rng.uniform(0, 1, size=n)),
+        ("base_Blendedness_raw_child_instFlux", "D", _fluxes(n, rng)),
+        ("base_Blendedness_abs_child_instFlux", "D", _fluxes(n, rng)),
+    ]
+    columns += _centroid_columns("base_SdssCentroid", n, rng)
+    columns += _shape_columns("base_SdssShape", n, rng)
+    for infix in ["HsmSourceMoments", "HsmPsfMoments", "HsmSourceMomentsRound"]:
+        columns += _moment_columns("ext_shapeHSM_" + infix, n, rng)
+    columns += [
+        ("ext_shapeHSM_HsmShapeRegauss_" + name, "D", rng.normal(0, 0.3, size=n))
+        for name in ["e1", "e2", "sigma", "resolution"]
+    ]
+    columns += [
+        ("deblend_psfCenter_x", "D", rng.uniform(0, 4000, size=n)),
+        ("deblend_psfCenter_y", "D", rng.uniform(0, 4000, size=n)),
+        ("deblend_psfFlux", "D", _fluxes(n, rng)),
+    ]
+    columns += _ignored_columns(n, rng)
+    columns += _flux_columns("modelfit_CModel", n, rng)
+
+    flags = ["detect_isPrimary", "detect_isPatchInner", "detect_isTractInner"]
+    flags += ["merge_footprint_{}".format(f) for f in filters]
+    flags += ["merge_peak_{}".format(f) for f in filters] + ["merge_peak_sky"]
+    flags += ["base_PixelFlags_flag"] + ["base_PixelFlags_flag_" + f for f in pixelFlags]
+    flags += ["base_PsfFlux_flag", "base_SdssCentroid_flag", "base_SdssShape_flag",
+              "base_ClassificationExtendedness_flag", "ext_shapeHSM_HsmSourceMoments_flag",
+              "deblend_skipped", "deblend_tooManyPeaks", "deblend_masked", "modelfit_CModel_flag"]
+
+    # Most objects are primary
+    return write_catalog(path, columns, _flags(flags, n, rng, {"detect_isPrimary": 0.8}), compress)
+
+
+def write_forced(path, object_id, ra, dec, rng, compress=False):
+    """
+    Write a "forced-*.fits" file of a band.
+    @return (str)
+        Path to the file written.
+    """
+    n = len(object_id)
+    columns = _common_columns(object_id, ra, dec, rng)
+    columns += _flux_columns("base_PsfFlux", n, rng)
+    columns += [
+        ("base_PsfFlux_area", "E", rng.uniform(20, 60, size=n)),
+        ("base_ClassificationExtendedness_value", "D", (rng.uniform(size=n) < 0.6).astype(float)),
+    ]
+    for infix in ["", "_initial", "_exp", "_dev"]:
+        columns += _flux_columns("modelfit_CModel" + infix, n, rng)
+    columns += [
+        ("modelfit_CModel_fracDev", "D", rng.uniform(0, 1, size=n)),
+        ("modelfit_CModel_objective", "D", rng.uniform(0, 100, size=n)),
+    ]
+    columns += _centroid_columns("base_SdssCentroid", n, rng)
+    columns += _shape_columns("base_SdssShape", n, rng)
+    columns += _ignored_columns(n, rng)
+    columns += _flux_columns("undeblended_base_PsfFlux", n, rng)
+    columns += [
+        ("base_TransformedCentroid_x", "D", rng.uniform(0, 4000, size=n)),
+        ("base_TransformedCentroid_y", "D", rng.uniform(0, 4000, size=n)),
+    ]
+
+    flags = ["base_PixelFlags_flag"] + ["base_PixelFlags_flag_" + f for f in pixelFlags]
+    flags += ["base_PsfFlux_flag", "base_PsfFlux_flag_noGoodPixels", "base_PsfFlux_flag_edge",
+              "modelfit_CModel_flag", "modelfit_CModel_flag_apCorr", "base_SdssCentroid_flag",
+              "base_SdssShape_flag", "base_ClassificationExtendedness_flag"]
+
+    return write_catalog(path, columns, _flags(flags, n, rng), compress)
+
+
+def write_visit(path, object_id, ra, dec, rng, compress=False):
+    """
+    Write a "forced_{visit}-*.fits" file of a sensor.
+    @return (str)
+        Path to the file written.
+    """
+    n = len(object_id)
+    columns = [("id", "K", numpy.arange(n, dtype=numpy.int64) + (rng.randint(1 << 20) << 20))]
+    columns += _common_columns(object_id, ra, dec, rng)[1:]
+    columns += [("objectId", "K", object_id)]
+    columns += _flux_columns("base_PsfFlux", n, rng)
+    columns += [
+        ("base_PsfFlux_area", "E", rng.uniform(20, 60, size=n)),
+        ("base_PsfFlux_apCorr", "D", rng.uniform(0.9, 1.1, size=n)),
+        ("base_PsfFlux_apCorrErr", "D", rng.uniform(0, 0.01, size=n)),
+    ]
+    columns += _centroid_columns("base_SdssCentroid", n, rng)
+    columns += _shape_columns("base_SdssShape", n, rng)
+    columns += _ignored_columns(n, rng, coadd=False)
+    columns += [
+        ("base_TransformedCentroid_x", "D", rng.uniform(0, 4000, size=n)),
+        ("base_TransformedCentroid_y", "D", rng.uniform(0, 4000, size=n)),
+    ]
+
+    flags = ["base_PixelFlags_flag"] + ["base_PixelFlags_flag_" + f for f in pixelFlags]
+    flags += ["base_PsfFlux_flag", "base_PsfFlux_flag_noGoodPixels", "base_PsfFlux_flag_edge",
+              "base_PsfFlux_flag_apCorr", "base_SdssCentroid_flag", "base_SdssShape_flag"]
+
+    return write_catalog(path, columns, _flags(flags, n, rng), compress)
+
+
+def write_catalog(path, columns, flags, compress=False):
+    """
+    Write an afw table.
+    @param path (str)
+        Path ending with ".fits". ".gz" is appended if "compress".
+    @param columns (list of (str, str, numpy.array))
+        (name, TFORM, values) of the columns.
+    @param flags (list of (str, numpy.array))
+        (name, values) of the flags, stored as bits of column "flags".
+    @param compress (bool)
+    @return (str)
+        Path to the file written.
+    """
+    fitsColumns = [
+        pyfits.Column(name=name, format=tform, array=array)
+        for name, tform, array in columns
+    ]
+    if flags:
+        bits = numpy.stack([array for name, array in flags], axis=-1)
+        fitsColumns.insert(0, pyfits.Column(name="flags", format="{}X".format(len(flags)), array=bits))
+
+    hdu = pyfits.BinTableHDU.from_columns(fitsColumns)
+    hdu.header["HIERARCH AFW_TABLE_VERSION"] = 3
+    for i in range(len(columns)):
+        hdu.header["TCCLS{}".format(i + 1 + bool(flags))] = "Scalar"
+    if flags:
+        hdu.header["FLAGCOL"] = 1
+        for i, (name, array) in enumerate(flags):
+            hdu.header["TFLAG{}".format(i + 1)] = name
+    hdu.header.append(("ALIAS", "slot_PsfFlux:base_PsfFlux"))
+    hdu.header.append(("ALIAS", "slot_Centroid:base_SdssCentroid"))
+    hdu.header.append(("ALIAS", "slot_Shape:base_SdssShape"))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pyfits.HDUList([pyfits.PrimaryHDU(), hdu]).writeto(path, overwrite=True)
+    if compress:
+        with open(path, "rb") as fin, gzip.open(path + ".gz", "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+        os.remove(path)
+        path += ".gz"
+    return path
+
+
+def _common_columns(object_id, ra, dec, rng):
+    n = len(object_id)
+    parent = numpy.where(rng.uniform(size=n) < 0.2, object_id[rng.randint(n, size=n)], 0)
+    return [
+        ("id", "K", object_id),
+        ("coord_ra", "D", ra),
+        ("coord_dec", "D", dec),
+        ("parent", "K", parent),
+        ("deblend_nChild", "J", numpy.where(parent == 0, rng.poisson(0.3, size=n), 0).astype(numpy.int32)),
+    ]
+
+
+def _fluxes(n, rng):
+    # Magnitudes roughly from 18 to 28
+    return 10.0**(-0.4 * (rng.uniform(18, 28, size=n) - 31.4))
+
+
+def _flux_columns(prefix, n, rng):
+    flux = _fluxes(n, rng)
+    return [
+        (prefix + "_instFlux", "D", flux),
+        (prefix + "_instFluxErr", "D", numpy.sqrt(flux) + 10.0),
+    ]
+
+
+def _centroid_columns(prefix, n, rng):
+    return [
+        (prefix + "_x", "D", rng.uniform(0, 4000, size=n)),
+        (prefix + "_y", "D", rng.uniform(0, 4000, size=n)),
+        (prefix + "_xErr", "E", rng.uniform(0, 0.5, size=n)),
+        (prefix + "_yErr", "E", rng.uniform(0, 0.5, size=n)),
+    ]
+
+
+def _moment_columns(prefix, n, rng):
+    return [
+        (prefix + "_x", "D", rng.uniform(0, 4000, size=n)),
+        (prefix + "_y", "D", rng.uniform(0, 4000, size=n)),
+        (prefix + "_xx", "D", rng.uniform(2, 20, size=n)),
+        (prefix + "_yy", "D", rng.uniform(2, 20, size=n)),
+        (prefix + "_xy", "D", rng.normal(0, 2, size=n)),
+    ]
+
+
+def _shape_columns(prefix, n, rng):
+    columns = _moment_columns(prefix, n, rng)
+    columns += [
+        (prefix + "_xxErr", "E", rng.uniform(0, 1, size=n)),
+        (prefix + "_yyErr", "E", rng.uniform(0, 1, size=n)),
+        (prefix + "_xyErr", "E", rng.uniform(0, 1, size=n)),
+        (prefix + "_psf_xx", "D", rng.uniform(2, 5, size=n)),
+        (prefix + "_psf_yy", "D", rng.uniform(2, 5, size=n)),
+        (prefix + "_psf_xy", "D", rng.normal(0, 0.5, size=n)),
+    ]
+    columns += _flux_columns(prefix, n, rng)
+    return columns
+
+
+def _ignored_columns(n, rng, coadd=True):
+    """
+    Columns of algorithms the ingest scripts do not read.
+    @param coadd (bool)
+        If True, include those only in coadd catalogs.
+    """
+    columns = []
+    for radius in apertures:
+        columns += _flux_columns("base_CircularApertureFlux_" + radius, n, rng)
+    columns += _flux_columns("base_GaussianFlux", n, rng)
+    columns += _flux_columns("ext_photometryKron_KronFlux", n, rng)
+    columns += _flux_columns("base_LocalBackground", n, rng)
+    if coadd:
+        columns += [
+            ("base_Variance_value", "D", rng.uniform(0, 1, size=n)),
+            ("base_InputCount_value", "J", rng.randint(1, 100, size=n).astype(numpy.int32)),
+        ]
+    return columns
+
+
+def _flags(names, n, rng, probabilities={}):
+    """
+    @param probabilities (dict)
+        Name -> probability of the flag being set, if not small.
+    @return (list of (str, numpy.array))
+    """
+    return [(name, rng.uniform(size=n) < probabilities.get(name, 0.05)) for name in names]
@@ -0,0 +1,348 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vectorized printf for COPY's text format.
+
+encode(format, columns) yields the same bytes as
+
+    b"".join(format % tpl for tpl in zip(*columns))
+
+for the row formats made of Field.get_print_format() conventions
+("%d", "%ld", "%lu", "%.8e", "%.16e", and literal separators),
+but each column is converted to text in bulk with numpy.
+
+Every value is rendered into a fixed-width record whose unused bytes
+are NUL. A row is a structure of such records (and of the literal
+separators); removing NULs from an array of rows leaves the text.
+Digits are looked up four at a time from a table, and the records
+are built field by field so that no Python object is created per value.
+
+"%.Ne" (N <= 16) is computed in numpy by scaling the values by powers of
+ten in double-double arithmetic, which is accurate enough to round
+correctly all the values but those too close to a tie. Such values,
+non-finite values, zeros, and values of extreme magnitude are formatted
+one by one with the "%" operator, as are other conversions.
+"""
+
+import fractions
+import re
+
+import numpy
+
+# Number of rows formatted at a time
+blockRows = 8192
+
+_conversion = re.compile(rb"%(?:\.([0-9]+))?l?([deu])")
+
+# The largest precision for which "%.Ne" is computed in numpy.
+# The mantissa must fit in int64.
+_maxFastPrecision = 16
+
+# _digitTable[i] = "%04d" % i, packed in 4 bytes
+_digitTable = numpy.frombuffer(b"".join(b"%04d" % i for i in range(10000)), dtype=numpy.uint32)
+
+# _digitTableLeading[i] = "%4d" % i, but padded with NULs instead of spaces
+_digitTableLeading = numpy.frombuffer(b"".join((b"%4d" % i).replace(b" ", b"\0") for i in range(10000)), dtype=numpy.uint32)
+_digitTableBoth = numpy.concatenate([_digitTable, _digitTableLeading])
+
+# _digitTable2[i] = "%02d" % i, packed in 2 bytes
+_digitTable2 = numpy.frombuffer(b"".join(b"%02d" % i for i in range(100)), dtype=numpy.uint16)
+
+
+def _make_powers_of_ten(offset):
+    """
+    Make 10**k (-offset <= k <= offset) in double-double.
+    @return (numpy.array, numpy.array)
+        hi and lo such that hi[k + offset] + lo[k + offset] = 10**k.
+    """
+    hi = []
+    lo = []
+    for k in range(-offset, offset + 1):
+        exact = fractions.Fraction(10) ** k
+        hi.append(float(exact))
+        lo.append(float(exact - fractions.Fraction(hi[-1])))
+    return numpy.array(hi), numpy.array(lo)
+
+_powersOfTenOffset = 300
+_powersOfTenHi, _powersOfTenLo = _make_powers_of_ten(_powersOfTenOffset)
+
+# Values out of this range are formatted by "%"
+# so that the double-double arithmetic will not overflow.
+_minFastMagnitude = 1e-270
+_maxFastMagnitude = 1e270
+
+# Values whose scaled fraction is this close to 0.5 are formatted by "%"
+_tieMargin = 1e-5
+
+
+def parse_format(format):
+    """
+    Split a row format into conversions and literals.
+    @param format (bytes)
+        e.g. b"%ld\t%.8e\t(%.16e,%.16e,%.16e)\n"
+    @return (list)
+        Each element is either a literal (bytes)
+        or a conversion (conv: bytes, type: bytes, precision: int or None).
+    """
+    if isinstance(format, str):
+        format = format.encode("utf-8")
+
+    items = []
+    pos = 0
+    for m in _conversion.finditer(format):
+        if m.start() > pos:
+            items.append(format[pos:m.start()])
+        precision = None if m.group(1) is None else int(m.group(1))
+        items.append((m.group(0), m.group(2), precision))
+        pos = m.end()
+
+    if pos < len(format):
+        items.append(format[pos:])
+
+    for item in items:
+        if isinstance(item, bytes) and (b"%" in item or b"\0" in item):
+            raise RuntimeError("Format not supported: {}".format(format))
+
+    return items
+
+
+def encode(format, columns, nRows=None):
+    """
+    Format columns as text.
+    @param format (bytes)
+        Row format, including the trailing newline.
+    @param columns (list of numpy.array)
+        One column per conversion in "format".
+    @param nRows (int)
+        Number of rows. Taken from the first column if omitted.
+    @return
+        Generator of bytes, the concatenation of which is the whole text.
+    """
+    items = parse_format(format)
+    columns = [numpy.asarray(column) for column in columns]
+
+    if sum(1 for item in items if not isinstance(item, bytes)) != len(columns):
+        raise RuntimeError("Number of columns does not match format")
+
+    if nRows is None:
+        nRows = len(columns[0]) if columns else 0
+
+    for start in range(0, nRows, blockRows):
+        stop = min(start + blockRows, nRows)
+        yield format_block(items, [column[start:stop] for column in columns], stop - start)
+
+
+def format_block(items, columns, nRows):
+    """
+    Format rows at once.
+    @param items (list)
+        Return value of parse_format().
+    @param columns (list of numpy.array)
+        Columns, each of which has "nRows" elements.
+    @param nRows (int)
+    @return (bytes)
+    """
+    pieces = []
+    iColumn = 0
+    for item in items:
+        if isinstance(item, bytes):
+            pieces.append(numpy.frombuffer(item, dtype="V{}".format(len(item))))
+        else:
+            pieces.append(_format_column(item, columns[iColumn]))
+            iColumn += 1
+
+    names = ["f{}".format(i) for i in range(len(pieces))]
+    rows = numpy.empty(nRows, dtype=[(name, "V{}".format(piece.itemsize)) for name, piece in zip(names, pieces)])
+    for name, piece in zip(names, pieces):
+        rows[name] = piece.view("V{}".format(piece.itemsize))
+
+    chars = rows.view(numpy.uint8)
+    return chars[chars != 0].tobytes()
+
+
+def _format_column(item, column):
+    """
+    Format a column into fixed-width records padded with NULs.
+    @param item (tuple)
+        Conversion (conv, type, precision). See parse_format().
+    @param column (numpy.array)
+    @return (numpy.array)
+        1-dimensional array, one record per element.
+    """
+    conv, type, precision = item
+    kind = column.dtype.kind
+
+    if type in (b"d", b"u") and kind in "biu":
+        return _format_int(column)
+
+    if type == b"e" and kind == "f" and precision is not None and precision <= _maxFastPrecision:
+        return _format_e(conv, precision, column)
+
+    return _format_generic(conv, column)
+
+
+def _format_generic(conv, column):
+    """
+    Format elements one by one with "%".
+    @return (numpy.array)
+        Array of bytes.
+    """
+    return numpy.array([conv % x for x in column.tolist()], dtype=bytes).reshape(len(column))
+
+
+def _format_int(column):
+    """
+    Compute "%d" % x for each x in an integer (or bool) column.
+    """
+    n = len(column)
+    if column.dtype.kind == "i":
+        negative = column < 0
+        # Two's complement negation works for the minimum value as well
+        magnitude = column.astype(numpy.int64).view(numpy.uint64)
+        magnitude = numpy.where(negative, ~magnitude + numpy.uint64(1), magnitude)
+    else:
+        negative = None
+        magnitude = column.astype(numpy.uint64)
+
+    maximum = int(magnitude.max()) if n else 0
+    if maximum < 2**32:
+        magnitude = magnitude.astype(numpy.uint32)
+
+    # sign, then groups of four digits
+    nGroups = (len(str(maximum)) + 3) // 4
+    record = numpy.dtype([("sign", "u1")] + [("g{}".format(i), "u4") for i in range(nGroups)])
+    out = numpy.empty(n, dtype=record)
+    out["sign"] = 0 if negative is None else numpy.where(negative, ord("-"), 0)
+
+    values = magnitude
+    for i in range(nGroups - 1, -1, -1):
+        values, remainder = numpy.divmod(values, magnitude.dtype.type(10000))
+        # The group is the most significant if magnitude < 10**(4*(nGroups-i)),
+        # and it is not printed at all if magnitude < 10**(4*(nGroups-i-1))
+        # (except the last group, which prints "0" for zero).
+        if i > 0:
+            remainder += 10000 * (magnitude < magnitude.dtype.type(10 ** (4 * (nGroups - i)))).astype(remainder.dtype)
+        else:
+            remainder += 10000
+        group = _digitTableBoth[remainder]
+        if i < nGroups - 1:
+            group[magnitude < magnitude.dtype.type(10 ** (4 * (nGroups - i - 1)))] = 0
+        out["g{}".format(i)] = group
+
+    return out
+
+
+def _two_product(a, b):
+    """
+    Dekker's product: a * b = p + e exactly.
+    @return (numpy.array, numpy.array)
+        p, e
+    """
+    p = a * b
+    t = 134217729.0 * a  # 2**27 + 1
+    aHi = t - (t - a)
+    aLo = a - aHi
+    t = 134217729.0 * b
+    bHi = t - (t - b)
+    bLo = b - bHi
+    e = ((aHi * bHi - p) + aHi * bLo + aLo * bHi) + aLo * bLo
+    return p, e
+
+
+def _scale(ax, k):
+    """
+    Compute ax * 10**k in double-double.
+    @return (numpy.array, numpy.array)
+        Integral part (int64) and fractional part (float64).
+        The fractional part is accurate to about 1e-14.
+    """
+    index = k + _powersOfTenOffset
+    p, e = _two_product(ax, _powersOfTenHi[index])
+    e += ax * _powersOfTenLo[index]
+
+    integer = numpy.floor(p)
+    fraction = (p - integer) + e
+    carry = numpy.floor(fraction)
+    return integer.astype(numpy.int64) + carry.astype(numpy.int64), fraction - carry
+
+
+def _format_e(conv, precision, column):
+    """
+    Compute "%.{precision}e" % x for each x in a float column.
+    """
+    with numpy.errstate(invalid="ignore"):
+        # signaling NaNs warn when cast
+        x = column.astype(numpy.float64)
+    n = len(x)
+    ax = numpy.abs(x)
+
+    regular = numpy.isfinite(ax) & (ax >= _minFastMagnitude) & (ax < _maxFastMagnitude)
+    ax = numpy.where(regular, ax, 1.0)
+
+    # ax * 10**(precision - exponent) is to be in [10**precision, 10**(precision+1))
+    exponent = numpy.floor(numpy.log10(ax)).astype(numpy.int64)
+    integer, fraction = _scale(ax, precision - exponent)
+
+    # log10() may be wrong by one near powers of ten
+    wrong = (integer < 10 ** precision) | (integer >= 10 ** (precision + 1))
+    if numpy.any(wrong):
+        exponent[wrong] += numpy.where(integer[wrong] < 10 ** precision, -1, 1)
+        integer[wrong], fraction[wrong] = _scale(ax[wrong], precision - exponent[wrong])
+
+    regular &= numpy.abs(fraction - 0.5) >= _tieMargin
+
+    mantissa = integer + (fraction > 0.5)
+    carry = mantissa >= 10 ** (precision + 1)
+    mantissa[carry] //= 10
+    exponent[carry] += 1
+
+    # The fraction is padded with zeros to groups of four digits.
+    nGroups = (precision + 3) // 4
+    leading, fraction = numpy.divmod(mantissa.astype(numpy.uint64), numpy.uint64(10 ** precision))
+    fraction *= numpy.uint64(10 ** (4 * nGroups - precision))
+    absExponent = numpy.abs(exponent)
+
+    record = numpy.dtype(
+        [("sign", "u1"), ("leading", "u1"), ("point", "u1")]
+        + [("fraction{}".format(i), "u4") for i in range(nGroups)]
+        + [("e", "u1"), ("esign", "u1"), ("exponent1", "u1"), ("exponent2", "u2")]
+    )
+    out = numpy.empty(n, dtype=record)
+    out["sign"] = numpy.where(x < 0, ord("-"), 0)
+    out["leading"] = leading + ord("0")
+    out["point"] = ord(".")
+    for i in range(nGroups - 1, -1, -1):
+        fraction, remainder = numpy.divmod(fraction, numpy.uint64(10000))
+        out["fraction{}".format(i)] = _digitTable[remainder]
+    out["e"] = ord("e")
+    out["esign"] = numpy.where(exponent < 0, ord("-"), ord("+"))
+    out["exponent1"] = numpy.where(absExponent >= 100, absExponent // 100 + ord("0"), 0)
+    out["exponent2"] = _digitTable2[absExponent % 100]
+
+    chars = out.view(numpy.uint8).reshape(n, record.itemsize)
+    chars[:, 3 + precision:3 + 4 * nGroups] = 0
+    if precision == 0:
+        chars[:, 2] = 0
+
+    irregular = numpy.flatnonzero(~regular)
+    if len(irregular):
+        strings = _format_generic(conv, column[irregular])
+        if strings.dtype.itemsize > record.itemsize:
+            raise RuntimeError("Unexpected length: {}".format(strings))
+        chars[irregular] = strings.astype("S{}".format(record.itemsize)).view(numpy.uint8).reshape(-1, record.itemsize)
+
+    return out
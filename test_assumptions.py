@@ -16,7 +16,11 @@
 
 import unittest
 
+import numpy
+
 from lib.assumptions import Assumptions
+from lib.misc import PoppingOrderedDict
+from lib.sourcetable import SourceTable, Field
 
 class testAssumptions(unittest.TestCase):
 
@@ -30,6 +34,51 @@ class testAssumptions(unittest.TestCase):
         for t in tables:
             print(t)
 
+    def make_raw(self, n, extra=[]):
+        fields = PoppingOrderedDict()
+        names = ['id', 'objectId', 'base_PsfFlux_instFlux',
+                 'base_PixelFlags_flag_edge',
+                 'base_PixelFlags_flag_interpolatedCenter',
+                 'base_PixelFlags_flag_saturatedCenter',
+                 'base_PixelFlags_flag_crCenter',
+                 'base_PixelFlags_flag_bad',
+                 'base_PixelFlags_flag_suspectCenter'] + extra
+        rng = numpy.random.RandomState(n)
+        for name in names:
+            if name.startswith('base_PixelFlags'):
+                data = rng.uniform(size=n) < 0.1
+            else:
+                data = rng.normal(size=n)
+            fields[name] = Field(name, "Scalar", "", data, "", None)
+        return SourceTable(fields, {}, None)
+
+    def test_plan_reused(self):
+        assump = Assumptions('config/forced_source_assumptions.yaml')
+        kw = {'visit': 1234, 'raft': 10, 'sensor': 2}
+
+        fields = assump.apply(self.make_raw(5), 'schema', **kw)['forcedsourcenative'].fields
+        plan = assump.plan
+        self.assertNotIn('id', fields)
+        self.assertEqual(list(fields)[-2:], ['ccdVisitId', 'forcedsourcevisit_good'])
+        self.assertTrue(numpy.all(fields['ccdVisitId'].data == 100200001234))
+
+        raw = self.make_raw(7)
+        fields = assump.apply(raw, 'schema', **kw)['forcedsourcenative'].fields
+        self.assertIs(assump.plan, plan)
+        self.assertEqual(len(fields['ccdVisitId'].data), 7)
+        good = ~(raw.fields['base_PixelFlags_flag_edge'].data
+                 | raw.fields['base_PixelFlags_flag_interpolatedCenter'].data
+                 | raw.fields['base_PixelFlags_flag_saturatedCenter'].data
+                 | raw.fields['base_PixelFlags_flag_crCenter'].data
+                 | raw.fields['base_PixelFlags_flag_bad'].data
+                 | raw.fields['base_PixelFlags_flag_suspectCenter'].data)
+        self.assertTrue(numpy.array_equal(fields['forcedsourcevisit_good'].data, good))
+
+        raw = self.make_raw(3, extra=['base_PsfFlux_instFluxErr'])
+        fields = assump.apply(raw, 'schema', **kw)['forcedsourcenative'].fields
+        self.assertIsNot(assump.plan, plan)
+        self.assertIn('base_PsfFlux_instFluxErr', fields)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import unittest.mock
+
+import psycopg2.extensions
+
+from lib import common
+
+class FakeConnection(object):
+    """
+    Connection recording the statements executed, without a server.
+    """
+    def __init__(self, **kwargs):
+        self.closed = 0
+        self.autocommit = False
+        self.readonly = None
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, statement, params=None):
+        self.connection.statements.append(statement)
+
+class testConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        patcher = unittest.mock.patch("psycopg2.connect", FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = common.ConnectionPool(size=1)
+
+    def test_reuse(self):
+        db = self.pool.get()
+        connection = db.connection
+        db.close()
+        db.close()
+        self.assertEqual(db.closed, 1)
+
+        db = self.pool.get()
+        self.assertIs(db.connection, connection)
+        other = self.pool.get()
+        self.assertIsNot(other.connection, connection)
+        db.close()
+        other.close()
+
+        # Beyond the size of the pool, connections are closed
+        self.assertEqual(connection.closed, 0)
+        self.assertEqual(other.closed, 1)
+        self.assertEqual(len([s for s in connection.statements if "set_config" in s]), 1)
+
+    def test_reset(self):
+        db = self.pool.get()
+        db.autocommit = True
+        connection = db.connection
+        db.close()
+
+        self.assertEqual(connection.autocommit, False)
+        self.assertIn("RESET ALL", connection.statements)
+        self.assertEqual(len([s for s in connection.statements if "set_config" in s]), 2)
+
+    def test_execute_once(self):
+        db = self.pool.get()
+        with db.cursor() as cursor:
+            common.execute_once(cursor, "CREATE TABLE IF NOT EXISTS t ()")
+            common.execute_once(cursor, "CREATE TABLE IF NOT EXISTS t ()")
+        db.rollback()
+        with db.cursor() as cursor:
+            common.execute_once(cursor, "CREATE TABLE IF NOT EXISTS t ()")
+        db.commit()
+        with db.cursor() as cursor:
+            common.execute_once(cursor, "CREATE TABLE IF NOT EXISTS t ()")
+        self.assertEqual(db.statements.count("CREATE TABLE IF NOT EXISTS t ()"), 2)
+        db.close()
+
+    def test_execute_prepared(self):
+        db = self.pool.get()
+        with db.cursor() as cursor:
+            common.execute_prepared(cursor, "SELECT $1", (1,))
+            common.execute_prepared(cursor, "SELECT $1", (2,))
+            common.execute_prepared(cursor, "SELECT 0", ())
+        self.assertEqual(db.statements[1:], [
+            "PREPARE dc2_stmt_0 AS SELECT $1",
+            "EXECUTE dc2_stmt_0 (%s)",
+            "EXECUTE dc2_stmt_0 (%s)",
+            "PREPARE dc2_stmt_1 AS SELECT 0",
+            "EXECUTE dc2_stmt_1",
+        ])
+        db.close()
+
+if __name__ == "__main__":
+    unittest.main()
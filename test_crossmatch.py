@@ -0,0 +1,53 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import unittest
+
+import numpy
+
+from lib import crossmatch
+
+class testCrossmatch(unittest.TestCase):
+
+    def test_read_positions(self):
+        text = (
+            "# id ra dec radius\n"
+            "16844518137528321 10.5 -20.25 2.0\n"
+            "\n"
+            "16844518137528323 11.5 -21.25  # default radius\n"
+        )
+        ids, ra, dec, radius = crossmatch.read_positions(io.StringIO(text), 1.0)
+        self.assertEqual(ids.dtype, numpy.int64)
+        self.assertEqual(ids.tolist(), [16844518137528321, 16844518137528323])
+        self.assertEqual(ra.tolist(), [10.5, 11.5])
+        self.assertEqual(dec.tolist(), [-20.25, -21.25])
+        self.assertEqual(radius.tolist(), [2.0, 1.0])
+
+    def test_read_no_positions(self):
+        ids, ra, dec, radius = crossmatch.read_positions(io.StringIO(""), 1.0)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(len(radius), 0)
+
+    def test_query(self):
+        query = crossmatch.get_query('"pg_temp"."p"', '"s"."position"', nearest=True)
+        self.assertIn('FROM\n      "pg_temp"."p" p\n    CROSS JOIN LATERAL', query)
+        self.assertIn('"s"."position" o', query)
+        self.assertIn("LIMIT 1", query)
+        self.assertNotIn("LIMIT", crossmatch.get_query('"pg_temp"."p"', '"s"."position"'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from lib import query
+from lib.dpdd import DpddView
+
+class testDpddView(unittest.TestCase):
+
+    def test_per_band_join_type(self):
+        tableSpecs = [
+            {'table_name': 'position'},
+            {'table_name': 'forced2', 'join_type': ' left join', 'join_using': ['object_id']},
+            {'table_name': 'forced3', 'join_type': 'join', 'join_using': ['object_id']},
+        ]
+        spec = DpddView._get_table_spec(tableSpecs, 's', {'forced2': [], 'forced3': []}, ['g', 'r'])
+        for band in ['g', 'r']:
+            self.assertIn(' left join "s".forced2 AS forced2_{b} on'.format(b=band), spec)
+            self.assertIn(' join "s".forced3 AS forced3_{b} on'.format(b=band), spec)
+            self.assertNotIn('left join "s".forced3', spec)
+
+    def test_untyped_columns(self):
+        class View(object):
+            def column_types(self):
+                return [('ra', 'double'), ('filtername', None), ('obsstart', 'string')]
+
+        self.assertEqual(query.get_dpdd_formats(View()), [('ra', 'float8')])
+        with self.assertRaisesRegex(ValueError, 'filtername'):
+            query.get_dpdd_formats(View(), ['ra', 'filtername'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib import export
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class testExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_manifest(self):
+        self.assertEqual(export.read_manifest(self.tmpdir), {})
+
+        manifest = {"schema": "s", "columns": [("objectid", "int8")], "tracts": {
+            "3830": {"fingerprint": "a", "file": "tract_3830.parquet", "rows": 10},
+            "3831": {"fingerprint": "b", "file": "tract_3831.parquet", "rows": 20},
+        }}
+        export.write_manifest(self.tmpdir, manifest)
+        manifest = export.read_manifest(self.tmpdir)
+        self.assertEqual(manifest["columns"], [("objectid", "int8")])
+
+        fingerprints = {3830: "a", 3831: "c", 4023: "d"}
+        self.assertEqual(export.get_stale_tracts(manifest, fingerprints), {3831: "c", 4023: "d"})
+        self.assertEqual(export.get_removed_tracts(manifest, {4023: "d"}), [3830, 3831])
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_write_parquet(self):
+        n = 25
+        data = collections.OrderedDict([
+            ("objectid", numpy.arange(n, dtype=numpy.int64)),
+            ("mag_i", numpy.linspace(20, 25, n).astype(numpy.float32)),
+            ("coord", numpy.ones((n, 3))),
+        ])
+        path = self.tmpdir + "/tract_1.parquet"
+        self.assertEqual(export.write_parquet(path, data, rowGroupRows=10), n)
+
+        metadata = pyarrow.parquet.ParquetFile(path).metadata
+        self.assertEqual(metadata.num_row_groups, 3)
+        self.assertEqual(metadata.row_group(1).column(0).statistics.min, 10)
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column_names, ["objectid", "mag_i", "coord"])
+        self.assertEqual(table.column("coord").to_pylist()[0], [1.0, 1.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib import fits
+from lib.fits import pyfits
+from lib.sourcetable import SourceTable
+
+class testFits(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cat.fits")
+
+        rng = numpy.random.RandomState(0)
+        n = 1000
+        nFlags = 11
+        flags = rng.uniform(size=(n, nFlags)) < 0.3
+
+        columns = [
+            pyfits.Column(name="flags", format="{}X".format(nFlags), array=flags),
+            pyfits.Column(name="id", format="K", array=numpy.arange(n, dtype=numpy.int64) << 40),
+            pyfits.Column(name="coord_ra", format="D", array=rng.uniform(size=n)),
+            pyfits.Column(name="base_PsfFlux_instFlux", format="E", array=rng.normal(size=n)),
+            pyfits.Column(name="base_SdssShape_psf", format="3E", array=rng.normal(size=(n, 3))),
+            pyfits.Column(name="matrix", format="6D", dim="(3,2)", array=rng.normal(size=(n, 2, 3))),
+            pyfits.Column(name="base_Variance_value", format="E", array=rng.normal(size=n)),
+            pyfits.Column(name="nChild", format="J", bzero=2**31, array=rng.randint(0, 2**32, size=n, dtype=numpy.uint64).astype(numpy.uint32)),
+            pyfits.Column(name="small", format="I", bzero=2**15, array=rng.randint(0, 2**16, size=n).astype(numpy.uint16)),
+            pyfits.Column(name="primary", format="L", array=rng.uniform(size=n) < 0.5),
+        ]
+        hdu = pyfits.BinTableHDU.from_columns(columns, uint=True)
+        hdu.header["FLAGCOL"] = 1
+        for i in range(nFlags):
+            hdu.header["TFLAG{}".format(i + 1)] = "base_PixelFlags_flag_{}".format(i)
+        hdu.header["TCCLS5"] = "Moments"
+        hdu.header.append(("ALIAS", "slot_PsfFlux:base_PsfFlux"))
+        hdu.header.append(("ALIAS", "psfFlux:base_PsfFlux_instFlux"))
+        hdu.header.append(("ALIAS", "firstFlag:base_PixelFlags_flag_0"))
+
+        pyfits.HDUList([pyfits.PrimaryHDU(), hdu]).writeto(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameTable(self, table, expected):
+        self.assertEqual(list(table.fields), list(expected.fields))
+        self.assertEqual(table.slots, expected.slots)
+        for name, field in expected.fields.items():
+            other = table.fields[name]
+            self.assertEqual(other.name, field.name)
+            self.assertEqual(other.type, field.type)
+            self.assertEqual(other.data.dtype.name, field.data.dtype.name, name)
+            self.assertEqual(other.data.shape, field.data.shape, name)
+            self.assertTrue(numpy.array_equal(other.data, field.data), name)
+
+    def test_all_fields(self):
+        expected = SourceTable.from_hdu(fits.fits_open(self.path)[1])
+        self.assertSameTable(SourceTable.from_fits(self.path), expected)
+
+    def test_gzip(self):
+        with open(self.path, "rb") as fin, gzip.open(self.path + ".gz", "wb") as fout:
+            fout.write(fin.read())
+        expected = SourceTable.from_hdu(fits.fits_open(self.path)[1])
+        os.remove(self.path)
+
+        self.assertSameTable(SourceTable.from_fits(self.path), expected)
+
+    def test_projection(self):
+        keep = lambda name: not name.startswith(("base_Variance_", "base_PixelFlags_flag_", "matrix"))
+
+        expected = SourceTable.from_hdu(fits.fits_open(self.path)[1])
+        for name in list(expected.fields):
+            if not keep(name):
+                del expected.fields[name]
+
+        table = SourceTable.from_fits(self.path, keep)
+        self.assertSameTable(table, expected)
+        # The alias is kept though its referend is not
+        self.assertIn("firstFlag", table.fields)
+
+    def test_blocks(self):
+        readBlockRows = fits._readBlockRows
+        fits._readBlockRows = 7
+        try:
+            table = SourceTable.from_fits(self.path)
+        finally:
+            fits._readBlockRows = readBlockRows
+        expected = SourceTable.from_hdu(fits.fits_open(self.path)[1])
+        self.assertSameTable(table, expected)
+
+    def test_flag_bits(self):
+        table = fits.BinTable(self.path)
+        expected = fits.fits_open(self.path)[1].data["flags"]
+        for bit, data in zip([0, 7, 8, 10], table.flag_bits("flags", [0, 7, 8, 10])):
+            self.assertTrue(numpy.array_equal(data, expected[:, bit]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import unittest
+
+import numpy
+
+from lib import healpix
+
+def random_positions(rng, n):
+    ra = rng.uniform(0, 360, size=n)
+    dec = numpy.degrees(numpy.arcsin(rng.uniform(-1, 1, size=n)))
+    return ra, dec
+
+def offset(ra, dec, distance, angle):
+    """
+    Points at "distance" (degrees) from (ra, dec) in the directions "angle" (radians)
+    """
+    ra, dec, rho = math.radians(ra), math.radians(dec), math.radians(distance)
+    dec2 = numpy.arcsin(math.sin(dec)*math.cos(rho) + math.cos(dec)*math.sin(rho)*numpy.cos(angle))
+    ra2 = ra + numpy.arctan2(numpy.sin(angle)*math.sin(rho)*math.cos(dec), math.cos(rho) - math.sin(dec)*numpy.sin(dec2))
+    return numpy.degrees(ra2), numpy.degrees(dec2)
+
+class testHealpix(unittest.TestCase):
+
+    def test_base_pixels(self):
+        ra = numpy.array([0.0, 45.0, 45.0, 90.0, 10.0, 10.0, numpy.nan])
+        dec = numpy.array([0.0, 41.8, -41.8, 0.0, 90.0, -90.0, 0.0])
+        self.assertEqual(list(healpix.ang2pix_nest(0, ra, dec)), [4, 0, 8, 5, 0, 8, -1])
+
+    def test_nested(self):
+        # Pixels at order k-1 are pixels at order k divided by 4; areas are equal
+        rng = numpy.random.RandomState(0)
+        ra, dec = random_positions(rng, 100000)
+        pix = healpix.ang2pix_nest(healpix.maxOrder, ra, dec)
+        for order in [0, 3, 10, 20, 28]:
+            self.assertTrue(numpy.all(healpix.ang2pix_nest(order, ra, dec) == pix >> 2*(healpix.maxOrder - order)))
+
+        counts = numpy.bincount(pix >> 2*(healpix.maxOrder - 1), minlength=48)
+        self.assertEqual(len(counts), 48)
+        self.assertLess(numpy.abs(counts / (100000 / 48) - 1).max(), 0.1)
+
+    def test_neighbours(self):
+        order = 2
+        for pix in range(12 << 2*order):
+            for n in healpix.neighbours(order, pix):
+                if n >= 0:
+                    self.assertIn(pix, healpix.neighbours(order, n))
+
+    def test_cone_ranges(self):
+        # Points on the edge of cones are in the ranges, also at the corners of base pixels
+        rng = numpy.random.RandomState(1)
+        ra, dec = random_positions(rng, 200)
+        ra = numpy.concatenate([ra, numpy.arange(0, 360, 45.0), [0.0, 45.0, 0.0]])
+        dec = numpy.concatenate([dec, numpy.full(8, 41.8103), [89.9999, -41.8103, 0.0]])
+        angle = numpy.linspace(0, 2*math.pi, 64, endpoint=False)
+
+        for radius in [1.0, 30.0, 3600.0]:
+            for r, d in zip(ra, dec):
+                ranges = healpix.cone_ranges(r, d, radius)
+                self.assertLessEqual(len(ranges), 9)
+                for distance in [0.0, radius / 3600.0]:
+                    pix = healpix.ang2pix_nest(healpix.maxOrder, *offset(r, d, distance, angle))
+                    self.assertTrue(all(any(lo <= p <= hi for lo, hi in ranges) for p in pix))
+
+    def test_box_ranges(self):
+        ranges = healpix.box_ranges(50.0, 50.5, -30.0, -29.8)
+        ra, dec = numpy.meshgrid(numpy.linspace(50.0, 50.5, 20), numpy.linspace(-30.0, -29.8, 20))
+        pix = healpix.ang2pix_nest(healpix.maxOrder, ra.ravel(), dec.ravel())
+        self.assertTrue(all(any(lo <= p <= hi for lo, hi in ranges) for p in pix))
+
+        # Too large for the coarsest order
+        self.assertEqual(healpix.box_ranges(0, 180, -60, 60), [(0, (12 << 2*healpix.maxOrder) - 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib import common
+from lib import config
+from lib.fits import pyfits
+from lib.forcedsource_finder import ForcedSourceFinder
+
+class testManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifestDir = config.manifestDir
+        config.manifestDir = os.path.join(self.tmpdir, "manifests")
+
+    def tearDown(self):
+        config.manifestDir = self.manifestDir
+        common._coaddManifests.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def write_fits(self, path, nRows):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        hdu = pyfits.BinTableHDU.from_columns([
+            pyfits.Column(name="id", format="K", array=numpy.arange(nRows)),
+        ])
+        pyfits.HDUList([pyfits.PrimaryHDU(), hdu]).writeto(path)
+
+    def test_forced(self):
+        root = os.path.join(self.tmpdir, "forced")
+        def path(visit, raft, sensor):
+            return os.path.join(root, "{:08}-r".format(visit), "R" + raft,
+                "forced_{:08}-r-R{}-S{}-det000.fits".format(visit, raft, sensor))
+
+        self.write_fits(path(1, "01", "11"), 3)
+        self.write_fits(path(1, "01", "22"), 0)
+        self.write_fits(path(1, "10", "00"), 5)
+        self.write_fits(path(2, "01", "11"), 1)
+        os.makedirs(os.path.join(root, "00000003-g", "R22"))
+
+        finder = ForcedSourceFinder(root)
+        self.assertEqual(finder.get_visits(), [1, 2, 3])
+        self.assertEqual(finder.get_visit_files(1), [path(1, "01", "11"), path(1, "10", "00")])
+        self.assertEqual(len(finder.get_visit_files(1, nonempty=False)), 3)
+        self.assertEqual(finder.get_file_path(1, "R10", "S00"), path(1, "10", "00"))
+        self.assertEqual(finder.get_file_path(3), os.path.join(root, "00000003-g"))
+        self.assertIsNone(finder.get_file_path(3, "R22", "S00"))
+        self.assertIsNone(finder.get_file_path(4))
+
+        # Changes are noticed by the next finder
+        self.write_fits(path(3, "22", "00"), 2)
+        os.remove(path(1, "01", "11"))
+        finder = ForcedSourceFinder(root)
+        self.assertEqual(finder.get_visit_files(1), [path(1, "10", "00")])
+        self.assertEqual(finder.get_visit_files(3), [path(3, "22", "00")])
+
+        # A pickled finder can be used in another process
+        finder = pickle.loads(pickle.dumps(finder))
+        self.assertEqual(finder.get_visit_files(3), [path(3, "22", "00")])
+
+    def test_coadd(self):
+        rerunDir = os.path.join(self.tmpdir, "rerun")
+        results = os.path.join(rerunDir, "deepCoadd-results")
+        for tract, patch in [(10, "0,1"), (10, "2,3"), (11, "0,0")]:
+            self.write_fits(os.path.join(results, "merged", str(tract), patch,
+                "ref-{}-{}.fits".format(tract, patch)), 1)
+            self.write_fits(os.path.join(results, "r", str(tract), patch,
+                "forced-r-{}-{}.fits".format(tract, patch)), 1)
+        with open(os.path.join(results, "r", "10", "0,1", "other.txt"), "w"):
+            pass
+
+        self.assertEqual(common.get_existing_tracts(rerunDir), [10, 11])
+        manifest = common.get_coadd_manifest(rerunDir)
+        self.assertEqual(manifest.distinct("patch", kind="ref", tract=10), [1, 203])
+        entry = manifest.find_one(kind="forced", tract=11)
+        self.assertEqual((entry.patch, entry.filter, entry.nRows), (0, "r", 1))
+        self.assertEqual(len(manifest.find()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from lib import config
+from lib import metrics
+from lib.misc import meas_time
+
+class testMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.stop()
+        metrics.reset()
+
+    def test_timers(self):
+        @metrics.timer("outer")
+        def outer():
+            with metrics.timer("inner"):
+                pass
+
+        outer()
+        outer()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(meas_time("inner")(lambda x: x + 1)(1), 2)
+
+        timers = metrics.snapshot()["timers"]
+        self.assertEqual(timers["outer"]["calls"], 2)
+        self.assertEqual(timers["inner"]["calls"], 3)
+        self.assertIsNone(timers["inner"]["rss_high_water"])
+        self.assertEqual(timers["inner"]["seconds"], metrics.get_seconds("inner"))
+
+    def test_stage_rss(self):
+        with unittest.mock.patch.object(config, "metricsStageRss", True):
+            with metrics.timer("stage"):
+                pass
+        self.assertGreater(metrics.snapshot()["timers"]["stage"]["rss_high_water"], 0)
+
+    def test_counters(self):
+        metrics.set_total("patches", 4)
+        metrics.count("rows", 10, table="position")
+        metrics.count("rows", 5, table="dpdd_ref")
+        metrics.count("patches")
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"rows": 15, "patches": 1})
+        self.assertEqual(snapshot["tables"]["position"], {"rows": 10})
+        self.assertEqual(snapshot["progress"]["patches"]["done"], 1)
+        self.assertEqual(snapshot["progress"]["patches"]["total"], 4)
+        self.assertIsNotNone(snapshot["progress"]["patches"]["eta_seconds"])
+
+        text = metrics.to_prometheus(snapshot, {"name": "test"})
+        self.assertIn('dc2_ingest_rows_total{name="test"} 15.0', text)
+        self.assertIn('dc2_ingest_table_rows_total{name="test",table="position"} 10.0', text)
+        self.assertIn('dc2_ingest_units_expected{name="test",unit="patches"} 4.0', text)
+
+    def test_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            metrics.start(directory, "test", interval=3600)
+            metrics.count("files", 2)
+            metrics.emit()
+            metrics.stop()
+
+            path = os.path.join(directory, "test-{}".format(os.getpid()))
+            with open(path + ".jsonl") as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(lines[-1]["counters"]["files"], 2)
+            with open(path + ".prom") as f:
+                self.assertIn("dc2_ingest_files_total", f.read())
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
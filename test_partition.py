@@ -0,0 +1,42 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from lib import partition
+
+class testPartition(unittest.TestCase):
+
+    def test_bounds(self):
+        # The bounds must agree with tractSearch() so that queries are pruned
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            "postgres-objcatalog", "sql", "objcatalog.sql.in")
+        with open(path) as f:
+            self.assertIn("'4398046511104'::Bigint", f.read())
+
+        lower, upper = partition.get_tract_bounds(4023)
+        self.assertEqual(lower, 4023 * 4398046511104)
+        self.assertEqual(upper, 4024 * 4398046511104)
+        self.assertEqual(partition.get_tract_bounds(4024)[0], upper)
+
+        # object_id of tract 4023, patch (6,6)
+        object_id = (4023 << 42) | (6 << 37) | (6 << 32) | 1234
+        self.assertTrue(lower <= object_id < upper)
+
+
+if __name__ == '__main__':
+    unittest.main()
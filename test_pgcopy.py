@@ -0,0 +1,139 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import unittest
+
+import numpy
+
+from lib import pgcopy
+from lib.sourcetable import Field, Field_earth
+
+class testPgcopy(unittest.TestCase):
+
+    def test_scalars(self):
+        formats = ["int8", "bool", "int2", "float4", "float8"]
+        columns = [
+            numpy.array([1, -2], dtype=numpy.int64),
+            numpy.array([True, False]),
+            numpy.array([7, 200], dtype=numpy.uint8),
+            numpy.array([1.5, numpy.nan], dtype=numpy.float32),
+            numpy.array([2.25, -0.0], dtype=numpy.float64),
+        ]
+        stream = b"".join(pgcopy.encode(formats, columns))
+
+        expected = pgcopy.signature + struct.pack(">ii", 0, 0)
+        for i in range(2):
+            expected += struct.pack(">h", 5)
+            expected += struct.pack(">iq", 8, columns[0][i])
+            expected += struct.pack(">iB", 1, int(columns[1][i]))
+            expected += struct.pack(">ih", 2, columns[2][i])
+            expected += struct.pack(">if", 4, columns[3][i])
+            expected += struct.pack(">id", 8, columns[4][i])
+        expected += struct.pack(">h", -1)
+
+        self.assertEqual(stream, expected)
+
+    def test_unsigned_overflow(self):
+        column = numpy.array([1, 1 << 63], dtype=numpy.uint64)
+        with self.assertRaises(RuntimeError):
+            b"".join(pgcopy.encode(["int8"], [column]))
+
+        column = numpy.array([1, (1 << 63) - 1], dtype=numpy.uint64)
+        stream = b"".join(pgcopy.encode(["int8"], [column]))
+        self.assertIn(struct.pack(">iq", 8, (1 << 63) - 1), stream)
+
+    def test_earth(self):
+        field = Field_earth.from_radec("coord", numpy.array([0.1, 0.2]), numpy.array([-0.3, 0.4]))
+        self.assertEqual(field.get_binary_format(), "earth")
+        xyz = field.get_arrays()
+
+        stream = b"".join(pgcopy.encode(["earth"], xyz))
+
+        expected = pgcopy.header
+        for i in range(2):
+            expected += struct.pack(">hiI", 1, 28, 0x80000003)
+            expected += struct.pack(">ddd", xyz[0][i], xyz[1][i], xyz[2][i])
+        expected += pgcopy.trailer
+
+        self.assertEqual(stream, expected)
+
+    def test_char(self):
+        # The "band" column of per-band tables
+        band = numpy.full(2, b"g", dtype="S1")
+        stream = b"".join(pgcopy.encode(["int8", "char"], [numpy.array([1, 2]), band]))
+
+        expected = pgcopy.header
+        for i in range(2):
+            expected += struct.pack(">hiqi", 2, 8, i + 1, 1) + b"g"
+        expected += pgcopy.trailer
+
+        self.assertEqual(stream, expected)
+
+    def test_blocks(self):
+        n = pgcopy.blockRows * 2 + 3
+        column = numpy.arange(n, dtype=numpy.int32)
+        stream = pgcopy.BinaryCopyStream(["int4"], [column])
+        data = b""
+        while True:
+            chunk = stream.read(1000)
+            if not chunk: break
+            data += chunk
+
+        rows = numpy.frombuffer(data[len(pgcopy.header):-2],
+                                dtype=[("n", ">i2"), ("len", ">i4"), ("val", ">i4")])
+        self.assertEqual(len(rows), n)
+        self.assertTrue(numpy.all(rows["val"] == column))
+        self.assertTrue(numpy.all(rows["len"] == 4))
+
+    def test_decode(self):
+        # Decoding what was encoded, written in small pieces
+        n = pgcopy.blockRows + 5
+        formats = ["int8", "float4", "bool", "earth"]
+        columns = [
+            numpy.arange(n, dtype=numpy.int64),
+            numpy.linspace(0, 1, n).astype(numpy.float32),
+            numpy.arange(n) % 3 == 0,
+            numpy.full(n, 1.5), numpy.full(n, -2.0), numpy.arange(n, dtype=float),
+        ]
+        data = b"".join(pgcopy.encode(formats, columns))
+
+        decoder = pgcopy.Decoder(formats)
+        for start in range(0, len(data), 100000):
+            decoder.write(data[start:start+100000])
+        decoded = decoder.get_columns()
+
+        self.assertEqual(decoder.nRows, n)
+        for i in range(3):
+            self.assertEqual(decoded[i].dtype, columns[i].dtype)
+            self.assertTrue(numpy.all(decoded[i] == columns[i]))
+        self.assertEqual(decoded[3].shape, (n, 3))
+        self.assertTrue(numpy.all(decoded[3] == numpy.stack(columns[3:], axis=-1)))
+
+    def test_decode_null(self):
+        data = pgcopy.header + struct.pack(">hiq", 2, 8, 1) + struct.pack(">i", -1) + pgcopy.trailer
+        with self.assertRaises(RuntimeError):
+            pgcopy.decode(["int8", "float8"], data)
+
+    def test_formats_agree_with_sqltypes(self):
+        sizes = {"Boolean": "bool", "Smallint": "int2", "Integer": "int4",
+                 "Bigint": "int8", "Real": "float4", "Double precision": "float8"}
+        for dtype, sqltype in Field.dtypesToSQLType.items():
+            self.assertEqual(Field.dtypesToBinaryFormat[dtype], sizes[sqltype])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+import numpy
+
+from lib import pipe_printf, tsvformat
+
+class testPipePrintf(unittest.TestCase):
+
+    def setUp(self):
+        n = tsvformat.blockRows * 2 + 5
+        self.format = b"%ld\t%.8e\t%d\n"
+        self.columns = [
+            numpy.arange(n),
+            numpy.linspace(-1, 1, n, dtype=numpy.float32),
+            numpy.arange(n) % 3 == 0,
+        ]
+        self.expected = b"".join(self.format % tpl for tpl in zip(*self.columns))
+
+    def test_read(self):
+        pipe_printf.start(2)
+        for i in range(3):
+            with pipe_printf.open(self.format, *self.columns) as fin:
+                self.assertEqual(fin.read(), self.expected)
+
+    def test_close_early(self):
+        fin = pipe_printf.open(self.format, *self.columns)
+        fin.read(10)
+        fin.close()
+        # The worker must be usable again
+        with pipe_printf.open(self.format, *self.columns) as fin:
+            self.assertEqual(fin.read(), self.expected)
+
+    def test_error(self):
+        with self.assertRaises(RuntimeError):
+            with pipe_printf.open(b"%s\n", self.columns[0]) as fin:
+                fin.read()
+
+    def test_threads(self):
+        results = []
+        def job():
+            for i in range(3):
+                with pipe_printf.open(self.format, *self.columns) as fin:
+                    results.append(fin.read() == self.expected)
+
+        threads = [threading.Thread(target=job) for i in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(results, [True] * 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
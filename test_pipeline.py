@@ -0,0 +1,70 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from lib import pipeline
+
+class testPipeline(unittest.TestCase):
+
+    def test_order_and_failures(self):
+        done = []
+
+        def fail_on_3(x):
+            if x == 3:
+                raise ValueError("three")
+            return x * 10
+
+        stages = [("a", lambda x: x + 1, 1), ("b", fail_on_3, 1), ("c", done.append, 1)]
+        failures = pipeline.run(list(range(6)), stages)
+
+        self.assertEqual(done, [10, 20, 40, 50, 60])
+        self.assertEqual([(item, str(e)) for item, e in failures], [(2, "three")])
+
+    def test_memory_cap(self):
+        lock = threading.Lock()
+        inFlight = [0, 0]
+
+        def read(x):
+            with lock:
+                inFlight[0] += 1
+                inFlight[1] = max(inFlight[1], inFlight[0])
+            return x
+
+        def copy(x):
+            time.sleep(0.01)
+            with lock:
+                inFlight[0] -= 1
+
+        stages = [("read", read, 4), ("copy", copy, 1)]
+        failures = pipeline.run(list(range(20)), stages, queueSize=10,
+                                memoryCap=250, sizeof=lambda x: 100)
+
+        self.assertEqual(failures, [])
+        self.assertEqual(inFlight[0], 0)
+        self.assertLessEqual(inFlight[1], 2)
+
+    def test_oversized_item(self):
+        done = []
+        failures = pipeline.run([1, 2], [("a", done.append, 1)],
+                                memoryCap=10, sizeof=lambda x: 1000)
+        self.assertEqual((done, failures), ([1, 2], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+from lib import scan
+
+class testScan(unittest.TestCase):
+
+    def test_to_records(self):
+        # (name, type_code) as in cursor.description
+        description = [("objectid", 20), ("mag_i", 700), ("good", 16), ("band", 18), ("patch_s", 25)]
+        rows = [
+            (1, 20.5, True, "i", "3,5"),
+            (2, None, None, None, None),
+        ]
+        records = scan.to_records(description, rows)
+
+        self.assertEqual(records.dtype.names, ("objectid", "mag_i", "good", "band", "patch_s"))
+        self.assertEqual(records["objectid"].dtype, numpy.int64)
+        self.assertEqual(records["mag_i"].dtype, numpy.float32)
+        self.assertEqual(list(records["objectid"]), [1, 2])
+        self.assertTrue(numpy.isnan(records["mag_i"][1]))
+        self.assertEqual(list(records["good"]), [True, False])
+        self.assertEqual(list(records["band"]), [b"i", b""])
+        self.assertEqual(list(records["patch_s"]), ["3,5", None])
+
+    def test_predicate(self):
+        self.assertEqual(scan.get_predicate("tract", 4023, "objectid"),
+                         "public.tractSearch(objectid, 4023)")
+        # (4023 << 42) | (3 << 37) | (5 << 32), and the next patch
+        self.assertEqual(scan.get_predicate("patch", 40230305, "object_id"),
+                         "object_id >= 17693774905868288 AND object_id < 17693779200835584")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib import pgcopy
+from lib.sink import Sink
+
+class testSink(unittest.TestCase):
+
+    def test_null(self):
+        sink = Sink()
+        with sink.cursor() as cursor:
+            cursor.execute("CREATE TABLE whatever ()")
+            cursor.copy_from(io.BytesIO(b"1\t2\n3\t4\n"), '"schema"."table"', sep='\t', size=-1)
+            cursor.copy_from(io.BytesIO(b"5\t6\n"), '"schema"."table"', sep='\t', size=-1)
+        sink.commit()
+
+        self.assertEqual(list(sink.stats), ["table"])
+        nCopies, nRows, nBytes, seconds = sink.stats["table"]
+        self.assertEqual((nCopies, nRows, nBytes), (2, 3, 12))
+        self.assertEqual(len(sink.report(1.0)), 2)
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            sink = Sink(directory)
+            columns = [numpy.arange(5, dtype=numpy.int64)]
+            pgcopy.copy_binary(sink, '"schema"."table"', ["object_id"], ["int8"], columns)
+
+            self.assertEqual(sink.stats["table"][:2], [1, 5])
+            with open(os.path.join(directory, "table-000000.bin"), "rb") as f:
+                self.assertEqual(f.read(), b"".join(pgcopy.encode(["int8"], columns)))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+from lib import spatialsort
+
+class testSpatialSort(unittest.TestCase):
+
+    def test_hilbert(self):
+        # Successive cells of the Hilbert curve are adjacent
+        bits = 3
+        n = 1 << bits
+        grid = numpy.indices((n, n, n)).reshape(3, -1).astype(numpy.int64)
+        key = spatialsort._hilbert([axis.copy() for axis in grid], bits)
+
+        self.assertEqual(sorted(key), list(range(n**3)))
+        steps = numpy.abs(numpy.diff(grid[:, numpy.argsort(key)], axis=1)).sum(axis=0)
+        self.assertTrue(numpy.all(steps == 1))
+
+    def test_order(self):
+        rng = numpy.random.RandomState(0)
+        ra = rng.uniform(0, 360, size=1000)
+        dec = rng.uniform(-90, 90, size=1000)
+        ra[3] = numpy.nan
+
+        for curve in spatialsort.curves:
+            order = spatialsort.get_order(ra, dec, curve)
+            self.assertEqual(sorted(order), list(range(1000)))
+            self.assertEqual(order[-1], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib import common
+from lib import partition
+from lib import synthetic
+from lib.assumptions import Assumptions
+from lib.forcedsource_finder import ForcedSourceFinder
+from lib.sourcetable import SourceTable
+
+class testSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        common._coaddManifests.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_rerun(self):
+        rerunDir = os.path.join(self.tmpdir, "rerun")
+        synthetic.make_rerun(rerunDir, tracts=[3830], patches=[0, 101], bands=["g", "r"],
+                             nObjects=100, compress=True)
+
+        self.assertEqual(common.get_existing_filters(rerunDir), ["g", "r"])
+        self.assertEqual(common.get_existing_tracts(rerunDir), [3830])
+
+        path = "{}/deepCoadd-results/merged/3830/1,1/ref-3830-1,1.fits".format(rerunDir)
+        table = SourceTable.from_fits(path)
+        self.assertEqual(table.dm_schema_version(), 3)
+        object_id = table.fields["id"].data
+        lower, upper = partition.get_patch_bounds(3830, 101)
+        self.assertTrue(numpy.all((lower <= object_id) & (object_id < upper)))
+        self.assertEqual(table.fields["detect_isPrimary"].data.dtype, numpy.bool_)
+        self.assertEqual(table.fields["base_PsfFlux_instFlux"].type, "Scalar")
+
+    def test_visits(self):
+        synthetic.make_visits(self.tmpdir, visits=[1, 2], bands=["r", "i"],
+                              rafts=["22"], sensors=["00", "11"], nSources=300)
+        finder = ForcedSourceFinder(self.tmpdir)
+        self.assertEqual(finder.get_visits(), [1, 2])
+        paths = finder.get_visit_files(2)
+        self.assertEqual(len(paths), 2)
+
+        assumptions = Assumptions(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                               "config", "forced_source_assumptions.yaml"))
+        raw = SourceTable.from_fits(paths[0], assumptions.get_field_filter())
+        tables = assumptions.apply(raw, "schema", **finder.get_determiner_dict(paths[0]))
+        dbimage = tables["forcedsourcenative"]
+        dbimage.transform()
+        names = [name for name, fmt, columns in dbimage.get_backend_field_binary("")]
+        self.assertIn("objectId", names)
+        self.assertIn("forcedsourcevisit_good", names)
+
+
+if __name__ == '__main__':
+    unittest.main()
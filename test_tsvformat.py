@@ -0,0 +1,67 @@
+# Copyright (C) 2019  LSST Dark Energy Science Collaboration (DESC)
+#
+# This file is part of the project DC2-PostgreSQL
+# DC2-PostgreSQL is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+from lib import tsvformat
+from lib.sourcetable import Field, Field_earth
+
+class testTsvformat(unittest.TestCase):
+
+    def assertSameAsPrintf(self, format, columns):
+        expected = b"".join(format % tpl for tpl in zip(*columns))
+        self.assertEqual(b"".join(tsvformat.encode(format, columns)), expected)
+
+    def test_print_formats(self):
+        rng = numpy.random.RandomState(1)
+        n = tsvformat.blockRows + 100
+        columns = [
+            Field("", "", "", rng.randint(0, 2, size=n).astype(bool), "", None),
+            Field("", "", "", rng.randint(-2**63, 2**63 - 1, size=n, dtype=numpy.int64), "", None),
+            Field("", "", "", rng.randint(0, 2**16, size=n).astype(">u2"), "", None),
+            Field("", "", "", rng.randint(-2**31, 2**31, size=n).astype(">i4"), "", None),
+            Field("", "", "", rng.randint(0, 2**32, size=n, dtype=numpy.uint64).astype(numpy.uint32).view(">f4"), "", None),
+            Field("", "", "", rng.randint(0, 2**63, size=n, dtype=numpy.int64).view(numpy.float64), "", None),
+        ]
+
+        format = "\t".join(field.get_print_format() for field in columns) + "\n"
+        self.assertSameAsPrintf(format.encode("utf-8"), [field.data for field in columns])
+
+    def test_special_values(self):
+        values = [0.0, -0.0, numpy.nan, -numpy.nan, numpy.inf, -numpy.inf,
+                  0.5, 9.5, 1.25e-5, 9.9999999999999999e22, 1e-320, 1.7976931348623157e308]
+        f64 = numpy.array(values, dtype=numpy.float64)
+        with numpy.errstate(over="ignore"):
+            f32 = f64.astype(numpy.float32)
+
+        self.assertSameAsPrintf(b"%.16e\t%.8e\n", [f64, f32])
+
+    def test_earth(self):
+        field = Field_earth.from_radec("coord", numpy.array([0.1, 0.2, 3.0]), numpy.array([-0.3, 0.4, 1.5]))
+        format = ("%ld\t" + field.get_print_format() + "\n").encode("utf-8")
+        columns = [numpy.arange(3)] + field.get_columns()
+
+        self.assertSameAsPrintf(format, columns)
+
+    def test_generic(self):
+        # Conversions that are not vectorized
+        self.assertSameAsPrintf(b"%.20e\t%d\n", [numpy.array([0.1, -2.5]), numpy.array([1.5, -2.5])])
+
+
+if __name__ == '__main__':
+    unittest.main()